@@ -1,62 +1,134 @@
 import os
 import json
 import re
+import threading
 import time
-from google import genai
-from google.genai import types
-from dotenv import load_dotenv
-
-load_dotenv()
-
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-
-def scan_receipt_with_gemini(image_bytes: bytes):
-    # Liste des noms de modèles à essayer par ordre de priorité
-    # gemini-flash-latest est souvent le nom 'alias' qui fonctionne sur le Tier Gratuit
-    model_candidates = ['gemini-1.5-flash', 'gemini-flash-latest', 'gemini-1.5-flash-002']
-    
-    last_error = None
-
-    for model_name in model_candidates:
-        try:
-            print(f"--- Tentative avec le modèle : {model_name} ---")
-            
-            prompt = """
-            Analyze this grocery receipt. Extract all food items. 
+from services import coldstart, metrics
+
+# Fournisseur IA : "gemini" (Google GenAI) ou "fake" (sans réseau, pour les tests et le banc).
+# Le client n'est construit qu'au premier scan (ou au préchauffage) : importer `google.genai`
+# coûte à lui seul une bonne part du démarrage à froid.
+AI_PROVIDER = os.getenv("AI_PROVIDER") or ("fake" if os.getenv("GEMINI_FAKE") else "gemini")
+
+# Liste des noms de modèles à essayer par ordre de priorité
+# gemini-flash-latest est souvent le nom 'alias' qui fonctionne sur le Tier Gratuit
+MODEL_CANDIDATES = ['gemini-1.5-flash', 'gemini-flash-latest', 'gemini-1.5-flash-002']
+
+# Attente avant de passer au modèle suivant après une erreur de quota (429)
+QUOTA_RETRY_DELAY = 2
+
+# A incrémenter à chaque changement du prompt ou du parsing (invalide le cache des scans)
+PROMPT_VERSION = "1"
+PROMPT = """
+            Analyze this grocery receipt. Extract all food items.
             Return ONLY a JSON array of objects:
             [{"name": "string", "quantity": number, "unit": "string"}].
-            Normalize units to 'kg', 'g', 'l', or 'unit'. 
+            Normalize units to 'kg', 'g', 'l', or 'unit'.
             Return ONLY the raw JSON.
             """
 
-            response = client.models.generate_content(
-                model=model_name,
-                contents=[
-                    prompt,
-                    types.Part.from_bytes(data=image_bytes, mime_type='image/jpeg')
-                ]
-            )
-
-            text = response.text
-            # Nettoyage JSON
-            text = text.replace('```json', '').replace('```', '').strip()
-            match = re.search(r'\[.*\]', text, re.DOTALL)
-            
-            if match:
-                return json.loads(match.group(0))
-            return json.loads(text)
-
-        except Exception as e:
-            last_error = e
-            error_msg = str(e)
-            print(f"Échec avec {model_name}: {error_msg[:100]}...")
-            
-            # Si c'est une erreur de quota (429), on attend 2 secondes et on change de modèle
-            if "429" in error_msg:
-                time.sleep(2)
-            # On continue la boucle pour essayer le modèle suivant
-            continue
-
-    # Si on arrive ici, aucun modèle n'a fonctionné
-    print(f"ERREUR FATALE AI : Aucun modèle n'a répondu favorablement.")
-    raise last_error
\ No newline at end of file
+
+# --- FOURNISSEURS ---
+# Un fournisseur expose generate(model, prompt, image_bytes) -> texte brut de la réponse
+PROVIDERS = {}
+
+
+def provider(name: str):
+    def register(factory):
+        PROVIDERS[name] = factory
+        return factory
+    return register
+
+
+@provider("gemini")
+class GeminiProvider:
+    def __init__(self):
+        from dotenv import load_dotenv
+        from google import genai
+        from google.genai import types
+        load_dotenv()
+        self.types = types
+        self.client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
+    def generate(self, model, prompt, image_bytes):
+        response = self.client.models.generate_content(
+            model=model,
+            contents=[prompt, self.types.Part.from_bytes(data=image_bytes, mime_type='image/jpeg')]
+        )
+        return response.text
+
+
+@provider("fake")
+class FakeGeminiClient:
+    """
+    Remplace Gemini sans appel réseau. `failures` associe un nom de modèle
+    à l'exception levée pour ce modèle (ex: Exception("429 RESOURCE_EXHAUSTED")).
+    """
+    def __init__(self, items=None, failures=None, latency: float = 0.0):
+        self.items = items if items is not None else [{"name": "Tomate", "quantity": 1, "unit": "kg"}]
+        self.failures = failures or {}
+        self.latency = latency
+        self.calls = []
+
+    def generate(self, model, prompt, image_bytes):
+        self.calls.append(model)
+        if self.latency:
+            time.sleep(self.latency)
+        if model in self.failures:
+            raise self.failures[model]
+        return "```json\n" + json.dumps(self.items) + "\n```"
+
+
+if AI_PROVIDER not in PROVIDERS:
+    raise ValueError(f"AI_PROVIDER inconnu : {AI_PROVIDER} (attendu : {', '.join(PROVIDERS)})")
+
+client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Fournisseur courant, construit au premier appel."""
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                with coldstart.phase(f"ai:{AI_PROVIDER}"):
+                    client = PROVIDERS[AI_PROVIDER]()
+    return client
+
+
+def set_client(new_client):
+    global client
+    client = new_client
+
+
+def warm_up():
+    # Préchauffage optionnel (STARTUP_WARMUP=ai) : le premier scan ne paie plus l'import du SDK
+    try:
+        get_client()
+    except Exception as e:
+        print(f"Préchauffage IA impossible : {e}")
+
+
+def is_quota_error(error: Exception) -> bool:
+    return "429" in str(error)
+
+def parse_receipt_text(text: str):
+    # Nettoyage JSON
+    text = text.replace('```json', '').replace('```', '').strip()
+    match = re.search(r'\[.*\]', text, re.DOTALL)
+
+    if match:
+        return json.loads(match.group(0))
+    return json.loads(text)
+
+def call_model(model_name: str, image_bytes: bytes):
+    """Une tentative sur un seul modèle (appel bloquant), chronométrée par modèle."""
+    started = time.perf_counter()
+    ok = False
+    try:
+        result = parse_receipt_text(get_client().generate(model_name, PROMPT, image_bytes))
+        ok = True
+        return result
+    finally:
+        metrics.registry.record_ai_call(model_name, ok, time.perf_counter() - started)
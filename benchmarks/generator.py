@@ -0,0 +1,97 @@
+import random
+from datetime import date, timedelta
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from models import Ingredient, MealPlan, PantryItem, Recipe, RecipeIngredient, ShoppingList, WeeklyStaple
+from services import demand_logic, inventory_logic, units
+
+# --- ÉCHELLES PRÉDÉFINIES ---
+SCALES = {
+    "small": {"ingredients": 2000, "recipes": 400, "lines": (3, 10), "meal_plans": 150,
+              "pantry": 600, "staples": 40, "shopping": 300},
+    "medium": {"ingredients": 10000, "recipes": 2000, "lines": (3, 12), "meal_plans": 600,
+               "pantry": 4000, "staples": 150, "shopping": 1500},
+    "large": {"ingredients": 50000, "recipes": 10000, "lines": (3, 12), "meal_plans": 2000,
+              "pantry": 20000, "staples": 500, "shopping": 5000},
+}
+
+WORDS = [
+    "Tomate", "Oignon", "Carotte", "Poireau", "Courgette", "Poivron", "Farine", "Sucre", "Lait",
+    "Beurre", "Crème", "Œuf", "Riz", "Pâtes", "Lentilles", "Pois chiches", "Huile d'olive",
+    "Vinaigre", "Moutarde", "Ail", "Échalote", "Persil", "Basilic", "Thym", "Poulet", "Bœuf",
+    "Saumon", "Cabillaud", "Fromage râpé", "Yaourt", "Pomme", "Poire", "Citron", "Orange",
+]
+QUALIFIERS = ["bio", "frais", "surgelé", "en conserve", "entier", "demi-écrémé", "rouge", "vert", "jaune", "fumé"]
+UNIT_CHOICES = {"g": ["g", "kg"], "kg": ["g", "kg"], "ml": ["ml", "cl", "l", "cs"], "l": ["ml", "cl", "l"],
+                "unit": ["unit", "pièce"]}
+SLOTS = ["LUNCH", "DINNER"]
+CHUNK = 5000
+
+
+def _insert(db: Session, model, rows):
+    for i in range(0, len(rows), CHUNK):
+        # Sur la table : les None restent des NULL (quantités canoniques remplies ensuite)
+        db.execute(insert(model.__table__), rows[i:i + CHUNK])
+
+
+def generate(db: Session, scale="small", seed: int = 42) -> dict:
+    """
+    Remplit une base vide avec un jeu de données déterministe (même graine = mêmes lignes).
+    `scale` est un nom de SCALES ou un dictionnaire de mêmes clés.
+    Retourne les volumes créés.
+    """
+    sizes = SCALES[scale] if isinstance(scale, str) else scale
+    rng = random.Random(seed)
+
+    ingredients = []
+    for i in range(1, sizes["ingredients"] + 1):
+        unit = rng.choice(list(UNIT_CHOICES))
+        ingredients.append({
+            "id": i,
+            "name": f"{rng.choice(WORDS)} {rng.choice(QUALIFIERS)} {i}",
+            "category": rng.choice(["Légumes", "Épicerie", "Frais", "Viande", "Fruits"]),
+            "unit": unit,
+            "density": round(rng.uniform(0.5, 1.5), 2) if unit in ("ml", "l") else None,
+            "piece_weight": round(rng.uniform(20, 400), 1) if unit == "unit" else None,
+        })
+    _insert(db, Ingredient, ingredients)
+
+    recipes, lines = [], []
+    low, high = sizes["lines"]
+    for i in range(1, sizes["recipes"] + 1):
+        recipes.append({"id": i, "name": f"Recette {i}", "instructions": "Mélanger puis cuire."})
+        for ing in rng.sample(ingredients, rng.randint(low, high)):
+            lines.append({
+                "recipe_id": i, "ingredient_id": ing["id"],
+                "quantity_required": round(rng.uniform(0.1, 500), 2),
+                "unit": rng.choice(UNIT_CHOICES[ing["unit"]]),
+            })
+    _insert(db, Recipe, recipes)
+    _insert(db, RecipeIngredient, lines)
+
+    today = date.today()
+    _insert(db, MealPlan, [
+        {"id": i, "date": today + timedelta(days=rng.randrange(14)), "slot": rng.choice(SLOTS),
+         "recipe_id": rng.randint(1, sizes["recipes"])}
+        for i in range(1, sizes["meal_plans"] + 1)
+    ])
+    _insert(db, PantryItem, [
+        {"ingredient_id": ing["id"], "quantity_available": round(rng.uniform(0.5, 50), 2), "quantity_canonical": None}
+        for ing in rng.sample(ingredients, sizes["pantry"])
+    ])
+    _insert(db, WeeklyStaple, [
+        {"ingredient_id": ing["id"], "default_quantity": round(rng.uniform(1, 5), 1)}
+        for ing in rng.sample(ingredients, sizes["staples"])
+    ])
+    _insert(db, ShoppingList, [
+        {"id": i, "ingredient_id": rng.randint(1, sizes["ingredients"]),
+         "quantity_needed": round(rng.uniform(1, 10), 1), "is_checked": False, "source": "MANUAL"}
+        for i in range(1, sizes["shopping"] + 1)
+    ])
+
+    # Mêmes étapes que le démarrage de l'API : quantités canoniques, lots du stock, demande agrégée
+    units.backfill_canonical(db)
+    inventory_logic.reconcile_lots(db)
+    demand_logic.rebuild_demand(db)
+    db.commit()
+    return {**{k: v for k, v in sizes.items() if k != "lines"}, "recipe_lines": len(lines)}
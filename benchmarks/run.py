@@ -0,0 +1,201 @@
+"""
+Banc de performance reproductible.
+
+    python -m benchmarks.run --scale small --iterations 50
+    python -m benchmarks.run --scale small --update-baseline
+
+Les données sont générées dans une base SQLite temporaire (graine fixe), l'API est
+appelée en mémoire (httpx + ASGITransport) avec le client Gemini factice, et le rapport
+JSON (débit, p50/p99, requêtes SQL par opération) est comparé à benchmarks/baseline.json.
+Code de sortie 1 si un scénario régresse au-delà des seuils.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def _prepare_environment(workdir: str):
+    # Avant tout import de `database` / `main` : ils lisent ces variables au chargement
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["SCAN_CACHE_PATH"] = os.path.join(workdir, "scan_cache.db")
+    os.environ["GEMINI_FAKE"] = "1"
+    os.chdir(workdir)
+
+
+# --- COMPTAGE DES REQUÊTES SQL ---
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def install(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        # Écouteur sur la classe : moteurs synchrones et asynchrones (aiosqlite) confondus
+        event.listen(Engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+# --- STATISTIQUES ---
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, queries, elapsed) -> dict:
+    latencies = sorted(latencies)
+    ops = len(latencies)
+    return {
+        "ops": ops,
+        "throughput_ops_s": round(ops / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "queries_per_op": round(queries / ops, 2) if ops else 0.0,
+    }
+
+
+async def run_scenarios(names, iterations: int, warmup: int, state: dict, seed: int, counter: QueryCounter):
+    import httpx
+    import main
+    from benchmarks.scenarios import SCENARIOS
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in names:
+                op = SCENARIOS[name]
+                rng = random.Random(f"{seed}:{name}")
+                try:
+                    for _ in range(warmup):
+                        await op(client, state, rng)
+                    latencies, queries = [], 0
+                    started = time.perf_counter()
+                    for _ in range(iterations):
+                        before, t0 = counter.count, time.perf_counter()
+                        await op(client, state, rng)
+                        latencies.append(time.perf_counter() - t0)
+                        queries += counter.count - before
+                except IndexError:
+                    # Plus de plans à cuisiner ou d'articles à passer en stock à cette échelle
+                    pass
+                elapsed = time.perf_counter() - started if latencies else 0.0
+                results[name] = summarize(latencies, queries, elapsed)
+                print(f"{name:22s} {json.dumps(results[name])}", file=sys.stderr)
+    return results
+
+
+# --- COMPARAISON AVEC LA RÉFÉRENCE ---
+def compare(report: dict, baseline: dict, latency_threshold: float, query_threshold: float):
+    """Liste des régressions : latence p50 / débit au-delà du seuil relatif, ou plus de requêtes SQL."""
+    regressions = []
+    if baseline.get("meta", {}).get("scale") != report["meta"]["scale"]:
+        return [f"référence mesurée à l'échelle {baseline.get('meta', {}).get('scale')!r}, comparaison ignorée"], False
+    for name, current in report["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if not reference or not current["ops"]:
+            continue
+        if current["p50_ms"] > reference["p50_ms"] * (1 + latency_threshold):
+            regressions.append(f"{name}: p50 {reference['p50_ms']} -> {current['p50_ms']} ms")
+        if current["throughput_ops_s"] < reference["throughput_ops_s"] * (1 - latency_threshold):
+            regressions.append(f"{name}: débit {reference['throughput_ops_s']} -> {current['throughput_ops_s']} op/s")
+        if current["queries_per_op"] > reference["queries_per_op"] * (1 + query_threshold):
+            regressions.append(f"{name}: requêtes/op {reference['queries_per_op']} -> {current['queries_per_op']}")
+    return regressions, True
+
+
+def main(argv=None):
+    from benchmarks.scenarios import SCENARIOS
+
+    parser = argparse.ArgumentParser(description="Banc de performance de l'API Kitchen Logistics")
+    parser.add_argument("--scale", default="small", help="small, medium ou large")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="liste séparée par des virgules")
+    parser.add_argument("--output", help="fichier du rapport JSON (sinon sortie standard)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="remplace la référence par ce rapport")
+    parser.add_argument("--latency-threshold", type=float, default=0.25, help="régression relative tolérée (p50, débit)")
+    parser.add_argument("--query-threshold", type=float, default=0.0, help="hausse relative tolérée des requêtes/op")
+    args = parser.parse_args(argv)
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"scénarios inconnus : {', '.join(sorted(unknown))}")
+
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    baseline_path = os.path.abspath(args.baseline)
+    output_path = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="kitchen-bench-")
+    _prepare_environment(workdir)
+    sys.path.insert(0, repo_root)
+
+    import database
+    from sqlalchemy import select
+    from models import Ingredient
+    from benchmarks.generator import generate
+
+    database.sync_schema()
+    db = database.SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        sizes = generate(db, args.scale, args.seed)
+        print(f"Données générées en {time.perf_counter() - t0:.1f}s : {sizes}", file=sys.stderr)
+        names_rows = db.execute(select(Ingredient.name).order_by(Ingredient.id).limit(5000)).scalars().all()
+    finally:
+        db.close()
+
+    rng = random.Random(args.seed)
+    plan_ids = list(range(1, sizes["meal_plans"] + 1))
+    shopping_ids = list(range(1, sizes["shopping"] + 1))
+    rng.shuffle(plan_ids)
+    rng.shuffle(shopping_ids)
+    state = {"ingredient_names": names_rows, "recipes": sizes["recipes"],
+             "plan_ids": plan_ids, "shopping_ids": shopping_ids}
+
+    counter = QueryCounter()
+    counter.install()
+    scenarios = asyncio.run(run_scenarios(names, args.iterations, args.warmup, state, args.seed, counter))
+
+    report = {
+        "meta": {"scale": args.scale, "seed": args.seed, "iterations": args.iterations, "sizes": sizes,
+                 "python": sys.version.split()[0]},
+        "scenarios": scenarios,
+    }
+    rendered = json.dumps(report, indent=2, ensure_ascii=False)
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(rendered + "\n")
+    else:
+        print(rendered)
+
+    if args.update_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            f.write(rendered + "\n")
+        print(f"Référence mise à jour : {baseline_path}", file=sys.stderr)
+        return 0
+    if not os.path.exists(baseline_path):
+        print("Aucune référence : comparaison ignorée.", file=sys.stderr)
+        return 0
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions, compared = compare(report, baseline, args.latency_threshold, args.query_threshold)
+    for line in regressions:
+        print(f"RÉGRESSION {line}" if compared else line, file=sys.stderr)
+    return 1 if compared and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import asyncio
+import random
+from datetime import date, timedelta
+from services import read_cache
+
+# Chaque scénario est une coroutine `op(client, state, rng)` exécutant une opération
+# utilisateur (une ou plusieurs requêtes) ; `state` porte les IDs générés et consommés.
+
+
+def _check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.method} {response.request.url.path} -> "
+                           f"{response.status_code} {response.text[:200]}")
+    return response
+
+
+def _cold(path):
+    # Liste recalculée à chaque appel : mesure la requête et la sérialisation, pas le cache
+    async def op(client, state, rng):
+        read_cache.cache.clear()
+        _check(await client.get(path))
+    return op
+
+
+async def list_recipes_cached(client, state, rng):
+    _check(await client.get("/api/recipes?limit=200"))
+
+
+async def search_ingredients(client, state, rng):
+    prefix = rng.choice(["tom", "oign", "far", "beur", "poul", "crem", "tomatte", "pom"])
+    _check(await client.get(f"/api/ingredients/search?q={prefix}"))
+
+
+async def suggestions(client, state, rng):
+    _check(await client.get("/api/recipes/suggestions?limit=20"))
+
+
+async def pantry_bulk(client, state, rng):
+    items = [{"name": rng.choice(state["ingredient_names"]), "quantity": rng.randint(1, 5), "unit": "kg"}
+             for _ in range(48)]
+    items += [{"name": f"Nouveau produit {rng.getrandbits(32):08x}", "quantity": 1, "unit": "unit"} for _ in range(2)]
+    _check(await client.post("/api/pantry/bulk", json=items))
+
+
+def _recipe_payload(state, rng, name):
+    return {
+        "name": name,
+        "instructions": "Cuire doucement.",
+        "ingredients": [
+            {"name": rng.choice(state["ingredient_names"]), "quantity": rng.randint(50, 500), "unit": "g"}
+            for _ in range(8)
+        ],
+    }
+
+
+async def recipe_create(client, state, rng):
+    _check(await client.post("/api/recipes", json=_recipe_payload(state, rng, f"Banc {rng.getrandbits(128):032x}")))
+
+
+async def recipe_update(client, state, rng):
+    recipe_id = rng.randint(1, state["recipes"])
+    _check(await client.put(f"/api/recipes/{recipe_id}",
+                            json=_recipe_payload(state, rng, f"Recette modifiée {recipe_id}")))
+
+
+async def recipe_patch(client, state, rng):
+    # Correction des seules instructions : aucune ligne d'ingrédient réécrite
+    recipe_id = rng.randint(1, state["recipes"])
+    _check(await client.patch(f"/api/recipes/{recipe_id}", json={"instructions": f"Cuire {rng.randint(5, 60)} min."}))
+
+
+async def shopping_generate(client, state, rng):
+    _check(await client.post("/api/shopping-list/generate"))
+
+
+async def shopping_generate_week(client, state, rng):
+    today = date.today()
+    _check(await client.post(f"/api/shopping-list/generate?from={today}&to={today + timedelta(days=6)}"))
+
+
+def _week_plans(path):
+    async def op(client, state, rng):
+        read_cache.cache.clear()
+        today = date.today()
+        _check(await client.get(f"{path}?from={today}&to={today + timedelta(days=6)}"))
+    return op
+
+
+async def cook(client, state, rng):
+    plan_id = state["plan_ids"].pop()
+    _check(await client.post(f"/api/meal-plan/{plan_id}/cook"))
+
+
+async def checkout(client, state, rng):
+    ids = [state["shopping_ids"].pop() for _ in range(5)]
+    _check(await client.post("/api/shopping-list/checkout-batch", json={"item_ids": ids}))
+
+
+async def scan_receipt(client, state, rng):
+    # Image unique à chaque fois (tirée du rng du scénario) : pas de réponse servie par le cache des scans
+    image = rng.randbytes(16)
+    job = _check(await client.post("/api/scan-receipt", files={"file": ("ticket.jpg", image, "image/jpeg")})).json()
+    while job["status"] not in ("done", "error"):
+        await asyncio.sleep(0.001)
+        job = _check(await client.get(f"/api/scan-receipt/{job['id']}")).json()
+
+
+SCENARIOS = {
+    "list_ingredients": _cold("/api/ingredients?limit=500"),
+    "list_recipes": _cold("/api/recipes?limit=200"),
+    "list_recipes_cached": list_recipes_cached,
+    "list_meal_plan": _cold("/api/meal-plan"),
+    "list_meal_plan_week": _week_plans("/api/meal-plan"),
+    "list_pantry": _cold("/api/pantry?limit=500"),
+    "search_ingredients": search_ingredients,
+    "suggestions": suggestions,
+    "pantry_bulk": pantry_bulk,
+    "recipe_create": recipe_create,
+    "recipe_update": recipe_update,
+    "recipe_patch": recipe_patch,
+    "shopping_generate": shopping_generate,
+    "shopping_generate_week": shopping_generate_week,
+    "cook": cook,
+    "checkout": checkout,
+    "scan_receipt": scan_receipt,
+}
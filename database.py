@@ -1,15 +1,474 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from fastapi import Depends, HTTPException, Request
+from collections import OrderedDict
+from contextvars import ContextVar
+import asyncio
+import json
 import os
+import re
+import threading
+import time
 from dotenv import load_dotenv
+from services import coldstart
 
 load_dotenv()
-engine = create_engine("sqlite:///./kitchen.db", connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# --- CONFIGURATION DU STOCKAGE ---
+# SQLite par défaut ; une URL postgresql+psycopg://... active le pool de connexions
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./kitchen.db")
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",          # lecteurs non bloqués par l'écrivain
+    "synchronous": "NORMAL",        # fsync au checkpoint seulement (sûr en WAL)
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # négatif = en Kio
+    "temp_store": "MEMORY",
+}
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# --- CUISINES (FOYERS) ---
+# Chaque cuisine a sa propre base : un fichier SQLite (un verrou d'écriture par foyer)
+# ou un schéma sur un Postgres partagé (KITCHEN_SCHEMA, ex. "kitchen_{kitchen}").
+# La cuisine par défaut reste sur DATABASE_URL ; shards.json peut déplacer n'importe laquelle.
+KITCHEN_HEADER = "X-Kitchen-Id"
+DEFAULT_KITCHEN = os.getenv("DEFAULT_KITCHEN", "default")
+KITCHEN_DATABASE_URL = os.getenv("KITCHEN_DATABASE_URL", "sqlite:///./kitchens/{kitchen}.db")
+KITCHEN_SCHEMA = os.getenv("KITCHEN_SCHEMA", "")
+SHARD_MAP_PATH = os.getenv("SHARD_MAP_PATH", "./kitchens/shards.json")
+SHARD_MAP_TTL = float(os.getenv("SHARD_MAP_TTL", "5"))        # secondes entre deux relectures
+SHARD_CACHE_SIZE = int(os.getenv("SHARD_CACHE_SIZE", "64"))    # cuisines ouvertes par processus
+KITCHEN_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+# Clé de Session.info : cuisine de la session (posée par le sessionmaker du shard)
+KITCHEN_KEY = "kitchen"
+
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def make_engine(url: str = DATABASE_URL):
+    if is_sqlite(url):
+        new_engine = create_engine(
+            url, connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        )
+        event.listen(new_engine, "connect", _apply_sqlite_pragmas)
+        return new_engine
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+# --- ACCÈS ASYNCHRONE (endpoints async def) ---
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+def async_url(url: str) -> str:
+    """Même base que `url`, avec le driver asyncio correspondant (aiosqlite / asyncpg)."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"Pas de driver asynchrone connu pour {backend}")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+def make_async_engine(url: str = DATABASE_URL):
+    if is_sqlite(url):
+        new_engine = create_async_engine(
+            async_url(url), connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        )
+        event.listen(new_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+        return new_engine
+    return create_async_engine(
+        async_url(url),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+# Moteurs de la cuisine par défaut (DATABASE_URL), aussi utilisés par les outils
+engine = make_engine()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, info={KITCHEN_KEY: DEFAULT_KITCHEN})
+async_engine = make_async_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False,
+                                       info={KITCHEN_KEY: DEFAULT_KITCHEN})
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+def bind_schema(bind):
+    # Schéma Postgres de la cuisine (schema_translate_map du moteur), None sinon
+    return (bind.get_execution_options().get("schema_translate_map") or {}).get(None)
+
+def qualified(bind, name: str) -> str:
+    # Nom qualifié pour le SQL textuel, que schema_translate_map ne réécrit pas
+    schema = bind_schema(bind)
+    return f'"{schema}".{name}' if schema else name
+
+def sync_schema(bind=None, attempts: int = 3):
+    """
+    Crée les tables manquantes, puis les colonnes (nullables) et index ajoutés
+    depuis leur création (create_all ne touche pas aux tables déjà présentes).
+    """
+    bind = bind or engine
+    for attempt in range(attempts):
+        try:
+            return _sync_schema(bind)
+        except (OperationalError, ProgrammingError) as e:
+            # Autre worker initialisant la même base au même moment : la passe suivante voit ses tables
+            if not any(s in str(e) for s in ("already exists", "duplicate column")) or attempt == attempts - 1:
+                raise
+
+def _sync_schema(bind):
+    Base.metadata.create_all(bind=bind)
+    inspector = inspect(bind)
+    schema = bind_schema(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name, schema=schema)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f'ALTER TABLE {qualified(bind, table.name)} '
+                                      f'ADD COLUMN "{column.name}" {column_type}'))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+def dialect_insert(db, table):
+    # INSERT avec support ON CONFLICT (upsert) selon le moteur de la session
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+# --- ROUTAGE DES CUISINES VERS LEUR SHARD ---
+current_kitchen: ContextVar = ContextVar("kitchen", default=DEFAULT_KITCHEN)
+
+def session_kitchen(session) -> str:
+    return session.info.get(KITCHEN_KEY, DEFAULT_KITCHEN)
+
+class ShardMoving(Exception):
+    """Cuisine en cours de déplacement vers un autre shard (écritures suspendues)."""
+
+class Shard:
+    """Moteurs et fabriques de sessions d'une cuisine, ouverts et initialisés à la demande."""
+    def __init__(self, router, kitchen: str, url: str, schema: str):
+        self.router = router
+        self.kitchen = kitchen
+        self.url = url
+        self.schema = schema
+        self.engine = None
+        self.sessionmaker = None
+        self.async_engine = None
+        self._async = None
+        self._lock = threading.Lock()
+
+    @property
+    def location(self):
+        return (self.url, self.schema)
+
+    def open(self):
+        with self._lock:
+            if self.engine is not None:
+                return self
+            self.engine = self.router.engine_for(self.url, self.schema)
+            self.sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=self.engine,
+                                             info={KITCHEN_KEY: self.kitchen})
+            # Schéma et migrations une fois par processus et par emplacement (pas à chaque réouverture)
+            if self.location not in self.router.bootstrapped:
+                for hook in self.router.open_hooks:
+                    with coldstart.phase(f"open:{hook.__module__}.{hook.__name__}"):
+                        hook(self)
+                self.router.bootstrapped.add(self.location)
+        return self
+
+    def async_sessionmaker(self):
+        with self._lock:
+            if self._async is None:
+                self.async_engine = self.router.async_engine_for(self.url, self.schema)
+                self._async = async_sessionmaker(self.async_engine, class_=AsyncSession, autoflush=False,
+                                                 expire_on_commit=False, info={KITCHEN_KEY: self.kitchen})
+        return self._async
+
+    def close(self):
+        # Libère les fichiers d'une cuisine SQLite inactive (les moteurs Postgres sont partagés)
+        if self.schema or self.url == DATABASE_URL:
+            return
+        if self.engine is not None:
+            self.engine.dispose()
+        if self.async_engine is not None:
+            dispose = self.async_engine.dispose()
+            try:
+                asyncio.get_running_loop().create_task(dispose)
+            except RuntimeError:
+                asyncio.run(dispose)
+
+
+class ShardRouter:
+    """
+    Cuisine -> emplacement (URL, schéma) : entrée de shards.json si elle existe,
+    sinon KITCHEN_DATABASE_URL / KITCHEN_SCHEMA. Les shards ouverts sont gardés dans
+    un cache LRU de SHARD_CACHE_SIZE entrées ; une cuisine évincée ferme ses fichiers.
+    Une requête ne crée jamais de cuisine (voir exists) : `python -m services.shards create`.
+    """
+    def __init__(self, capacity: int = SHARD_CACHE_SIZE, map_path: str = SHARD_MAP_PATH):
+        self.capacity = capacity
+        self.map_path = map_path
+        self.open_hooks = []       # hook(shard) à la première ouverture d'un emplacement
+        self.relocate_hooks = []   # hook(cuisine) quand shards.json déplace une cuisine
+        self.bootstrapped = set()
+        self.known = {DEFAULT_KITCHEN}  # cuisines dont l'existence est établie
+        self._lock = threading.Lock()
+        self._shards = OrderedDict()   # { cuisine: Shard }
+        self._servers = {}             # { url Postgres: moteur partagé par les schémas }
+        self._async_servers = {}
+        self._map = {}
+        self._map_mtime = None
+        self._map_checked = 0.0
+        self._map_lock = threading.Lock()
+
+    # --- CARTE DES SHARDS ---
+    def shard_map(self) -> dict:
+        if time.monotonic() - self._map_checked < SHARD_MAP_TTL:
+            return self._map
+        with self._map_lock:
+            if time.monotonic() - self._map_checked < SHARD_MAP_TTL:
+                return self._map
+            try:
+                mtime = os.stat(self.map_path).st_mtime
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self._map_mtime:
+                previous = self._map
+                self._map = read_shard_map(self.map_path) if mtime is not None else {}
+                self._map_mtime = mtime
+                for kitchen in set(previous) | set(self._map):
+                    if previous.get(kitchen) != self._map.get(kitchen):
+                        self._relocated(kitchen)
+            self._map_checked = time.monotonic()
+        return self._map
+
+    def location(self, kitchen: str):
+        entry = self.shard_map().get(kitchen)
+        if entry:
+            if entry.get("moving"):
+                raise ShardMoving(kitchen)
+            return entry["url"], entry.get("schema") or ""
+        return default_location(kitchen)
+
+    def exists(self, kitchen: str) -> bool:
+        """
+        Cuisine déjà créée : entrée de shards.json, ou emplacement par défaut présent
+        (fichier SQLite, schéma Postgres). Un emplacement par défaut qui ne se vérifie pas
+        ainsi (une base Postgres par cuisine) doit figurer dans shards.json.
+        """
+        if kitchen in self.known or kitchen in self.shard_map():
+            found = True
+        else:
+            url, schema = default_location(kitchen)
+            if schema:
+                with self._server(url).connect() as conn:
+                    found = conn.execute(text("SELECT 1 FROM information_schema.schemata WHERE schema_name = :s"),
+                                         {"s": schema}).first() is not None
+            elif is_sqlite(url):
+                path = make_url(url).database
+                found = bool(path) and path != ":memory:" and os.path.exists(path)
+            else:
+                found = False
+        if found:
+            self.known.add(kitchen)
+        return found
+
+    def _relocated(self, kitchen):
+        with self._lock:
+            shard = self._shards.pop(kitchen, None)
+        if shard is not None:
+            shard.close()
+        for hook in self.relocate_hooks:
+            hook(kitchen)
+
+    # --- MOTEURS ---
+    def _server(self, url: str):
+        with self._lock:
+            server = self._servers.get(url)
+            if server is None:
+                server = self._servers[url] = make_engine(url)
+        return server
+
+    def engine_for(self, url: str, schema: str = ""):
+        if not schema:
+            if url == DATABASE_URL:
+                return engine
+            if is_sqlite(url):
+                path = make_url(url).database
+                if path and path != ":memory:":
+                    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            return make_engine(url)
+        server = self._server(url)
+        with server.begin() as conn:
+            conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+        return server.execution_options(schema_translate_map={None: schema})
+
+    def async_engine_for(self, url: str, schema: str = ""):
+        if not schema:
+            return async_engine if url == DATABASE_URL else make_async_engine(url)
+        with self._lock:
+            server = self._async_servers.get(url)
+            if server is None:
+                server = self._async_servers[url] = make_async_engine(url)
+        return server.execution_options(schema_translate_map={None: schema})
+
+    # --- CACHE LRU ---
+    def shard(self, kitchen: str) -> Shard:
+        url, schema = self.location(kitchen)
+        evicted = []
+        with self._lock:
+            shard = self._shards.get(kitchen)
+            if shard is not None and shard.location != (url, schema):
+                evicted.append(self._shards.pop(kitchen))
+                shard = None
+            if shard is None:
+                shard = self._shards[kitchen] = Shard(self, kitchen, url, schema)
+                while len(self._shards) > self.capacity:
+                    evicted.append(self._shards.popitem(last=False)[1])
+            else:
+                self._shards.move_to_end(kitchen)
+        for old in evicted:
+            old.close()
+        return shard.open()
+
+    def sessionmaker(self, kitchen: str):
+        return self.shard(kitchen).sessionmaker
+
+    def open_kitchens(self):
+        with self._lock:
+            return list(self._shards)
+
+
+def default_location(kitchen: str):
+    if kitchen == DEFAULT_KITCHEN:
+        return DATABASE_URL, ""
+    return KITCHEN_DATABASE_URL.format(kitchen=kitchen), KITCHEN_SCHEMA.format(kitchen=kitchen)
+
+def read_shard_map(path: str = SHARD_MAP_PATH) -> dict:
+    """{ cuisine: {"url": ..., "schema": ..., "moving": bool} } (fichier absent : vide)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("kitchens", {})
+    except FileNotFoundError:
+        return {}
+
+def write_shard_map(kitchens: dict, path: str = SHARD_MAP_PATH):
+    # Écriture atomique : les workers relisent le fichier à tout moment
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"kitchens": kitchens}, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+router = ShardRouter()
+
+
+class PerKitchen:
+    """
+    Une instance par cuisine (index, matrice, broker...), créée à la demande et bornée
+    comme les shards. Les attributs sont ceux de l'instance de la cuisine courante
+    (current_kitchen) ; get(cuisine) pour une autre. Une instance qui expose idle()
+    n'est évincée que si idle() est vrai ; close() est appelé à l'éviction.
+    """
+    def __init__(self, factory, capacity: int = SHARD_CACHE_SIZE):
+        self._factory = factory
+        self._capacity = capacity
+        self._instances = OrderedDict()
+        self._lock = threading.Lock()
+        router.relocate_hooks.append(self.discard)
+
+    def get(self, kitchen: str = None):
+        kitchen = kitchen or current_kitchen.get()
+        evicted = []
+        with self._lock:
+            instance = self._instances.get(kitchen)
+            if instance is None:
+                instance = self._instances[kitchen] = self._factory(kitchen)
+                for other, candidate in list(self._instances.items()):
+                    if len(self._instances) <= self._capacity:
+                        break
+                    if other != kitchen and getattr(candidate, "idle", lambda: True)():
+                        evicted.append(self._instances.pop(other))
+            else:
+                self._instances.move_to_end(kitchen)
+        for old in evicted:
+            _close(old)
+        return instance
+
+    def discard(self, kitchen: str):
+        with self._lock:
+            instance = self._instances.pop(kitchen, None)
+        if instance is not None:
+            _close(instance)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+def _close(instance):
+    close = getattr(instance, "close", None)
+    if close is not None:
+        close()
+
+
+# --- DÉPENDANCES FASTAPI ---
+async def kitchen_id(request: Request) -> str:
+    """
+    Cuisine de la requête : en-tête X-Kitchen-Id, ou paramètre `kitchen` (EventSource ne
+    peut pas poser d'en-tête). Async : la ContextVar posée ici est vue par la route.
+    """
+    kitchen = (request.headers.get(KITCHEN_HEADER) or request.query_params.get("kitchen") or DEFAULT_KITCHEN)
+    kitchen = kitchen.strip().lower()
+    if not KITCHEN_ID.match(kitchen):
+        raise HTTPException(status_code=400, detail="Identifiant de cuisine invalide")
+    if kitchen not in router.known:
+        # Vérification (fichier, schéma) hors de la boucle, une fois par cuisine et par processus
+        from anyio import to_thread
+        if not await to_thread.run_sync(router.exists, kitchen):
+            raise HTTPException(status_code=404, detail=f"Cuisine inconnue : {kitchen}")
+    current_kitchen.set(kitchen)
+    return kitchen
+
+def kitchen_shard(kitchen: str) -> Shard:
+    try:
+        return router.shard(kitchen)
+    except ShardMoving:
+        raise HTTPException(status_code=503, detail="Cuisine en cours de migration, réessayez dans un instant",
+                            headers={"Retry-After": "5"})
+
+def get_db(kitchen: str = Depends(kitchen_id)):
+    # Session synchrone : réservée aux routes `def` (exécutées dans le threadpool)
+    db = kitchen_shard(kitchen).sessionmaker()
     try: yield db
-    finally: db.close()
\ No newline at end of file
+    finally: db.close()
+
+async def get_async_db(kitchen: str = Depends(kitchen_id)):
+    # Session asynchrone pour les routes `async def` (ouverture d'un shard : hors boucle)
+    from anyio import to_thread
+    shard = await to_thread.run_sync(kitchen_shard, kitchen)
+    async with shard.async_sessionmaker()() as db:
+        yield db
@@ -1,11 +1,28 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request
+from services import coldstart  # en premier : mesure des imports (STARTUP_PROFILE=1 pour le détail)
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Query, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session, joinedload, selectinload
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from anyio import to_thread
+import inspect
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 import models, schemas, database, ai_service
-from typing import List, Optional
+from services.ingredient_logic import normalize_name, resolve_ingredients
+from services import master_import, demand_logic, inventory_logic, recipe_logic, listing, read_cache, metrics
+from services import changefeed, meal_plan_logic, transfer, jobs, batch_logic, ingredient_logic
+from services import shards  # initialisation de chaque cuisine à sa première ouverture
+from services.ingredient_index import index as ingredient_index
+from services.suggestion_engine import matrix as suggestion_matrix
+from services.scan_queue import ScanQueue, QueueFullError
+from services.scan_cache import ScanCache
+from services.units import ConversionError
+from typing import List, Optional, Union
 from datetime import date
-import json
+import gzip
 import os
+import tempfile
+import threading
 from pydantic import BaseModel
 
 app = FastAPI(title="Kitchen Logistics Manager Pro")
@@ -16,218 +33,330 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
-models.Base.metadata.create_all(bind=database.engine)
+# Latence, requêtes SQL et N+1 probables par route (voir /metrics et SLOW_REQUEST_MS)
+app.middleware("http")(metrics.track_request)
+scan_queue = ScanQueue(cache=ScanCache())
 
 # --- SCHEMA LOCAL POUR LA CREATION D'INGREDIENT ---
 class IngredientCreateRequest(BaseModel):
     name: str
     category: str = "Divers"
     unit: str = "unit"
+    density: Optional[float] = None # g/ml
+    piece_weight: Optional[float] = None # g par pièce
 
 # --- UTILITAIRE ---
 def get_or_create_ingredient(db: Session, name: str, unit: str = "unit", category: str = "Divers"):
-    name_clean = name.strip()
-    # Recherche insensible à la casse
-    ing = db.query(models.Ingredient).filter(models.Ingredient.name.ilike(name_clean)).first()
-    if not ing:
-        ing = models.Ingredient(name=name_clean, unit=unit, category=category)
-        db.add(ing)
-        db.commit()
-        db.refresh(ing)
-    return ing
+    # Cas unitaire du résolveur en lot (pas de commit : l'appelant valide)
+    ids = resolve_ingredients(db, [(name, unit, category)])
+    return db.get(models.Ingredient, ids[normalize_name(name)])
+
+# --- BOUCLE D'ÉVÉNEMENTS ---
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+def _uses_dependency(dependant, dependency) -> bool:
+    return any(d.call is dependency or _uses_dependency(d, dependency) for d in dependant.dependencies)
 
-# --- STARTUP EVENT (IMPORT JSON) ---
 @app.on_event("startup")
-def startup_load_master_ingredients():
+def check_blocking_routes():
     """
-    Au démarrage, vérifie si 'ingredient_master.json' existe et
-    charge son contenu dans la base de données s'il n'est pas déjà présent.
+    Les routes `async def` tournent sur la boucle d'événements : elles doivent utiliser
+    get_async_db. Les routes utilisant la session synchrone doivent être des `def`,
+    exécutées par FastAPI dans le threadpool (dimensionné par THREADPOOL_SIZE).
     """
-    db = database.SessionLocal()
-    file_path = "ingredient_master.json"
-    
-    if os.path.exists(file_path):
-        print(f"Chargement du fichier maître : {file_path}")
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                
-            count = 0
-            for item in data:
-                # Utilise la fonction utilitaire qui gère déjà les doublons (get_or_create)
-                name = item.get("name")
-                if name:
-                    get_or_create_ingredient(
-                        db, 
-                        name, 
-                        item.get("unit", "unit"), 
-                        item.get("category", "Divers")
-                    )
-                    count += 1
-            print(f"Succès : {count} ingrédients traités depuis le fichier maître.")
-        except Exception as e:
-            print(f"Erreur lors de l'import des ingrédients : {e}")
-        finally:
-            db.close()
-    else:
-        print("Aucun fichier 'ingredient_master.json' trouvé. Démarrage sans import.")
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    for route in app.routes:
+        if isinstance(route, APIRoute) and inspect.iscoroutinefunction(route.endpoint) \
+                and _uses_dependency(route.dependant, database.get_db):
+            raise RuntimeError(f"{route.path} est async mais utilise une session synchrone (get_db)")
 
-# --- INGREDIENTS (MODIFIED) ---
-@app.get("/api/ingredients")
-def list_ingredients(db: Session = Depends(database.get_db)):
-    return db.query(models.Ingredient).all()
+# --- STARTUP EVENT (IMPORT JSON) ---
+MASTER_FILE = "ingredient_master.json"
+
+def load_master_ingredients(shard: database.Shard):
+    """
+    À la première ouverture d'une cuisine, met en file le job d'import incrémental de
+    'ingredient_master.json' (ignoré si le fichier n'a pas changé) pour que l'API réponde immédiatement.
+    """
+    if not os.path.exists(MASTER_FILE):
+        if shard.kitchen == database.DEFAULT_KITCHEN:
+            print("Aucun fichier 'ingredient_master.json' trouvé. Démarrage sans import.")
+        return
+    db = shard.sessionmaker()
+    try:
+        # Un import déjà en file ou en cours (autre worker, reprise) suffit
+        pending = db.query(models.Job).filter(models.Job.kind == "master_import",
+                                              models.Job.status.in_(jobs.ACTIVE)).first()
+        if pending is None:
+            print(f"Chargement du fichier maître en arrière-plan ({shard.kitchen}) : {MASTER_FILE}")
+            jobs.enqueue(db, shard.kitchen, "master_import", {"path": MASTER_FILE})
+    finally:
+        db.close()
+
+# Reprise des jobs interrompus, puis import du fichier maître
+database.router.open_hooks.append(jobs.resume_pending)
+database.router.open_hooks.append(load_master_ingredients)
+
+# --- PRÉCHAUFFAGE ---
+# Liste séparée par des virgules ; vide : tout est initialisé à la première requête qui en a besoin
+#   kitchen : ouvre la cuisine par défaut avant d'accepter des requêtes (schéma, reprise des jobs, fichier maître)
+#   ai      : construit le client IA en arrière-plan (sinon au premier scan de ticket)
+STARTUP_WARMUP = {w.strip() for w in os.getenv("STARTUP_WARMUP", "kitchen").split(",") if w.strip()}
 
-@app.post("/api/ingredients")
+@app.on_event("startup")
+def warm_up():
+    # Les autres cuisines sont ouvertes (schéma, migrations, demande) à leur première requête
+    for unknown in STARTUP_WARMUP - {"kitchen", "ai"}:
+        print(f"STARTUP_WARMUP : préchauffage inconnu ignoré : {unknown}")
+    if "kitchen" in STARTUP_WARMUP:
+        database.router.shard(database.DEFAULT_KITCHEN)
+    if "ai" in STARTUP_WARMUP:
+        threading.Thread(target=ai_service.warm_up, name="ai-warmup", daemon=True).start()
+
+# --- INGREDIENTS (MODIFIED) ---
+# Paramètres communs des listes : limit/after (pagination par clé), fields (projection).
+# Sans `limit`, la liste complète est renvoyée ; le curseur suivant est dans X-Next-Cursor.
+@app.get("/api/ingredients", response_model=List[schemas.IngredientResponse])
+def list_ingredients(request: Request, limit: Optional[int] = None, after: Optional[str] = None,
+                     fields: Optional[str] = None, db: Session = Depends(database.get_db)):
+    return listing.conditional_list(request, db, ["ingredients"],
+                                    lambda: listing.list_ingredients(db, limit, after, fields), cached=True)
+
+@app.post("/api/ingredients", response_model=schemas.IngredientResponse)
 def create_ingredient_endpoint(item: IngredientCreateRequest, db: Session = Depends(database.get_db)):
-    # Vérifier si existe déjà
-    existing = db.query(models.Ingredient).filter(models.Ingredient.name.ilike(item.name.strip())).first()
-    if existing:
+    # Vérifier si existe déjà (sans tenir compte de la casse ni des accents)
+    if ingredient_index.lookup(db, item.name) is not None:
         raise HTTPException(status_code=400, detail="Cet ingrédient existe déjà.")
     
-    new_ing = models.Ingredient(name=item.name.strip(), category=item.category, unit=item.unit)
+    new_ing = models.Ingredient(name=item.name.strip(), category=item.category, unit=item.unit,
+                                density=item.density, piece_weight=item.piece_weight)
     db.add(new_ing)
     db.commit()
     db.refresh(new_ing)
     return new_ing
 
+@app.patch("/api/ingredients/{ingredient_id}", response_model=schemas.IngredientResponse)
+def update_ingredient_endpoint(ingredient_id: int, item: schemas.IngredientUpdate, db: Session = Depends(database.get_db)):
+    # Seuls les champs envoyés sont modifiés ; densité et poids d'une pièce peuvent être effacés (null)
+    changes = {field: value for field, value in item.model_dump(exclude_unset=True).items()
+               if value is not None or field in ("density", "piece_weight")}
+    if "name" in changes:
+        changes["name"] = changes["name"].strip()
+        if not changes["name"]:
+            raise HTTPException(status_code=400, detail="Nom d'ingrédient vide")
+        if ingredient_index.lookup(db, changes["name"]) not in (None, ingredient_id):
+            raise HTTPException(status_code=400, detail="Cet ingrédient existe déjà.")
+    try:
+        updated = ingredient_logic.update_ingredient(db, ingredient_id, changes)
+    except ConversionError as e:
+        # Quantités existantes impossibles à ré-exprimer dans la nouvelle unité : rien n'est modifié
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Ingrédient non trouvé")
+    ingredient, recipe_ids = updated
+    db.commit()
+    db.refresh(ingredient)
+    suggestion_matrix.recipes_changed(recipe_ids)
+    suggestion_matrix.stock_changed([ingredient_id])
+    return ingredient
+
 # --- MASTER LIST (REPLACED JSON WITH DB) ---
-@app.get("/api/ingredients/master")
-def get_master(db: Session = Depends(database.get_db)):
+@app.get("/api/ingredients/master", response_model=List[schemas.IngredientResponse])
+def get_master(request: Request, limit: Optional[int] = None, after: Optional[str] = None,
+               fields: Optional[str] = None, db: Session = Depends(database.get_db)):
     # Retourne tous les ingrédients connus en base au lieu du fichier JSON
-    return db.query(models.Ingredient).order_by(models.Ingredient.name).all()
+    return listing.conditional_list(request, db, ["ingredients"],
+                                    lambda: listing.list_ingredients(db, limit, after, fields, by_name=True),
+                                    cached=True)
 
-# --- RECIPES ---
-@app.get("/api/recipes")
-def list_recipes(db: Session = Depends(database.get_db)):
-    return db.query(models.Recipe).options(
-        selectinload(models.Recipe.ingredients).joinedload(models.RecipeIngredient.ingredient)
-    ).all()
-
-@app.post("/api/recipes")
-async def create_recipe(request: Request, db: Session = Depends(database.get_db)):
-    data = await request.json()
-    db_recipe = models.Recipe(name=data['name'], instructions=data.get('instructions', ""))
-    db.add(db_recipe)
-    db.commit()
-    db.refresh(db_recipe)
-
-    for ing_data in data['ingredients']:
-        ing = get_or_create_ingredient(db, ing_data['name'], ing_data.get('unit', 'unit'))
-        ri = models.RecipeIngredient(
-            recipe_id=db_recipe.id, 
-            ingredient_id=ing.id, 
-            quantity_required=float(ing_data['quantity'])
-        )
-        db.add(ri)
-    db.commit()
-    return db_recipe
+@app.get("/api/ingredients/search", response_model=List[schemas.IngredientSearchResult])
+def search_ingredients(q: str, limit: int = 10, db: Session = Depends(database.get_db)):
+    # Autocomplétion : préfixes puis correspondances approximatives, servie par l'index mémoire
+    return ingredient_index.search(db, q, max(1, min(limit, 50)))
 
-@app.put("/api/recipes/{recipe_id}")
-async def update_recipe(recipe_id: int, request: Request, db: Session = Depends(database.get_db)):
+@app.get("/api/ingredients/master/import-status", response_model=schemas.ImportStatusResponse)
+def get_master_import_status(db: Session = Depends(database.get_db)):
+    return master_import.import_status(db)
+
+# --- RECIPES ---
+@app.get("/api/recipes", response_model=List[schemas.RecipeDetailResponse])
+def list_recipes(request: Request, limit: Optional[int] = None, after: Optional[str] = None,
+                 fields: Optional[str] = None, db: Session = Depends(database.get_db)):
+    return listing.conditional_list(request, db, ["recipes", "recipe_ingredients", "ingredients"],
+                                    lambda: listing.list_recipes(db, limit, after, fields), cached=True)
+
+@app.post("/api/recipes", response_model=schemas.RecipeResponse)
+async def create_recipe(request: Request, db: AsyncSession = Depends(database.get_async_db)):
     data = await request.json()
     try:
-        db_recipe = db.query(models.Recipe).filter(models.Recipe.id == recipe_id).first()
-        if not db_recipe:
+        recipe = await db.run_sync(recipe_logic.create_recipe, data)
+    except ConversionError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.commit()
+    suggestion_matrix.recipes_changed([recipe["id"]])
+    return recipe
+
+@app.put("/api/recipes/{recipe_id}", response_model=schemas.RecipeResponse)
+async def update_recipe(recipe_id: int, request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    return await _update_recipe(recipe_id, await request.json(), db, partial=False)
+
+@app.patch("/api/recipes/{recipe_id}", response_model=schemas.RecipeResponse)
+async def patch_recipe(recipe_id: int, request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    # Seuls les champs envoyés sont modifiés (ingredients : liste complète des lignes)
+    return await _update_recipe(recipe_id, await request.json(), db, partial=True)
+
+async def _update_recipe(recipe_id: int, data: dict, db: AsyncSession, partial: bool):
+    try:
+        updated = await db.run_sync(recipe_logic.update_recipe, recipe_id, data, partial)
+        if updated is None:
             raise HTTPException(status_code=404, detail="Recette non trouvée")
 
-        db_recipe.name = data.get('name')
-        db_recipe.instructions = data.get('instructions', "")
-
-        # Suppression des anciens ingrédients liés
-        db.query(models.RecipeIngredient).filter_by(recipe_id=recipe_id).delete()
-
-        for ing_data in data.get('ingredients', []):
-            name = ing_data.get('name', 'Inconnu')
-            qty = float(ing_data.get('quantity', 0))
-            unit = ing_data.get('unit', 'unit')
-            
-            ing = get_or_create_ingredient(db, name, unit)
-            ri = models.RecipeIngredient(
-                recipe_id=db_recipe.id, 
-                ingredient_id=ing.id, 
-                quantity_required=qty
-            )
-            db.add(ri)
-        
-        db.commit()
-        db.refresh(db_recipe)
-        return db_recipe
+        recipe, changed = updated
+        await db.commit()
+        if changed:
+            suggestion_matrix.recipes_changed([recipe_id])
+        return recipe
+    except HTTPException:
+        raise
+    except ConversionError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Erreur update: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# --- PANTRY (INVENTAIRE) ---
-@app.get("/api/pantry")
-def list_pantry(db: Session = Depends(database.get_db)):
-    return db.query(models.PantryItem).options(joinedload(models.PantryItem.ingredient)).all()
+@app.get("/api/recipes/suggestions", response_model=List[schemas.SuggestionResponse])
+def suggest_recipes(limit: int = 20, category: Optional[str] = None, max_missing: Optional[int] = None,
+                    db: Session = Depends(database.get_db)):
+    # Classement de toutes les recettes selon le stock actuel (calcul vectorisé)
+    return suggestion_matrix.suggest(db, limit=limit, category=category, max_missing=max_missing)
 
-@app.delete("/api/pantry/{ingredient_id}")
+# --- PANTRY (INVENTAIRE) ---
+@app.get("/api/pantry", response_model=List[schemas.PantryItemResponse])
+def list_pantry(request: Request, limit: Optional[int] = None, after: Optional[str] = None,
+                fields: Optional[str] = None, db: Session = Depends(database.get_db)):
+    return listing.conditional_list(request, db, ["pantry", "ingredients"],
+                                    lambda: listing.list_pantry(db, limit, after, fields))
+
+@app.get("/api/pantry/use-soon", response_model=schemas.UseSoonResponse)
+def get_use_soon(days: int = 3, limit: int = 50, db: Session = Depends(database.get_db)):
+    # Lots périmés ou périmant dans `days` jours, et les recettes qui permettent de les écouler
+    return inventory_logic.use_soon(db, days=days, limit=limit)
+
+@app.get("/api/pantry/{ingredient_id}/lots", response_model=List[schemas.PantryLotResponse])
+def list_pantry_lots(ingredient_id: int, db: Session = Depends(database.get_db)):
+    # Dans l'ordre où la cuisson les consomme (FEFO)
+    return inventory_logic.list_lots(db, ingredient_id)
+
+@app.delete("/api/pantry/{ingredient_id}", response_model=schemas.StatusResponse)
 def delete_pantry_item(ingredient_id: int, db: Session = Depends(database.get_db)):
-    db_item = db.query(models.PantryItem).filter_by(ingredient_id=ingredient_id).first()
-    if not db_item:
+    if not inventory_logic.remove_from_pantry(db, ingredient_id):
         raise HTTPException(status_code=404, detail="Article non trouvé")
-    
-    db.delete(db_item)
     db.commit()
+    suggestion_matrix.stock_changed([ingredient_id])
     return {"status": "success"}
 
-@app.post("/api/pantry")
-async def add_pantry_item(request: Request, db: Session = Depends(database.get_db)):
+@app.post("/api/pantry", response_model=schemas.StatusResponse)
+async def add_pantry_item(request: Request, db: AsyncSession = Depends(database.get_async_db)):
     data = await request.json()
-    ing = get_or_create_ingredient(db, data['name'], data.get('unit', 'unit'))
-    
-    db_item = db.query(models.PantryItem).filter_by(ingredient_id=ing.id).first()
-    if db_item:
-        db_item.quantity_available += float(data['quantity'])
-    else:
-        db_item = models.PantryItem(ingredient_id=ing.id, quantity_available=float(data['quantity']))
-        db.add(db_item)
-    db.commit()
+    try:
+        added = await db.run_sync(inventory_logic.add_pantry_entries, [data])
+    except ConversionError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.commit()
+    suggestion_matrix.stock_changed(added)
     return {"status": "success"}
 
-@app.post("/api/pantry/bulk")
-async def add_pantry_bulk(items: List[dict], db: Session = Depends(database.get_db)):
+@app.post("/api/pantry/bulk", response_model=Union[schemas.MessageResponse, schemas.JobResponse])
+async def add_pantry_bulk(items: List[dict], response: Response, background: bool = False, source: str = "bulk",
+                          idempotency_key: Optional[str] = Header(None, alias=jobs.IDEMPOTENCY_HEADER),
+                          kitchen: str = Depends(database.kitchen_id),
+                          db: AsyncSession = Depends(database.get_async_db)):
+    # background=true : job par lots de JOB_CHUNK, suivi via /api/jobs/{id}
+    # source : origine des lots créés (bulk, scan après une lecture de ticket...)
+    payload = {"items": items, "source": source}
+    if background:
+        job = await db.run_sync(jobs.enqueue, kitchen, "pantry_bulk", payload, idempotency_key)
+        response.status_code = 202
+        return jobs.job_dict(job)
+
+    def apply(session):
+        added = inventory_logic.add_pantry_entries(session, items, source)
+        return {"status": "success", "message": f"{len(items)} articles ajoutés"}, added
+
     try:
-        for item in items:
-            name = item.get('name', '').strip()
-            if not name: continue
-            
-            qty = float(item.get('quantity', 0))
-            unit = item.get('unit', 'unit')
-            
-            ing = get_or_create_ingredient(db, name, unit)
-            
-            db_item = db.query(models.PantryItem).filter_by(ingredient_id=ing.id).first()
-            if db_item:
-                db_item.quantity_available += qty
-            else:
-                db_item = models.PantryItem(ingredient_id=ing.id, quantity_available=qty)
-                db.add(db_item)
-        
-        db.commit()
-        return {"status": "success", "message": f"{len(items)} articles ajoutés"}
+        result, added = await db.run_sync(jobs.run_once, "pantry_bulk", payload, idempotency_key, apply)
+    except HTTPException:
+        raise
+    except ConversionError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+    if added:
+        suggestion_matrix.stock_changed(added)
+    return result
 
 # --- AI & SHOPPING ---
-@app.get("/api/shopping-list")
+@app.get("/api/shopping-list", response_model=List[schemas.ShoppingItemResponse])
 def get_shopping_list(db: Session = Depends(database.get_db)):
     return db.query(models.ShoppingList).options(joinedload(models.ShoppingList.ingredient)).all()
 
-@app.post("/api/scan-receipt")
-async def scan_receipt(file: UploadFile = File(...)):
-    try:
-        content = await file.read()
-        result = ai_service.scan_receipt_with_gemini(content)
-        return result
-    except Exception as e:
-        print(f"Erreur Scan: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+# Scans restés actifs à l'arrêt d'un processus : repris à l'ouverture de la cuisine
+database.router.open_hooks.append(scan_queue.resume)
+
+@app.on_event("startup")
+async def start_scan_queue():
+    await scan_queue.start()
+
+@app.on_event("shutdown")
+async def stop_scan_queue():
+    await scan_queue.stop()
 
-@app.put("/api/shopping-list/{item_id}/toggle")
+@app.post("/api/scan-receipt", status_code=202, response_model=schemas.ScanJobResponse)
+async def scan_receipt(file: UploadFile = File(...), kitchen: str = Depends(database.kitchen_id)):
+    # Le scan est mis en file (job de la cuisine) : on renvoie tout de suite l'identifiant du job
+    content = await file.read()
+    try:
+        return await scan_queue.submit(kitchen, content)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.get("/api/scan-receipt/cache/stats", response_model=schemas.CacheStats)
+def get_scan_cache_stats():
+    return scan_queue.cache.snapshot()
+
+@app.get("/api/read-cache/stats", response_model=schemas.CacheStats)
+def get_read_cache_stats():
+    return read_cache.cache.snapshot()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Format texte Prometheus
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/scan-receipt/{job_id}", response_model=schemas.ScanJobResponse)
+def get_scan_job(job_id: str, kitchen: str = Depends(database.kitchen_id), db: Session = Depends(database.get_db)):
+    # Lu dans la table jobs : le scan peut avoir été reçu ou exécuté par un autre worker
+    job = scan_queue.get(db, kitchen, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Scan non trouvé")
+    if job["status"] == "done" and isinstance(job["result"], list):
+        # Rapprochement des noms lus sur le ticket avec les ingrédients existants
+        job["result"] = [
+            {**item, "match": ingredient_index.match(db, str(item.get("name", "")))} if isinstance(item, dict) else item
+            for item in job["result"]
+        ]
+    return job
+
+@app.put("/api/shopping-list/{item_id}/toggle", response_model=schemas.ToggleResponse)
 def toggle_shopping_item(item_id: int, db: Session = Depends(database.get_db)):
     item = db.query(models.ShoppingList).filter_by(id=item_id).first()
     if not item: raise HTTPException(status_code=404)
@@ -235,96 +364,57 @@ def toggle_shopping_item(item_id: int, db: Session = Depends(database.get_db)):
     db.commit()
     return {"status": "success", "is_checked": item.is_checked}
 
-@app.post("/api/shopping-list/checkout")
-def checkout_shopping_list(db: Session = Depends(database.get_db)):
-    purchased_items = db.query(models.ShoppingList).filter_by(is_checked=True).all()
-    for item in purchased_items:
-        pantry_item = db.query(models.PantryItem).filter_by(ingredient_id=item.ingredient_id).first()
-        if pantry_item:
-            pantry_item.quantity_available += item.quantity_needed
-        else:
-            new_pantry_item = models.PantryItem(
-                ingredient_id=item.ingredient_id,
-                quantity_available=item.quantity_needed
-            )
-            db.add(new_pantry_item)
-    
-    db.query(models.ShoppingList).filter_by(is_checked=True).delete()
-    db.commit()
-    return {"status": "success"}
-
-@app.delete("/api/shopping-list/clear")
+# Idempotency-Key : un passage en caisse rejoué (réseau coupé, double clic) n'est appliqué qu'une fois
+@app.post("/api/shopping-list/checkout", response_model=schemas.StatusResponse)
+def checkout_shopping_list(idempotency_key: Optional[str] = Header(None, alias=jobs.IDEMPOTENCY_HEADER),
+                           db: Session = Depends(database.get_db)):
+    def apply(session):
+        return {"status": "success"}, inventory_logic.checkout_items(session)
+
+    result, stocked = jobs.run_once(db, "checkout", {}, idempotency_key, apply)
+    if stocked:
+        suggestion_matrix.stock_changed(stocked)
+    return result
+
+@app.post("/api/shopping-list/checkout-batch", response_model=schemas.CheckoutBatchResponse)
+def checkout_shopping_batch(batch: schemas.CheckoutBatchRequest,
+                            idempotency_key: Optional[str] = Header(None, alias=jobs.IDEMPOTENCY_HEADER),
+                            db: Session = Depends(database.get_db)):
+    # Plusieurs sélections (IDs et/ou sources) passées en stock dans une seule transaction
+    def apply(session):
+        stocked = inventory_logic.checkout_items(session, item_ids=batch.item_ids, sources=batch.sources)
+        return {"status": "success", "stocked": len(stocked)}, stocked
+
+    result, stocked = jobs.run_once(db, "checkout_batch", batch.model_dump(), idempotency_key, apply)
+    if stocked:
+        suggestion_matrix.stock_changed(stocked)
+    return result
+
+@app.delete("/api/shopping-list/clear", response_model=schemas.StatusResponse)
 def clear_shopping_list(db: Session = Depends(database.get_db)):
     db.query(models.ShoppingList).delete()
+    changefeed.mark_reset(db, models.ShoppingList.__tablename__)
     db.commit()
     return {"status": "success"}
 
-@app.post("/api/shopping-list/generate")
-def generate_shopping_list(db: Session = Depends(database.get_db)):
-    # 1. Nettoyer
-    db.query(models.ShoppingList).filter(models.ShoppingList.source == "Planning").delete(synchronize_session=False)
-    db.commit()
-    
-    # 2. Récupérer TOUS les plans de repas
-    plans = db.query(models.MealPlan).options(
-        joinedload(models.MealPlan.recipe)
-        .selectinload(models.Recipe.ingredients)
-        .joinedload(models.RecipeIngredient.ingredient)
-    ).all()
-    
-    # 3. Agréger les ingrédients nécessaires
-    needed = {} # { ingredient_id: {qty: float, name: str, unit: str} }
-    
-    for plan in plans:
-        if not plan.recipe: continue
-        for ri in plan.recipe.ingredients:
-            qty = ri.quantity_required or 0
-            ing_id = ri.ingredient_id
-            
-            if ing_id not in needed:
-                needed[ing_id] = {
-                    "qty": 0.0,
-                    "name": ri.ingredient.name if ri.ingredient else "Inconnu",
-                    "unit": ri.ingredient.unit if ri.ingredient else "unit"
-                }
-            needed[ing_id]["qty"] += qty
-
-    # 4. Vérifier le stock actuel (Pantry)
-    pantry_items = db.query(models.PantryItem).all()
-    pantry_map = {item.ingredient_id: item.quantity_available for item in pantry_items}
-    
-    # Listes pour le rapport de retour
-    added_items = []
-    skipped_items = []
-
-    # 5. Créer les entrées de liste de courses
-    for ing_id, data in needed.items():
-        qty_available = pantry_map.get(ing_id, 0.0)
-        qty_needed = data["qty"]
-        qty_missing = qty_needed - qty_available
-        
-        item_info = {
-            "name": data["name"],
-            "unit": data["unit"],
-            "needed": qty_needed,
-            "stock": qty_available
-        }
-
-        if qty_missing > 0:
-            new_item = models.ShoppingList(
-                ingredient_id=ing_id,
-                quantity_needed=qty_missing,
-                is_checked=False,
-                source="Planning"
-            )
-            db.add(new_item)
-            item_info["added_qty"] = qty_missing
-            added_items.append(item_info)
-        else:
-            skipped_items.append(item_info)
-    
+@app.post("/api/shopping-list/generate", response_model=Union[schemas.GenerateResponse, schemas.JobResponse])
+def generate_shopping_list(response: Response, date_from: Optional[date] = Query(None, alias="from"),
+                           date_to: Optional[date] = Query(None, alias="to"), background: bool = False,
+                           idempotency_key: Optional[str] = Header(None, alias=jobs.IDEMPOTENCY_HEADER),
+                           kitchen: str = Depends(database.kitchen_id),
+                           db: Session = Depends(database.get_db)):
+    # Diff entre la demande agrégée et le stock actuel : seules les lignes "Planning"
+    # dont le manque a changé sont réécrites. Avec from/to, seuls les plans de l'horizon comptent.
+    meal_plan_logic.check_window(date_from, date_to)
+    if background:
+        window = {"from": date_from.isoformat() if date_from else None,
+                  "to": date_to.isoformat() if date_to else None}
+        response.status_code = 202
+        return jobs.job_dict(jobs.enqueue(db, kitchen, "shopping_generate", window, idempotency_key))
+    added_items, skipped_items = demand_logic.sync_shopping_list(db, source="Planning",
+                                                                 date_from=date_from, date_to=date_to)
     db.commit()
-    
+
     return {
         "status": "success", 
         "message": "Calcul terminé.",
@@ -332,47 +422,189 @@ def generate_shopping_list(db: Session = Depends(database.get_db)):
         "skipped": skipped_items
     }
 
+# --- JOBS (TRAVAUX EN ARRIÈRE-PLAN) ---
+@app.on_event("shutdown")
+def stop_job_runner():
+    # Les jobs non terminés restent en base et sont repris à la prochaine ouverture de la cuisine
+    jobs.runner.shutdown()
+
+@app.get("/api/jobs", response_model=List[schemas.JobResponse])
+def list_jobs(status: Optional[str] = None, kind: Optional[str] = None, limit: int = 50,
+              db: Session = Depends(database.get_db)):
+    query = db.query(models.Job)
+    if status:
+        query = query.filter(models.Job.status == status)
+    if kind:
+        query = query.filter(models.Job.kind == kind)
+    return [jobs.job_dict(job) for job in query.order_by(models.Job.created_at.desc()).limit(limit)]
+
+@app.get("/api/jobs/{job_id}", response_model=schemas.JobResponse)
+def get_job(job_id: str, db: Session = Depends(database.get_db)):
+    job = db.get(models.Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trouvé")
+    return jobs.job_dict(job)
+
+@app.post("/api/jobs/{job_id}/cancel", response_model=schemas.JobResponse)
+def cancel_job(job_id: str, db: Session = Depends(database.get_db)):
+    job = db.get(models.Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trouvé")
+    return jobs.job_dict(jobs.cancel(db, job))
+
+# --- STAPLES (BASIQUES HEBDOMADAIRES) ---
+@app.get("/api/staples", response_model=List[schemas.StapleResponse])
+def list_staples(db: Session = Depends(database.get_db)):
+    return db.query(models.WeeklyStaple).options(joinedload(models.WeeklyStaple.ingredient)).all()
+
+@app.put("/api/staples/{ingredient_id}", response_model=schemas.StatusResponse)
+def set_staple(ingredient_id: int, item: schemas.StapleUpdate, db: Session = Depends(database.get_db)):
+    staple = db.get(models.WeeklyStaple, ingredient_id)
+    previous = staple.default_quantity if staple else 0.0
+    if staple:
+        staple.default_quantity = item.default_quantity
+    else:
+        db.add(models.WeeklyStaple(ingredient_id=ingredient_id, default_quantity=item.default_quantity))
+    demand_logic.apply_staple_delta(db, ingredient_id, item.default_quantity - (previous or 0.0))
+    db.commit()
+    return {"status": "success"}
+
+@app.delete("/api/staples/{ingredient_id}", response_model=schemas.StatusResponse)
+def delete_staple(ingredient_id: int, db: Session = Depends(database.get_db)):
+    staple = db.get(models.WeeklyStaple, ingredient_id)
+    if not staple:
+        raise HTTPException(status_code=404, detail="Basique non trouvé")
+    demand_logic.apply_staple_delta(db, ingredient_id, -(staple.default_quantity or 0.0))
+    db.delete(staple)
+    db.commit()
+    return {"status": "success"}
+
 # --- MEAL PLAN ---
-@app.get("/api/meal-plan")
-def get_meal_plan(db: Session = Depends(database.get_db)):
-    return db.query(models.MealPlan).options(
-        joinedload(models.MealPlan.recipe)
-            .selectinload(models.Recipe.ingredients)
-            .joinedload(models.RecipeIngredient.ingredient)
-    ).all()
-
-@app.post("/api/meal-plan/{recipe_id}")
-def add_to_plan(recipe_id: int, db: Session = Depends(database.get_db)):
-    from datetime import datetime
-    internal_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
-    new_plan = models.MealPlan(recipe_id=recipe_id, date=date.today(), slot=internal_id)
+@app.get("/api/meal-plan", response_model=List[schemas.MealPlanResponse])
+def get_meal_plan(request: Request, limit: Optional[int] = None, after: Optional[str] = None,
+                  fields: Optional[str] = None, date_from: Optional[date] = Query(None, alias="from"),
+                  date_to: Optional[date] = Query(None, alias="to"), db: Session = Depends(database.get_db)):
+    meal_plan_logic.check_window(date_from, date_to)
+    return listing.conditional_list(request, db, ["meal_plans", "recipes", "recipe_ingredients", "ingredients"],
+                                    lambda: listing.list_meal_plans(db, limit, after, fields, date_from, date_to),
+                                    cached=True)
+
+@app.post("/api/meal-plan/cook-batch", response_model=schemas.CookBatchResponse)
+def cook_batch(batch: schemas.CookBatchRequest, db: Session = Depends(database.get_db)):
+    # Déclarée avant /api/meal-plan/{recipe_id} pour ne pas être capturée par cette route
+    cooked, touched = inventory_logic.cook_plans(db, batch.plan_ids)
+    db.commit()
+    suggestion_matrix.stock_changed(touched)
+    return {"status": "success", "cooked": cooked, "not_found": sorted(set(batch.plan_ids) - set(cooked))}
+
+@app.post("/api/meal-plan/{recipe_id}", response_model=schemas.PlanCreatedResponse)
+def add_to_plan(recipe_id: int, plan_date: Optional[date] = Query(None, alias="date"), slot: Optional[str] = None,
+                db: Session = Depends(database.get_db)):
+    # Sans date ni créneau : aujourd'hui, créneau ANY (plusieurs recettes par créneau possibles)
+    new_plan = models.MealPlan(recipe_id=recipe_id, date=plan_date or date.today(),
+                               slot=meal_plan_logic.normalize_slot(slot))
     db.add(new_plan)
+    demand_logic.apply_recipe_delta(db, recipe_id, 1)
     db.commit()
-    return {"status": "success"}
+    return {"status": "success", "id": new_plan.id}
+
+@app.put("/api/meal-plan/{plan_id}", response_model=schemas.MealPlanResponse)
+def update_plan(plan_id: int, item: schemas.MealPlanUpdate, db: Session = Depends(database.get_db)):
+    plan = db.get(models.MealPlan, plan_id)
+    if not plan:
+        raise HTTPException(status_code=404, detail="Plan non trouvé")
+    if item.date is not None:
+        plan.date = item.date
+    if item.slot is not None:
+        plan.slot = meal_plan_logic.normalize_slot(item.slot)
+    if item.recipe_id is not None and item.recipe_id != plan.recipe_id:
+        demand_logic.apply_recipes_delta(db, {plan.recipe_id: -1, item.recipe_id: 1})
+        plan.recipe_id = item.recipe_id
+    db.commit()
+    return listing.meal_plan_dict(plan)
 
-@app.delete("/api/meal-plan/{plan_id}")
+@app.delete("/api/meal-plan/{plan_id}", response_model=schemas.StatusResponse)
 def remove_from_plan(plan_id: int, db: Session = Depends(database.get_db)):
-    db.query(models.MealPlan).filter_by(id=plan_id).delete()
+    plan = db.get(models.MealPlan, plan_id)
+    if plan:
+        demand_logic.apply_recipe_delta(db, plan.recipe_id, -1)
+        db.delete(plan)
     db.commit()
     return {"status": "success"}
 
-@app.post("/api/meal-plan/{plan_id}/cook")
+@app.post("/api/meal-plan/{plan_id}/cook", response_model=schemas.StatusResponse)
 def cook_recipe(plan_id: int, db: Session = Depends(database.get_db)):
-    plan = db.query(models.MealPlan).options(
-        joinedload(models.MealPlan.recipe)
-        .selectinload(models.Recipe.ingredients)
-    ).filter_by(id=plan_id).first()
-    
-    if not plan: 
+    cooked, touched = inventory_logic.cook_plans(db, [plan_id])
+    if not cooked: 
         raise HTTPException(status_code=404, detail="Plan non trouvé")
-    
-    for ri in plan.recipe.ingredients:
-        pantry_item = db.query(models.PantryItem).filter_by(ingredient_id=ri.ingredient_id).first()
-        if pantry_item:
-            pantry_item.quantity_available -= ri.quantity_required
-            if pantry_item.quantity_available <= 0:
-                db.delete(pantry_item)
-    
-    db.delete(plan)
     db.commit()
-    return {"status": "success"}
\ No newline at end of file
+    suggestion_matrix.stock_changed(touched)
+    return {"status": "success"}
+
+# --- LOT D'OPÉRATIONS (SYNCHRONISATION HORS LIGNE) ---
+@app.post("/api/batch", response_model=schemas.BatchResponse)
+def run_batch(batch: schemas.BatchRequest, db: Session = Depends(database.get_db)):
+    # Opérations unitaires (stock, liste de courses, plans) rejouées dans l'ordre, en une transaction
+    results, touched = batch_logic.run_batch(db, batch.operations, batch.atomic)
+    suggestion_matrix.stock_changed(touched)
+    return {"status": "success", "results": results}
+
+# --- FLUX DE CHANGEMENTS (SSE) ---
+@app.get("/api/changes", response_class=StreamingResponse)
+async def change_feed(request: Request, after: Optional[int] = None, tables: Optional[str] = None,
+                      kitchen: str = Depends(database.kitchen_id)):
+    """
+    Changements ligne à ligne de la liste de courses, du stock et des plans de repas.
+    Reprise après une coupure : Last-Event-ID (envoyé par EventSource) ou ?after=seq.
+    """
+    last_event_id = request.headers.get("last-event-id", "")
+    if after is None and last_event_id.isdigit():
+        after = int(last_event_id)
+    try:
+        wanted = changefeed.parse_tables(tables)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(changefeed.sse_stream(request, kitchen, after, wanted), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- EXPORT / IMPORT NDJSON ---
+# Au-delà, le corps de /api/import est recopié sur disque plutôt qu'en mémoire
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", str(8 * 1024 * 1024)))
+
+@app.get("/api/export", response_class=StreamingResponse)
+def export_kitchen(sections: Optional[str] = None, kitchen: str = Depends(database.kitchen_id)):
+    # Flux NDJSON produit par lots : la mémoire reste constante quelle que soit la taille de la cuisine
+    try:
+        wanted = transfer.parse_sections(sections)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    shard = database.kitchen_shard(kitchen)
+    filename = f"kitchen-{kitchen}-{date.today().isoformat()}.ndjson"
+    return StreamingResponse(transfer.export_ndjson(shard.sessionmaker, wanted), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.post("/api/import", response_model=schemas.ImportReport)
+async def import_kitchen(request: Request, replace: bool = False, kitchen: str = Depends(database.kitchen_id)):
+    """
+    Corps : NDJSON produit par /api/export (éventuellement gzip). Le corps est d'abord
+    recopié dans un fichier temporaire, puis importé par lots hors de la boucle d'événements.
+    """
+    shard = await to_thread.run_sync(database.kitchen_shard, kitchen)
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        source = gzip.GzipFile(fileobj=spool, mode="rb") if spool.read(2) == b"\x1f\x8b" else spool
+        spool.seek(0)
+        try:
+            report = await to_thread.run_sync(transfer.import_ndjson, shard.sessionmaker, source, replace)
+        except (ValueError, OSError) as e:
+            raise HTTPException(status_code=400, detail=f"Import impossible : {e}")
+    finally:
+        spool.close()
+    suggestion_matrix.reset()
+    return {"status": "success", **report}
+
+# Dernière instruction : durée d'import de l'application et chronométrage des hooks de démarrage
+coldstart.instrument(app)
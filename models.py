@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, Date, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, Date, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -8,6 +8,8 @@ class Ingredient(Base):
     name = Column(String, unique=True, index=True)
     category = Column(String)
     unit = Column(String)
+    density = Column(Float, nullable=True) # g/ml, pour passer d'un volume à une masse
+    piece_weight = Column(Float, nullable=True) # g par pièce, pour les unités comptées
 
 class Recipe(Base):
     __tablename__ = "recipes"
@@ -19,17 +21,35 @@ class Recipe(Base):
 class RecipeIngredient(Base):
     __tablename__ = "recipe_ingredients"
     id = Column(Integer, primary_key=True, index=True)
-    recipe_id = Column(Integer, ForeignKey("recipes.id"))
-    ingredient_id = Column(Integer, ForeignKey("ingredients.id"))
+    recipe_id = Column(Integer, ForeignKey("recipes.id"), index=True)
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"), index=True)
     quantity_required = Column(Float)
+    unit = Column(String, nullable=True) # unité saisie (NULL = unité de l'ingrédient)
+    quantity_canonical = Column(Float) # quantité dans l'unité de base de l'ingrédient (g, ml, unit)
     recipe = relationship("Recipe", back_populates="ingredients")
     ingredient = relationship("Ingredient")
 
 class PantryItem(Base):
+    # Agrégat par ingrédient des lots (pantry_lots), tenu à jour à chaque entrée ou sortie de stock
     __tablename__ = "pantry"
     ingredient_id = Column(Integer, ForeignKey("ingredients.id"), primary_key=True)
-    quantity_available = Column(Float, default=0.0)
+    quantity_available = Column(Float, default=0.0) # dans l'unité de l'ingrédient
+    quantity_canonical = Column(Float, default=0.0)
+    ingredient = relationship("Ingredient")
+
+class PantryLot(Base):
+    __tablename__ = "pantry_lots"
+    id = Column(Integer, primary_key=True)
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"))
+    quantity_canonical = Column(Float) # restant, dans l'unité de base de l'ingrédient
+    purchased_at = Column(Date)
+    expires_at = Column(Date, nullable=True, index=True) # "à consommer bientôt"
+    source = Column(String) # manual, bulk, scan, checkout, batch, migration
     ingredient = relationship("Ingredient")
+    __table_args__ = (
+        # Ordre de consommation FEFO : péremption la plus proche, puis le plus ancien achat
+        Index("ix_pantry_lots_fefo", "ingredient_id", "expires_at", "purchased_at", "id"),
+    )
 
 class WeeklyStaple(Base):
     __tablename__ = "weekly_staples"
@@ -41,15 +61,77 @@ class MealPlan(Base):
     __tablename__ = "meal_plans"
     id = Column(Integer, primary_key=True, index=True)
     date = Column(Date)
-    slot = Column(String) # LUNCH, DINNER, ANY...
+    slot = Column(String) # BREAKFAST, LUNCH, DINNER, SNACK, ANY
     recipe_id = Column(Integer, ForeignKey("recipes.id"))
     recipe = relationship("Recipe")
+    # Requêtes par fenêtre de dates (liste, génération des courses) ; plusieurs recettes par créneau
+    __table_args__ = (Index("ix_meal_plans_date_slot", "date", "slot"),)
+
+class ChangeEvent(Base):
+    __tablename__ = "change_events"
+    # Alloué à l'insertion, jamais réutilisé ; sur Postgres l'ordre des commits peut différer (voir DatabaseBroker)
+    seq = Column(Integer, primary_key=True)
+    payload = Column(String) # JSON des changements d'une transaction
+    created_at = Column(DateTime)
+    __table_args__ = {"sqlite_autoincrement": True}
 
 class ShoppingList(Base):
     __tablename__ = "shopping_list"
     id = Column(Integer, primary_key=True, index=True)
-    ingredient_id = Column(Integer, ForeignKey("ingredients.id"))
-    quantity_needed = Column(Float)
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"), index=True)
+    quantity_needed = Column(Float) # dans l'unité de l'ingrédient
+    quantity_canonical = Column(Float)
     is_checked = Column(Boolean, default=False)
     source = Column(String) # RECIPE, STAPLE, MANUAL
-    ingredient = relationship("Ingredient")
\ No newline at end of file
+    ingredient = relationship("Ingredient")
+
+class ImportState(Base):
+    __tablename__ = "import_state"
+    source = Column(String, primary_key=True) # chemin du fichier importé
+    content_hash = Column(String)
+    row_count = Column(Integer, default=0)
+    imported_at = Column(DateTime)
+
+class MasterIngredientRow(Base):
+    __tablename__ = "master_ingredient_rows"
+    name_key = Column(String, primary_key=True) # nom normalisé
+    fingerprint = Column(String)
+
+class IngredientDemand(Base):
+    __tablename__ = "ingredient_demand"
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"), primary_key=True)
+    planned_qty = Column(Float, default=0.0) # somme des recettes planifiées (quantités canoniques)
+    staple_qty = Column(Float, default=0.0) # somme des basiques hebdomadaires (quantités canoniques)
+    ingredient = relationship("Ingredient")
+
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, default=0) # incrémentée à chaque commit modifiant la table
+
+class Job(Base):
+    __tablename__ = "jobs"
+    id = Column(String, primary_key=True)
+    kind = Column(String)
+    status = Column(String, index=True) # queued, running, done, error, cancelled
+    idempotency_key = Column(String, unique=True, nullable=True) # en-tête Idempotency-Key du client
+    request_hash = Column(String) # empreinte de la requête : une clé réutilisée pour autre chose est refusée
+    payload = Column(String) # JSON
+    result = Column(String, nullable=True) # JSON
+    error = Column(String, nullable=True)
+    done = Column(Integer, default=0) # progression, validée avec chaque lot (curseur de reprise)
+    total = Column(Integer, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
+    owner = Column(String, nullable=True) # processus qui l'exécute
+    heartbeat = Column(DateTime, nullable=True) # au-delà de JOB_STALE_SECONDS, un autre processus le reprend
+    created_at = Column(DateTime)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class BatchOperation(Base):
+    __tablename__ = "batch_operations"
+    id = Column(String, primary_key=True) # identifiant choisi par le client (POST /api/batch)
+    op = Column(String)
+    request_hash = Column(String) # empreinte de l'opération : un identifiant réutilisé pour autre chose est refusé
+    result = Column(String, nullable=True) # JSON, renvoyé tel quel si le lot est rejoué
+    created_at = Column(DateTime, index=True) # purge au-delà de BATCH_RETENTION_HOURS
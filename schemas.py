@@ -1,27 +1,35 @@
-from pydantic import BaseModel
-from typing import List, Optional
-from datetime import date
+from pydantic import BaseModel, ConfigDict
+from typing import Any, Dict, List, Optional, Union
+import datetime
 
 # --- INGREDIENTS ---
 class IngredientBase(BaseModel):
     name: str
     category: str
     unit: str
+    density: Optional[float] = None
+    piece_weight: Optional[float] = None
 
 class IngredientCreate(IngredientBase): pass
 class IngredientUpdate(BaseModel):
     name: Optional[str] = None
     category: Optional[str] = None
     unit: Optional[str] = None
+    density: Optional[float] = None
+    piece_weight: Optional[float] = None
 
 class IngredientResponse(IngredientBase):
     id: int
-    class Config: from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+class IngredientSearchResult(IngredientResponse):
+    score: float
 
 # --- RECIPES ---
 class RecipeIngredientBase(BaseModel):
     ingredient_id: int
     quantity_required: float
+    unit: Optional[str] = None
 
 class RecipeCreate(BaseModel):
     name: str
@@ -37,23 +45,80 @@ class RecipeResponse(BaseModel):
     id: int
     name: str
     instructions: Optional[str] = None
-    class Config: from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+class RecipeIngredientResponse(BaseModel):
+    id: int
+    recipe_id: int
+    ingredient_id: Optional[int] = None
+    quantity_required: Optional[float] = None
+    unit: Optional[str] = None
+    quantity_canonical: Optional[float] = None
+    ingredient: Optional[IngredientResponse] = None
+    model_config = ConfigDict(from_attributes=True)
+
+class RecipeDetailResponse(RecipeResponse):
+    ingredients: List[RecipeIngredientResponse] = []
+
+class SuggestionResponse(BaseModel):
+    recipe_id: int
+    recipe_name: str
+    match_percentage: float
+    missing_items: int
+    missing_quantity: float
+    cookable_servings: int
 
 # --- PANTRY ---
 class PantryItemUpdate(BaseModel):
     quantity: float
 
+class PantryItemResponse(BaseModel):
+    ingredient_id: int
+    quantity_available: Optional[float] = None
+    quantity_canonical: Optional[float] = None
+    ingredient: Optional[IngredientResponse] = None
+    model_config = ConfigDict(from_attributes=True)
+
+class PantryLotResponse(BaseModel):
+    id: int
+    ingredient_id: int
+    ingredient_name: Optional[str] = None
+    quantity: Optional[float] = None # dans l'unité de l'ingrédient
+    unit: Optional[str] = None
+    quantity_canonical: Optional[float] = None
+    purchased_at: Optional[datetime.date] = None
+    expires_at: Optional[datetime.date] = None
+    source: Optional[str] = None
+
+class UseSoonRecipe(BaseModel):
+    recipe_id: int
+    recipe_name: str
+    ingredient_ids: List[int] # ingrédients à écouler utilisés par la recette
+    first_expiry: Optional[datetime.date] = None
+
+class UseSoonResponse(BaseModel):
+    lots: List[PantryLotResponse]
+    recipes: List[UseSoonRecipe]
+
 # --- MEAL PLAN ---
 class MealPlanCreate(BaseModel):
-    date: date
+    date: datetime.date
     slot: str
     recipe_id: int
 
 class MealPlanUpdate(BaseModel):
-    date: Optional[date] = None
+    date: Optional[datetime.date] = None
     slot: Optional[str] = None
     recipe_id: Optional[int] = None
 
+class MealPlanResponse(BaseModel):
+    id: int
+    date: Optional[datetime.date] = None
+    slot: Optional[str] = None
+    recipe_id: Optional[int] = None
+    recipe: Optional[RecipeDetailResponse] = None
+    model_config = ConfigDict(from_attributes=True)
+
 # --- STAPLES ---
 class StapleCreate(BaseModel):
     ingredient_id: int
@@ -62,6 +127,12 @@ class StapleCreate(BaseModel):
 class StapleUpdate(BaseModel):
     default_quantity: float
 
+class StapleResponse(BaseModel):
+    ingredient_id: int
+    default_quantity: Optional[float] = None
+    ingredient: Optional[IngredientResponse] = None
+    model_config = ConfigDict(from_attributes=True)
+
 # --- SHOPPING LIST ---
 class ShoppingItemCreate(BaseModel):
     ingredient_id: int
@@ -74,4 +145,135 @@ class ShoppingItemUpdate(BaseModel):
 
 class MarkCheckedRequest(BaseModel):
     item_ids: List[int]
-    checked: bool
\ No newline at end of file
+    checked: bool
+
+class ShoppingItemResponse(BaseModel):
+    id: int
+    ingredient_id: Optional[int] = None
+    quantity_needed: Optional[float] = None
+    quantity_canonical: Optional[float] = None
+    is_checked: Optional[bool] = None
+    source: Optional[str] = None
+    ingredient: Optional[IngredientResponse] = None
+    model_config = ConfigDict(from_attributes=True)
+
+class ShoppingReportItem(BaseModel):
+    name: str
+    unit: str
+    needed: float
+    stock: float
+    added_qty: Optional[float] = None
+
+class GenerateResponse(BaseModel):
+    status: str
+    message: str
+    added: List[ShoppingReportItem]
+    skipped: List[ShoppingReportItem]
+
+# --- BATCH ---
+class CookBatchRequest(BaseModel):
+    plan_ids: List[int]
+
+class CheckoutBatchRequest(BaseModel):
+    item_ids: Optional[List[int]] = None
+    sources: Optional[List[str]] = None
+
+class BatchOperation(BaseModel):
+    id: str # identifiant client, unique : sert à la déduplication
+    op: str # pantry.add, pantry.delete, shopping.toggle, shopping.checkout, meal_plan.add/remove/cook
+    args: Dict[str, Any] = {}
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+    atomic: bool = True
+
+class BatchOperationResult(BaseModel):
+    id: str
+    op: str
+    status: str # ok, replayed, error
+    result: Optional[Any] = None
+    code: Optional[int] = None
+    error: Optional[Any] = None
+
+class BatchResponse(BaseModel):
+    status: str
+    results: List[BatchOperationResult]
+
+# --- RÉPONSES D'ÉTAT ---
+class StatusResponse(BaseModel):
+    status: str
+
+class PlanCreatedResponse(StatusResponse):
+    id: int
+
+class MessageResponse(StatusResponse):
+    message: str
+
+class ToggleResponse(StatusResponse):
+    is_checked: bool
+
+class CheckoutBatchResponse(StatusResponse):
+    stocked: int
+
+class CookBatchResponse(StatusResponse):
+    cooked: List[int]
+    not_found: List[int]
+
+# --- SCAN ET IMPORT ---
+class ScanAttempt(BaseModel):
+    model: str
+    ok: bool
+    error: Optional[str] = None
+
+class ScanItem(BaseModel):
+    # Champs renvoyés par le modèle : tolérants sur les types, champs inconnus conservés
+    name: Optional[str] = None
+    quantity: Optional[Union[float, str]] = None
+    unit: Optional[str] = None
+    match: Optional[IngredientSearchResult] = None
+    model_config = ConfigDict(extra="allow")
+
+class ScanJobResponse(BaseModel):
+    id: str
+    status: str
+    model: Optional[str] = None
+    attempts: List[ScanAttempt] = []
+    result: Optional[List[ScanItem]] = None
+    error: Optional[str] = None
+    cached: bool = False
+    created_at: str
+    updated_at: str
+    position: Optional[int] = None
+
+class ImportStatusResponse(BaseModel):
+    state: str
+    processed: int
+    applied: int
+    bytes_read: int
+    total_bytes: int
+    error: Optional[str] = None
+
+class ImportReport(StatusResponse):
+    ingredients: int
+    recipes: int
+    pantry: int
+    staples: int
+    meal_plans: int
+    shopping_list: int
+    skipped: int
+
+CacheStats = Dict[str, Union[int, float]]
+
+# --- JOBS ---
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str
+    done: int = 0
+    total: Optional[int] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    created_at: Optional[datetime.datetime] = None
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
@@ -0,0 +1,202 @@
+"""
+Lot d'opérations (POST /api/batch) : une session hors ligne de l'application est rejouée
+en une seule requête, dans une seule transaction.
+
+Chaque opération porte un identifiant choisi par le client. Une opération appliquée est
+tracée dans la table `batch_operations` avec son résultat, dans la transaction même de
+ses écritures : un lot renvoyé après une coupure réseau ne rejoue que les opérations qui
+n'avaient pas été validées, les autres renvoient leur résultat d'origine. Les traces sont
+purgées au-delà de BATCH_RETENTION_HOURS, à chaque lot reçu.
+"""
+import json
+import os
+from datetime import date, datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import BatchOperation, MealPlan, ShoppingList
+from services import demand_logic, inventory_logic, jobs, meal_plan_logic
+
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "500"))
+BATCH_RETENTION_HOURS = int(os.getenv("BATCH_RETENTION_HOURS", str(jobs.JOB_RETENTION_HOURS)))
+
+# --- OPÉRATIONS ---
+# op(db, args) -> (résultat, ingrédients du stock touchés) ; mêmes traitements que les routes unitaires
+OPERATIONS = {}
+
+
+def operation(name: str):
+    def register(fn):
+        OPERATIONS[name] = fn
+        return fn
+    return register
+
+
+def _arg(args: dict, name: str, kind=int, required: bool = True):
+    value = args.get(name)
+    if value is None:
+        if required:
+            raise HTTPException(status_code=400, detail=f"Argument manquant : {name}")
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Argument invalide : {name}={value!r}")
+
+
+def _boolean(value):
+    # Booléen JSON uniquement : bool("false") vaudrait True
+    if not isinstance(value, bool):
+        raise ValueError(value)
+    return value
+
+
+@operation("pantry.add")
+def op_pantry_add(db: Session, args: dict):
+    # Même article que POST /api/pantry : {name, quantity, unit}
+    added = inventory_logic.add_pantry_entries(db, [args], "batch")
+    return {"status": "success"}, list(added)
+
+
+@operation("pantry.delete")
+def op_pantry_delete(db: Session, args: dict):
+    ingredient_id = _arg(args, "ingredient_id")
+    if not inventory_logic.remove_from_pantry(db, ingredient_id):
+        raise HTTPException(status_code=404, detail="Article non trouvé")
+    return {"status": "success"}, [ingredient_id]
+
+
+@operation("shopping.toggle")
+def op_shopping_toggle(db: Session, args: dict):
+    # `checked` fixe l'état voulu : rejoué sur un autre appareil, le résultat ne dépend pas de l'état courant
+    item = db.get(ShoppingList, _arg(args, "item_id"))
+    if not item:
+        raise HTTPException(status_code=404, detail="Article non trouvé")
+    checked = _arg(args, "checked", _boolean, required=False)
+    item.is_checked = (not item.is_checked) if checked is None else checked
+    return {"status": "success", "is_checked": item.is_checked}, []
+
+
+@operation("shopping.checkout")
+def op_shopping_checkout(db: Session, args: dict):
+    item_ids, sources = args.get("item_ids"), args.get("sources")
+    stocked = inventory_logic.checkout_items(
+        db, item_ids=[int(i) for i in item_ids] if item_ids is not None else None, sources=sources,
+    )
+    return {"status": "success", "stocked": len(stocked)}, stocked
+
+
+@operation("meal_plan.add")
+def op_meal_plan_add(db: Session, args: dict):
+    recipe_id = _arg(args, "recipe_id")
+    plan = MealPlan(recipe_id=recipe_id, date=_arg(args, "date", date.fromisoformat, required=False) or date.today(),
+                    slot=meal_plan_logic.normalize_slot(args.get("slot")))
+    db.add(plan)
+    demand_logic.apply_recipe_delta(db, recipe_id, 1)
+    db.flush()
+    return {"status": "success", "id": plan.id}, []
+
+
+@operation("meal_plan.remove")
+def op_meal_plan_remove(db: Session, args: dict):
+    plan = db.get(MealPlan, _arg(args, "plan_id"))
+    if plan:
+        demand_logic.apply_recipe_delta(db, plan.recipe_id, -1)
+        db.delete(plan)
+    return {"status": "success"}, []
+
+
+@operation("meal_plan.cook")
+def op_meal_plan_cook(db: Session, args: dict):
+    cooked, touched = inventory_logic.cook_plans(db, [_arg(args, "plan_id")])
+    if not cooked:
+        raise HTTPException(status_code=404, detail="Plan non trouvé")
+    return {"status": "success"}, touched
+
+
+# --- EXÉCUTION ---
+def _trace(op, fingerprint: str, result, now: datetime) -> BatchOperation:
+    return BatchOperation(id=op.id, op=op.op, request_hash=fingerprint,
+                          result=json.dumps(result, default=str), created_at=now)
+
+
+def purge(db: Session, now: datetime = None):
+    # Traces assez vieilles pour qu'aucun client ne renvoie encore leur lot
+    cutoff = (now or datetime.now()) - timedelta(hours=BATCH_RETENTION_HOURS)
+    db.execute(delete(BatchOperation).where(BatchOperation.created_at < cutoff))
+
+
+def _check(operations):
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"Lot trop grand : {len(operations)} opérations "
+                                                    f"(maximum {BATCH_MAX_OPERATIONS})")
+    seen = set()
+    for op in operations:
+        if not (0 < len(op.id) <= jobs.MAX_KEY_LENGTH):
+            raise HTTPException(status_code=400, detail=f"Identifiant d'opération invalide : {op.id!r}")
+        if op.id in seen:
+            raise HTTPException(status_code=400, detail=f"Identifiant d'opération en double : {op.id}")
+        if op.op not in OPERATIONS:
+            raise HTTPException(status_code=400, detail=f"Opération inconnue : {op.op} "
+                                                        f"(attendu : {', '.join(OPERATIONS)})")
+        seen.add(op.id)
+
+
+def run_batch(db: Session, operations, atomic: bool = True):
+    """
+    Applique les opérations dans l'ordre puis valide le tout. Atomique : la première
+    opération en échec annule le lot (erreur HTTP de cette opération). Sinon chaque
+    opération a son point de sauvegarde et son échec est rapporté dans son résultat.
+    Retourne (résultats par opération, ingrédients du stock touchés).
+    """
+    _check(operations)
+    now = datetime.now()
+    purge(db, now)
+    recorded = {
+        row.id: row for row in db.execute(
+            select(BatchOperation).where(BatchOperation.id.in_([op.id for op in operations]))
+        ).scalars()
+    }
+    results, touched = [], set()
+    for index, op in enumerate(operations):
+        fingerprint = jobs.request_hash(op.op, op.args)
+        try:
+            previous = recorded.get(op.id)
+            if previous is not None:
+                if previous.request_hash != fingerprint:
+                    raise HTTPException(status_code=422, detail="Identifiant déjà utilisé pour une autre opération")
+                replayed = json.loads(previous.result) if previous.result else None
+                results.append({"id": op.id, "op": op.op, "status": "replayed", "result": replayed})
+                continue
+            if atomic:
+                result, changed = OPERATIONS[op.op](db, op.args)
+                db.add(_trace(op, fingerprint, result, now))
+            else:
+                with db.begin_nested():
+                    result, changed = OPERATIONS[op.op](db, op.args)
+                    db.add(_trace(op, fingerprint, result, now))
+        except Exception as e:
+            if isinstance(e, HTTPException):
+                status_code, detail = e.status_code, e.detail
+            elif isinstance(e, (ValueError, TypeError)):
+                # Arguments bruts passés tels quels aux traitements (quantité "abc", liste attendue...)
+                status_code, detail = 400, f"Argument invalide : {e}"
+            else:
+                status_code, detail = 500, str(e)
+            if atomic:
+                db.rollback()
+                raise HTTPException(status_code=status_code,
+                                    detail=f"Opération {index} ({op.id}, {op.op}) : {detail}. Lot annulé.")
+            results.append({"id": op.id, "op": op.op, "status": "error", "code": status_code, "error": detail})
+            continue
+        touched.update(changed)
+        results.append({"id": op.id, "op": op.op, "status": "ok", "result": result})
+    try:
+        db.commit()
+    except IntegrityError:
+        # Le même lot validé entre-temps par une requête concurrente : le renvoyer rejoue ses résultats
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Lot en cours de synchronisation par une autre requête, "
+                                                    "réessayez")
+    return results, sorted(touched)
@@ -0,0 +1,466 @@
+"""
+Flux de changements ligne à ligne (liste de courses, stock, plans de repas), diffusé en SSE.
+
+Chaque transaction validée qui touche ces tables produit un événement
+{"seq": n, "changes": [{"table", "op": "upsert" | "delete" | "reset", "key", "row"}]}.
+`seq` est croissant : un client qui se reconnecte reprend après le dernier reçu
+(Last-Event-ID), ou reçoit un "reset" (tout relire) si l'historique ne remonte plus assez loin.
+
+Les clés modifiées sont notées dans la session (flush ORM automatiquement, changefeed.mark
+pour les requêtes ensemblistes) ; les lignes sont relues juste avant le commit.
+
+Broker (CHANGE_FEED_BROKER), un par cuisine (seq propres à chaque cuisine) :
+- "memory" : historique et diffusion dans le processus (un seul worker, tests) ;
+- "database" : événements écrits dans change_events dans la transaction même, puis relus
+  par chaque worker uvicorn (un thread de scrutation par processus et par cuisine écoutée).
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.orm import Session
+from database import PerKitchen, session_kitchen
+from models import ChangeEvent, Ingredient, MealPlan, PantryItem, ShoppingList
+from services.listing import INGREDIENT_FIELDS
+
+CHANGE_FEED_BROKER = os.getenv("CHANGE_FEED_BROKER", "memory")
+FEED_HISTORY = int(os.getenv("FEED_HISTORY", "1000"))            # transactions rejouables
+FEED_POLL_INTERVAL = float(os.getenv("FEED_POLL_INTERVAL", "0.5"))  # secondes (broker database)
+FEED_GAP_GRACE = float(os.getenv("FEED_GAP_GRACE", "5"))          # attente d'un seq manquant (broker database)
+FEED_QUEUE_SIZE = 1000                                             # événements en attente par client
+FEED_KEEPALIVE = 15.0
+KEY_CHUNK = 500
+
+KEYS_KEY = "feed_keys"
+RESETS_KEY = "feed_resets"
+PENDING_KEY = "feed_pending"
+
+
+# --- LECTURE DES LIGNES MODIFIÉES ---
+def _ingredient(row):
+    if row.ingredient_name is None:
+        return None
+    return {f: getattr(row, f"ingredient_{f}") for f in INGREDIENT_FIELDS}
+
+
+_INGREDIENT_COLUMNS = [getattr(Ingredient, f).label(f"ingredient_{f}") for f in INGREDIENT_FIELDS]
+
+WATCHED = {
+    ShoppingList.__tablename__: (
+        ShoppingList.id,
+        select(ShoppingList.id, ShoppingList.ingredient_id, ShoppingList.quantity_needed,
+               ShoppingList.quantity_canonical, ShoppingList.is_checked, ShoppingList.source, *_INGREDIENT_COLUMNS)
+        .outerjoin(Ingredient, Ingredient.id == ShoppingList.ingredient_id),
+        lambda r: {"id": r.id, "ingredient_id": r.ingredient_id, "quantity_needed": r.quantity_needed,
+                   "quantity_canonical": r.quantity_canonical, "is_checked": bool(r.is_checked),
+                   "source": r.source, "ingredient": _ingredient(r)},
+    ),
+    PantryItem.__tablename__: (
+        PantryItem.ingredient_id,
+        select(PantryItem.ingredient_id, PantryItem.quantity_available, PantryItem.quantity_canonical,
+               *_INGREDIENT_COLUMNS)
+        .outerjoin(Ingredient, Ingredient.id == PantryItem.ingredient_id),
+        lambda r: {"ingredient_id": r.ingredient_id, "quantity_available": r.quantity_available,
+                   "quantity_canonical": r.quantity_canonical, "ingredient": _ingredient(r)},
+    ),
+    MealPlan.__tablename__: (
+        MealPlan.id,
+        select(MealPlan.id, MealPlan.date, MealPlan.slot, MealPlan.recipe_id),
+        lambda r: {"id": r.id, "date": r.date.isoformat() if r.date else None, "slot": r.slot,
+                   "recipe_id": r.recipe_id},
+    ),
+}
+
+
+def mark(session: Session, table: str, keys):
+    """Signale des lignes modifiées par une requête ensembliste (insert, update ou delete)."""
+    session.info.setdefault(KEYS_KEY, {}).setdefault(table, set()).update(k for k in keys if k is not None)
+
+
+def mark_reset(session: Session, *tables):
+    """Modification en masse dont les clés ne sont pas connues : les clients relisent la table."""
+    session.info.setdefault(RESETS_KEY, set()).update(tables)
+
+
+def _collect(session: Session, keys: dict, resets: set, with_rows: bool):
+    changes = [{"table": table, "op": "reset"} for table in sorted(resets)]
+    for table, table_keys in keys.items():
+        if table in resets or not table_keys:
+            continue
+        if not with_rows:
+            # Personne n'écoute : un reset suffit pour un client qui reprendrait plus tard
+            changes.append({"table": table, "op": "reset"})
+            continue
+        key_column, query, to_dict = WATCHED[table]
+        found = {}
+        ordered = sorted(table_keys)
+        for i in range(0, len(ordered), KEY_CHUNK):
+            for row in session.execute(query.where(key_column.in_(ordered[i:i + KEY_CHUNK]))):
+                found[row[0]] = to_dict(row)
+        for key in ordered:
+            if key in found:
+                changes.append({"table": table, "op": "upsert", "key": key, "row": found[key]})
+            else:
+                changes.append({"table": table, "op": "delete", "key": key})
+    return changes
+
+
+# --- ABONNÉS ---
+class Subscription:
+    """File d'un client SSE, alimentée depuis n'importe quel thread."""
+    def __init__(self, loop, size: int = FEED_QUEUE_SIZE):
+        self.loop = loop
+        self.queue = asyncio.Queue(size)
+        self.overflow = False
+        self.closed = False
+
+    def push(self, evt):
+        self.loop.call_soon_threadsafe(self._put, evt)
+
+    def _put(self, evt):
+        try:
+            self.queue.put_nowait(evt)
+        except asyncio.QueueFull:
+            # Client trop lent : il recevra un reset au lieu des événements perdus
+            self.overflow = True
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._subscribers = set()
+
+    def subscribe(self, loop) -> Subscription:
+        sub = Subscription(loop)
+        with self._lock:
+            self._subscribers.add(sub)
+        self._on_subscribe()
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def _dispatch(self, evt):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.push(evt)
+
+    def _on_subscribe(self):
+        pass
+
+    def idle(self) -> bool:
+        return not self._subscribers
+
+    def close(self):
+        # Broker abandonné (cuisine déplacée) : les flux se terminent, EventSource se reconnecte
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.closed = True
+            sub.push(None)
+
+    # Interface des implémentations
+    def needs_rows(self) -> bool:
+        raise NotImplementedError
+
+    def stage(self, session: Session, changes):
+        """Dans la transaction, avant le commit."""
+        raise NotImplementedError
+
+    def committed(self, session: Session):
+        """Après le commit : diffusion."""
+        raise NotImplementedError
+
+    def since(self, after):
+        """(événements de seq > after, seq courant) ; None si l'historique ne remonte pas jusque-là."""
+        raise NotImplementedError
+
+
+class MemoryBroker(Broker):
+    def __init__(self, history: int = FEED_HISTORY):
+        super().__init__()
+        # Départ aléatoire : un broker recréé (redémarrage, éviction) ne rejoue pas les seq d'un ancien
+        self._seq = random.randrange(1, 1 << 30) * 1000
+        self._history = deque(maxlen=history)
+
+    def needs_rows(self) -> bool:
+        return bool(self._subscribers)
+
+    def stage(self, session, changes):
+        session.info[PENDING_KEY] = changes
+
+    def committed(self, session):
+        changes = session.info.pop(PENDING_KEY, None)
+        if not changes:
+            return
+        with self._lock:
+            # Diffusion sous le verrou : les clients reçoivent les seq dans l'ordre
+            self._seq += 1
+            evt = {"seq": self._seq, "changes": changes}
+            self._history.append(evt)
+            self._dispatch(evt)
+
+    def since(self, after):
+        with self._lock:
+            current = self._seq
+            if after is None or after == current:
+                return [], current
+            # seq inconnu (processus redémarré) ou sorti de l'historique
+            if after > current or not self._history or self._history[0]["seq"] > after + 1:
+                return None, current
+            return [evt for evt in self._history if evt["seq"] > after], current
+
+
+class DatabaseBroker(Broker):
+    """
+    Table change_events (boîte d'envoi) : l'événement est validé avec les données.
+    Chaque processus scrute la table et diffuse à ses propres clients ; un commit local
+    réveille la scrutation.
+
+    seq est alloué à l'insertion, pas au commit : sur Postgres, une transaction peut valider
+    seq 12 alors que seq 11 est encore en cours (ou annulé, le seq est alors perdu). Les
+    événements sont diffusés dans l'ordre des seq jusqu'au premier trou ; un trou qui reste
+    vide plus de FEED_GAP_GRACE secondes est abandonné (transaction annulée). Sur SQLite,
+    le verrou d'écriture et AUTOINCREMENT ne laissent pas de trou.
+    """
+    def __init__(self, kitchen: str, session_factory=None, history: int = FEED_HISTORY,
+                 interval: float = FEED_POLL_INTERVAL, grace: float = FEED_GAP_GRACE):
+        super().__init__()
+        self._kitchen = kitchen
+        self._session_factory = session_factory
+        self._history = history
+        self._interval = interval
+        self._grace = grace
+        self._wake = threading.Event()
+        self._thread = None
+        self._last = None       # tous les seq <= _last sont diffusés ou abandonnés
+        self._gap_seen = None   # premier constat du trou qui suit _last (time.monotonic)
+        self._closed = False
+
+    def _factory(self):
+        if self._session_factory is not None:
+            return self._session_factory
+        # Résolu à chaque fois : la cuisine peut avoir changé de shard
+        import database
+        return database.router.sessionmaker(self._kitchen)
+
+    def needs_rows(self) -> bool:
+        return True
+
+    def stage(self, session, changes):
+        session.execute(insert(ChangeEvent).values(payload=json.dumps(changes, default=str),
+                                                   created_at=datetime.now()))
+        session.info[PENDING_KEY] = True
+
+    def committed(self, session):
+        if session.info.pop(PENDING_KEY, None):
+            self._wake.set()
+
+    def _rows_after(self, db, after, limit=None, upto=None):
+        query = select(ChangeEvent.seq, ChangeEvent.payload).where(ChangeEvent.seq > after).order_by(ChangeEvent.seq)
+        if upto is not None:
+            query = query.where(ChangeEvent.seq <= upto)
+        if limit:
+            query = query.limit(limit)
+        return [{"seq": seq, "changes": json.loads(payload)} for seq, payload in db.execute(query)]
+
+    def _watermark(self, db) -> int:
+        # Point de départ : dernier événement assez ancien pour qu'aucun trou avant lui ne se comble ;
+        # les plus récents passent par la scrutation
+        with self._lock:
+            if self._last is None:
+                settled = datetime.now() - timedelta(seconds=self._grace)
+                self._last = db.execute(select(func.max(ChangeEvent.seq))
+                                        .where(ChangeEvent.created_at <= settled)).scalar() or 0
+                self._gap_seen = None
+            return self._last
+
+    def since(self, after):
+        db = self._factory()()
+        try:
+            # Rattrapage borné à ce que la scrutation a diffusé : la suite arrive en direct, dans l'ordre
+            current = self._watermark(db)
+            if after is None or after == current:
+                return [], current
+            oldest, newest = db.execute(select(func.min(ChangeEvent.seq), func.max(ChangeEvent.seq))).one()
+            if after > (newest or 0) or oldest is None or oldest > after + 1:
+                return None, current
+            if after > current:
+                # Déjà reçu d'un autre processus, en avance sur celui-ci
+                return [], after
+            return self._rows_after(db, after, upto=current), current
+        finally:
+            db.close()
+
+    # --- SCRUTATION ---
+    def _on_subscribe(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll_loop, name=f"change-feed-{self._kitchen}",
+                                                daemon=True)
+                self._thread.start()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        super().close()
+
+    def _poll_loop(self):
+        polls = 0
+        while True:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            with self._lock:
+                # Plus personne à l'écoute : le thread s'arrête, le prochain abonné le relance
+                if self._closed or not self._subscribers:
+                    self._thread = None
+                    self._last = None
+                    return
+            db = self._factory()()
+            try:
+                now = time.monotonic()
+                for evt in self._rows_after(db, self._watermark(db), limit=500):
+                    if evt["seq"] > self._last + 1:
+                        # Trou : transaction pas encore validée, ou annulée si le délai est dépassé
+                        if self._gap_seen is None:
+                            self._gap_seen = now
+                        if now - self._gap_seen < self._grace:
+                            break
+                    self._gap_seen = None
+                    self._last = evt["seq"]
+                    self._dispatch(evt)
+                polls += 1
+                if polls % 120 == 0:
+                    # Purge : seuls les FEED_HISTORY derniers événements restent rejouables
+                    db.execute(delete(ChangeEvent).where(ChangeEvent.seq <= self._last - self._history))
+                    db.commit()
+            except Exception as e:
+                print(f"Flux de changements : erreur de scrutation : {e}")
+            finally:
+                db.close()
+
+
+def make_broker(kitchen: str, kind: str = CHANGE_FEED_BROKER) -> Broker:
+    if kind == "database":
+        return DatabaseBroker(kitchen)
+    if kind == "memory":
+        return MemoryBroker()
+    raise ValueError(f"CHANGE_FEED_BROKER inconnu : {kind}")
+
+
+# Un broker par cuisine ; un broker écouté n'est jamais évincé
+brokers = PerKitchen(make_broker)
+
+
+# --- ÉVÉNEMENTS DE SESSION ---
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table in WATCHED:
+            key = getattr(obj, WATCHED[table][0].key, None)
+            if key is not None:
+                mark(session, table, [key])
+
+
+@event.listens_for(Session, "before_commit")
+def _stage_changes(session):
+    session.flush()
+    keys = session.info.pop(KEYS_KEY, None)
+    resets = session.info.pop(RESETS_KEY, None)
+    if not keys and not resets:
+        return
+    broker = brokers.get(session_kitchen(session))
+    changes = _collect(session, keys or {}, resets or set(), broker.needs_rows())
+    if changes:
+        broker.stage(session, changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session):
+    if PENDING_KEY in session.info:
+        brokers.get(session_kitchen(session)).committed(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changes(session):
+    for key in (KEYS_KEY, RESETS_KEY, PENDING_KEY):
+        session.info.pop(key, None)
+
+
+# --- FLUX SSE ---
+def _filter(evt, tables):
+    if tables is None:
+        return evt
+    changes = [c for c in evt["changes"] if c["table"] in tables]
+    return {"seq": evt["seq"], "changes": changes} if changes else None
+
+
+def _sse(name, evt) -> str:
+    return f"id: {evt['seq']}\nevent: {name}\ndata: {json.dumps(evt, default=str)}\n\n"
+
+
+def parse_tables(tables):
+    if not tables:
+        return None
+    wanted = {t.strip() for t in tables.split(",") if t.strip()}
+    unknown = wanted - set(WATCHED)
+    if unknown:
+        raise ValueError(f"Tables inconnues : {', '.join(sorted(unknown))}")
+    return wanted
+
+
+async def sse_stream(request, kitchen, after=None, tables=None):
+    """
+    Générateur SSE : rattrapage depuis `after` puis événements en direct.
+    Événements : "hello" (seq courant, à la première connexion), "change", "reset".
+    """
+    from anyio import to_thread
+    broker = brokers.get(kitchen)
+    sub = broker.subscribe(asyncio.get_running_loop())
+    try:
+        # Abonné avant la lecture de l'historique : aucun événement ne passe entre les deux
+        backlog, current = await to_thread.run_sync(broker.since, after)
+        last = current if backlog is None or after is None else after
+        if after is None:
+            yield _sse("hello", {"seq": current, "changes": []})
+        elif backlog is None:
+            yield _sse("reset", {"seq": current, "changes": []})
+        else:
+            for evt in backlog:
+                last = evt["seq"]
+                evt = _filter(evt, tables)
+                if evt:
+                    yield _sse("change", evt)
+        while True:
+            if await request.is_disconnected():
+                return
+            try:
+                evt = await asyncio.wait_for(sub.queue.get(), FEED_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if sub.closed:
+                return
+            if sub.overflow:
+                sub.overflow = False
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                last = evt["seq"]
+                yield _sse("reset", {"seq": last, "changes": []})
+                continue
+            if evt["seq"] <= last:
+                continue
+            last = evt["seq"]
+            evt = _filter(evt, tables)
+            if evt:
+                yield _sse("change", evt)
+    finally:
+        broker.unsubscribe(sub)
@@ -0,0 +1,181 @@
+"""
+Démarrage à froid : durée des imports et des initialisations (hooks de démarrage,
+première ouverture des cuisines, construction du client IA).
+
+L'import de main et chaque phase d'initialisation sont toujours mesurés : résumé au
+démarrage et jauges kitchen_startup_* de /metrics. Avec STARTUP_PROFILE=1, chaque module
+importé est en plus chronométré (temps propre et cumulé, comme python -X importtime) et
+les STARTUP_PROFILE_TOP plus coûteux sont affichés au démarrage.
+
+    STARTUP_PROFILE=1 uvicorn main:app
+    python -m services.coldstart --top 30 --output /tmp/coldstart.json --budget 1.5
+
+Ce module est importé en premier par main et ne dépend que de la bibliothèque standard.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "") not in ("", "0")
+STARTUP_PROFILE_TOP = int(os.getenv("STARTUP_PROFILE_TOP", "25"))
+
+STARTED = time.perf_counter()
+
+_lock = threading.Lock()
+_phases = {}      # { phase: [nombre, secondes] }
+_imports = {}     # { module: (propre, cumulé, importé par) }
+_timeline = {}    # { "import" | "ready": secondes depuis l'import de ce module }
+
+
+# --- PHASES D'INITIALISATION ---
+def record(name: str, seconds: float):
+    with _lock:
+        entry = _phases.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def _timed(hook):
+    name = f"startup:{hook.__name__}"
+    if inspect.iscoroutinefunction(hook):
+        @wraps(hook)
+        async def run():
+            with phase(name):
+                return await hook()
+    else:
+        @wraps(hook)
+        def run():
+            with phase(name):
+                return hook()
+    return run
+
+
+def instrument(app):
+    """
+    À appeler à la fin de main : clôt la mesure des imports, chronomètre chaque hook
+    de démarrage de l'application et ajoute le rapport en dernier hook.
+    """
+    _timeline["import"] = time.perf_counter() - STARTED
+    app.router.on_startup[:] = [_timed(hook) for hook in app.router.on_startup] + [report]
+
+
+# --- PROFIL DES IMPORTS ---
+def _install_import_profiler():
+    # `_find_and_load` est appelé pour chaque module absent de sys.modules (point mesuré par -X importtime)
+    import importlib._bootstrap as bootstrap
+    original = getattr(bootstrap, "_find_and_load", None)
+    if original is None:
+        print("STARTUP_PROFILE : profil des imports indisponible sur cette version de Python")
+        return
+    local = threading.local()
+
+    def find_and_load(name, import_):
+        stack = local.__dict__.setdefault("stack", [])
+        frame = [name, 0.0]  # module, temps des sous-imports
+        parent = stack[-1][0] if stack else None
+        stack.append(frame)
+        started = time.perf_counter()
+        try:
+            return original(name, import_)
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            if name in sys.modules and name not in _imports:
+                _imports[name] = (elapsed - frame[1], elapsed, parent)
+
+    bootstrap._find_and_load = find_and_load
+
+
+if STARTUP_PROFILE:
+    _install_import_profiler()
+
+
+# --- RAPPORT ---
+def snapshot(top: int = STARTUP_PROFILE_TOP) -> dict:
+    with _lock:
+        phases = {name: {"count": n, "seconds": round(s, 6)} for name, (n, s) in sorted(_phases.items())}
+    imported = list(_imports.items())
+    modules = sorted(imported, key=lambda item: -item[1][0])[:top]
+    # Temps propre cumulé par paquet de premier niveau : ce qu'il faudrait différer pour gagner du temps
+    packages = {}
+    for name, (own, _, _) in imported:
+        root = name.partition(".")[0]
+        packages[root] = packages.get(root, 0.0) + own
+    return {
+        "import_seconds": round(_timeline.get("import", 0.0), 6),
+        "ready_seconds": round(_timeline.get("ready", 0.0), 6),
+        "phases": phases,
+        "profiled": STARTUP_PROFILE,
+        "modules": [{"module": name, "self_seconds": round(own, 6), "cumulative_seconds": round(total, 6),
+                     "imported_by": parent} for name, (own, total, parent) in modules],
+        "packages": {name: round(s, 6) for name, s in
+                     sorted(packages.items(), key=lambda item: -item[1])[:top]},
+    }
+
+
+def report():
+    # Dernier hook de démarrage : l'application est prête
+    _timeline["ready"] = time.perf_counter() - STARTED
+    data = snapshot()
+    print(f"Démarrage : imports {data['import_seconds']:.3f}s, prêt en {data['ready_seconds']:.3f}s")
+    if not STARTUP_PROFILE:
+        return
+    for name, entry in data["phases"].items():
+        print(f"  {name:40s} {entry['seconds'] * 1000:9.1f} ms  (x{entry['count']})")
+    print(f"  {'module':48s} {'propre':>9s} {'cumulé':>9s}")
+    for entry in data["modules"]:
+        print(f"  {entry['module'][:48]:48s} {entry['self_seconds'] * 1000:7.1f}ms "
+              f"{entry['cumulative_seconds'] * 1000:7.1f}ms  <- {entry['imported_by'] or '-'}")
+    print("  Par paquet : " + ", ".join(f"{name} {s * 1000:.0f}ms" for name, s in list(data["packages"].items())[:10]))
+
+
+# --- LIGNE DE COMMANDE ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mesure du démarrage à froid de l'API (import de main + démarrage)")
+    parser.add_argument("--top", type=int, default=STARTUP_PROFILE_TOP, help="modules affichés")
+    parser.add_argument("--output", help="rapport JSON")
+    parser.add_argument("--budget", type=float, help="code de sortie 1 si l'API est prête après ce délai (s)")
+    args = parser.parse_args(argv)
+
+    # Module relancé par `python -m` : l'instance importée par main doit profiler les imports
+    os.environ["STARTUP_PROFILE"] = "1"
+    os.environ["STARTUP_PROFILE_TOP"] = str(args.top)
+    import main as app_module
+    from services import coldstart
+
+    async def cycle():
+        # Démarrage puis arrêt, comme le serveur (hooks on_event compris)
+        async with app_module.app.router.lifespan_context(app_module.app):
+            pass
+
+    asyncio.run(cycle())
+    data = coldstart.snapshot(args.top)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+    if args.budget is not None and data["ready_seconds"] > args.budget:
+        print(f"Démarrage trop lent : {data['ready_seconds']:.3f}s > {args.budget:.3f}s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
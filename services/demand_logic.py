@@ -0,0 +1,207 @@
+from sqlalchemy import case, delete, exists, func, insert, literal, select, union_all, update
+from sqlalchemy.orm import Session
+from models import Ingredient, IngredientDemand, MealPlan, PantryItem, RecipeIngredient, ShoppingList, WeeklyStaple
+from services import changefeed
+from services.meal_plan_logic import in_window
+from services.units import from_canonical, unit_factor_sql
+
+# En dessous de ce seuil, une quantité est considérée comme nulle (dérive des flottants)
+EPSILON = 1e-9
+
+
+# --- MAINTENANCE DE LA TABLE DE DEMANDE ---
+def demand_select(date_from=None, date_to=None):
+    """
+    SELECT ingredient_id, planned_qty, staple_qty agrégé par GROUP BY, en quantités
+    canoniques. Avec une fenêtre, seuls les plans datés dans [date_from, date_to] comptent
+    (parcours de l'index date, créneau).
+    """
+    planned = in_window(
+        select(RecipeIngredient.ingredient_id.label("ingredient_id"),
+               RecipeIngredient.quantity_canonical.label("planned_qty"),
+               literal(0.0).label("staple_qty"))
+        .join(MealPlan, MealPlan.recipe_id == RecipeIngredient.recipe_id),
+        date_from, date_to,
+    )
+    # Les basiques sont saisis dans l'unité de l'ingrédient
+    staples = (
+        select(WeeklyStaple.ingredient_id, literal(0.0),
+               WeeklyStaple.default_quantity * unit_factor_sql(Ingredient.unit))
+        .join(Ingredient, Ingredient.id == WeeklyStaple.ingredient_id)
+    )
+    rows = union_all(planned, staples).subquery()
+    return (
+        select(rows.c.ingredient_id.label("ingredient_id"),
+               func.coalesce(func.sum(rows.c.planned_qty), 0.0).label("planned_qty"),
+               func.coalesce(func.sum(rows.c.staple_qty), 0.0).label("staple_qty"))
+        .group_by(rows.c.ingredient_id)
+    )
+
+
+def rebuild_demand(db: Session, ingredient_ids=None):
+    """Recalcule ingredient_demand : entièrement (démarrage, réparation) ou pour les ingrédients donnés."""
+    if ingredient_ids is None:
+        db.execute(delete(IngredientDemand))
+        db.execute(
+            insert(IngredientDemand).from_select(["ingredient_id", "planned_qty", "staple_qty"], demand_select())
+        )
+        return
+    ingredient_ids = list(ingredient_ids)
+    rows = demand_select().subquery()
+    db.execute(delete(IngredientDemand).where(IngredientDemand.ingredient_id.in_(ingredient_ids)))
+    db.execute(
+        insert(IngredientDemand).from_select(
+            ["ingredient_id", "planned_qty", "staple_qty"],
+            select(rows.c.ingredient_id, rows.c.planned_qty, rows.c.staple_qty)
+            .where(rows.c.ingredient_id.in_(ingredient_ids))
+        )
+    )
+
+
+def _ensure_rows(db: Session, ingredient_ids):
+    """Crée à zéro les lignes de demande absentes pour les ingrédients sélectionnés."""
+    db.execute(
+        insert(IngredientDemand).from_select(
+            ["ingredient_id", "planned_qty", "staple_qty"],
+            select(ingredient_ids.c.ingredient_id, literal(0.0), literal(0.0))
+            .where(~exists().where(IngredientDemand.ingredient_id == ingredient_ids.c.ingredient_id))
+        )
+    )
+
+
+def recipe_multiplier(factors: dict):
+    """Expression SQL valant factors[recipe_id] pour chaque ligne de recette."""
+    return case(factors, value=RecipeIngredient.recipe_id, else_=0.0)
+
+
+def apply_recipe_delta(db: Session, recipe_id: int, factor: float):
+    """
+    Ajoute `factor` fois les lignes d'une recette à la demande planifiée
+    (+1 à l'ajout d'un plan, -1 à sa suppression ou quand il est cuisiné).
+    """
+    apply_recipes_delta(db, {recipe_id: factor})
+
+
+def apply_recipes_delta(db: Session, factors: dict):
+    """Variante par lot : { recipe_id: facteur }, en un nombre constant de requêtes."""
+    factors = {recipe_id: f for recipe_id, f in factors.items() if f}
+    if not factors:
+        return
+    _apply_planned(db, RecipeIngredient.recipe_id.in_(list(factors)), recipe_multiplier(factors))
+
+
+def apply_lines_delta(db: Session, line_ids, factor: float):
+    """Ajoute `factor` fois les seules lignes de recette données (mise à jour d'une recette par diff)."""
+    if not factor or not line_ids:
+        return
+    _apply_planned(db, RecipeIngredient.id.in_(list(line_ids)), factor)
+
+
+def _apply_planned(db: Session, condition, multiplier):
+    lines = (
+        select(RecipeIngredient.ingredient_id)
+        .where(condition)
+        .distinct()
+        .subquery()
+    )
+    _ensure_rows(db, lines)
+    per_ingredient = (
+        select(func.sum(RecipeIngredient.quantity_canonical * multiplier))
+        .where(condition, RecipeIngredient.ingredient_id == IngredientDemand.ingredient_id)
+        .scalar_subquery()
+    )
+    db.execute(
+        update(IngredientDemand)
+        .where(IngredientDemand.ingredient_id.in_(select(lines.c.ingredient_id)))
+        .values(planned_qty=IngredientDemand.planned_qty + func.coalesce(per_ingredient, 0.0))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def count_plans(db: Session, recipe_id: int) -> int:
+    return db.query(func.count(MealPlan.id)).filter(MealPlan.recipe_id == recipe_id).scalar() or 0
+
+
+def apply_staple_delta(db: Session, ingredient_id: int, delta: float):
+    """`delta` est exprimé dans l'unité de l'ingrédient, converti par la base."""
+    if not delta:
+        return
+    _ensure_rows(db, select(literal(ingredient_id).label("ingredient_id")).subquery())
+    ingredient_unit = select(Ingredient.unit).where(Ingredient.id == ingredient_id).scalar_subquery()
+    db.execute(
+        update(IngredientDemand)
+        .where(IngredientDemand.ingredient_id == ingredient_id)
+        .values(staple_qty=IngredientDemand.staple_qty + delta * unit_factor_sql(ingredient_unit))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# --- DIFF AVEC LA LISTE DE COURSES ---
+def sync_shopping_list(db: Session, source: str, include_staples: bool = False, date_from=None, date_to=None):
+    """
+    Aligne les lignes `source` de la liste de courses sur (demande - stock) :
+    seules les lignes dont le manque a changé sont insérées, modifiées ou supprimées.
+    Sans fenêtre, la demande vient de la table tenue à jour par deltas (tous les plans) ;
+    avec `date_from` / `date_to`, elle est agrégée sur les seuls plans de l'horizon.
+    Le manque est calculé par la base sur les quantités canoniques, puis ré-exprimé
+    dans l'unité de l'ingrédient. Retourne (ajoutés, couverts) au format du rapport de génération.
+    """
+    if date_from or date_to:
+        demand = demand_select(date_from, date_to).subquery()
+    else:
+        demand = IngredientDemand.__table__
+    demand_qty = demand.c.planned_qty
+    if include_staples:
+        demand_qty = demand_qty + demand.c.staple_qty
+    stock = func.coalesce(PantryItem.quantity_canonical, 0.0)
+    rows = db.execute(
+        select(demand.c.ingredient_id, Ingredient.name, Ingredient.unit,
+               demand_qty.label("needed"), stock.label("stock"), (demand_qty - stock).label("missing"))
+        .join(Ingredient, Ingredient.id == demand.c.ingredient_id)
+        .outerjoin(PantryItem, PantryItem.ingredient_id == demand.c.ingredient_id)
+        .where(demand_qty > EPSILON)
+    ).all()
+
+    current, stale = {}, []
+    for item_id, ing_id, qty in db.execute(
+        select(ShoppingList.id, ShoppingList.ingredient_id, ShoppingList.quantity_canonical)
+        .where(ShoppingList.source == source)
+    ):
+        if ing_id in current:
+            # Doublon hérité d'une ancienne génération : on ne garde qu'une ligne
+            stale.append(item_id)
+        else:
+            current[ing_id] = (item_id, qty)
+
+    added_items, skipped_items = [], []
+    inserts, updates = [], []
+    for ing_id, name, unit, needed, qty_available, qty_missing in rows:
+        item_info = {"name": name or "Inconnu", "unit": unit or "unit",
+                     "needed": from_canonical(needed, unit), "stock": from_canonical(qty_available, unit)}
+        existing = current.pop(ing_id, None)
+        if qty_missing > EPSILON:
+            display_qty = from_canonical(qty_missing, unit)
+            item_info["added_qty"] = display_qty
+            added_items.append(item_info)
+            if existing is None:
+                inserts.append({"ingredient_id": ing_id, "quantity_needed": display_qty,
+                                "quantity_canonical": qty_missing, "is_checked": False, "source": source})
+            elif abs((existing[1] or 0.0) - qty_missing) > EPSILON:
+                updates.append({"id": existing[0], "quantity_needed": display_qty,
+                                "quantity_canonical": qty_missing})
+        else:
+            skipped_items.append(item_info)
+            if existing is not None:
+                stale.append(existing[0])
+    stale.extend(item_id for item_id, _ in current.values())
+
+    if stale:
+        db.execute(delete(ShoppingList).where(ShoppingList.id.in_(stale)).execution_options(synchronize_session=False))
+        changefeed.mark(db, ShoppingList.__tablename__, stale)
+    if updates:
+        db.execute(update(ShoppingList), updates)
+        changefeed.mark(db, ShoppingList.__tablename__, [row["id"] for row in updates])
+    if inserts:
+        inserted = db.execute(insert(ShoppingList.__table__).returning(ShoppingList.__table__.c.id), inserts)
+        changefeed.mark(db, ShoppingList.__tablename__, inserted.scalars().all())
+    return added_items, skipped_items
@@ -0,0 +1,276 @@
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from database import PerKitchen, session_kitchen
+from models import Ingredient
+from services.table_versions import versions
+
+# Clé de Session.info : { "ids": ingrédients modifiés, "rebuild": écriture non attribuable }
+CHANGES_KEY = "ingredient_changes"
+
+# Score de Dice minimal (trigrammes communs) pour une correspondance approximative
+FUZZY_THRESHOLD = 0.3
+MATCH_THRESHOLD = 0.5
+# Au-delà de cette taille, un trigramme ne sert plus à trouver des candidats (trop courant)
+FUZZY_MAX_POSTINGS = 2000
+
+_LIGATURES = str.maketrans({"œ": "oe", "æ": "ae", "ß": "ss"})
+_SEPARATORS = re.compile(r"[^a-z0-9]+")
+
+
+def fold(text: str) -> str:
+    """Forme de recherche : minuscules, sans accents ni ponctuation ("Crème fraîche" -> "creme fraiche")."""
+    text = (text or "").lower()
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text.translate(_LIGATURES))
+        text = "".join(c for c in text if not unicodedata.combining(c))
+    return _SEPARATORS.sub(" ", text).strip()
+
+
+def trigrams(folded: str) -> set:
+    grams = set()
+    for word in folded.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class IngredientIndex:
+    """
+    Index mémoire des noms d'ingrédients : recherche par préfixe (liste triée des
+    noms et de chaque mot, parcourue par dichotomie) et approximative (trigrammes).
+
+    Comme la matrice de suggestions, l'index se met à jour paresseusement au premier
+    appel suivant une écriture : la version de la table `ingredients` indique s'il y a
+    du nouveau, les écritures de ce processus disent quelles lignes relire, et une
+    écriture venue d'ailleurs (autre worker) provoque une reconstruction complète.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._local_commits = 0
+        self._dirty = set()
+        self._rebuild = False
+        self._clear()
+
+    def _clear(self):
+        self._entries = {}    # { id: (nom, catégorie, unité, nom replié) }
+        self._exact = {}      # { nom replié: id }
+        self._names = []      # [(nom replié, id)] triée
+        self._words = []      # [(mot, id)] triée, mots après le premier
+        self._grams = defaultdict(set)
+        self._gram_counts = {}
+        self._max_id = 0
+
+    # --- SIGNALEMENT DES CHANGEMENTS ---
+    def ingredients_changed(self, ingredient_ids=(), rebuild: bool = False):
+        with self._lock:
+            self._local_commits += 1
+            self._dirty.update(ingredient_ids)
+            self._rebuild = self._rebuild or rebuild
+
+    def reset(self):
+        with self._lock:
+            self._version = None
+
+    # --- MAINTENANCE ---
+    def _add(self, ing_id, name, category, unit):
+        folded = fold(name)
+        self._entries[ing_id] = (name, category, unit, folded)
+        self._exact.setdefault(folded, ing_id)
+        insort(self._names, (folded, ing_id))
+        for word in folded.split()[1:]:
+            insort(self._words, (word, ing_id))
+        grams = trigrams(folded)
+        for gram in grams:
+            self._grams[gram].add(ing_id)
+        self._gram_counts[ing_id] = len(grams)
+        self._max_id = max(self._max_id, ing_id)
+
+    def _remove(self, ing_id):
+        entry = self._entries.pop(ing_id, None)
+        if entry is None:
+            return
+        folded = entry[3]
+        if self._exact.get(folded) == ing_id:
+            del self._exact[folded]
+        self._names.pop(bisect_left(self._names, (folded, ing_id)))
+        for word in folded.split()[1:]:
+            self._words.pop(bisect_left(self._words, (word, ing_id)))
+        for gram in trigrams(folded):
+            self._grams[gram].discard(ing_id)
+        self._gram_counts.pop(ing_id, None)
+
+    def _load_all(self, db: Session):
+        self._clear()
+        rows = db.execute(select(Ingredient.id, Ingredient.name, Ingredient.category, Ingredient.unit)).all()
+        for ing_id, name, category, unit in rows:
+            folded = fold(name)
+            self._entries[ing_id] = (name, category, unit, folded)
+            self._exact.setdefault(folded, ing_id)
+            self._names.append((folded, ing_id))
+            self._words.extend((word, ing_id) for word in folded.split()[1:])
+            grams = trigrams(folded)
+            for gram in grams:
+                self._grams[gram].add(ing_id)
+            self._gram_counts[ing_id] = len(grams)
+            self._max_id = max(self._max_id, ing_id)
+        # Tri unique plutôt que des insertions une à une
+        self._names.sort()
+        self._words.sort()
+
+    def _load_changes(self, db: Session, ingredient_ids):
+        query = select(Ingredient.id, Ingredient.name, Ingredient.category, Ingredient.unit).where(
+            (Ingredient.id > self._max_id) | Ingredient.id.in_(list(ingredient_ids))
+        )
+        for ing_id in ingredient_ids:
+            self._remove(ing_id)
+        for ing_id, name, category, unit in db.execute(query):
+            self._remove(ing_id)
+            self._add(ing_id, name, category, unit)
+
+    def _sync(self, db: Session):
+        version = versions(db, ["ingredients"])["ingredients"]
+        if self._version is not None and version == self._version:
+            # Rien de nouveau en base : les écritures signalées y étaient déjà
+            self._local_commits, self._dirty, self._rebuild = 0, set(), False
+            return
+        explained = (
+            self._version is not None and not self._rebuild
+            and version - self._version == self._local_commits
+        )
+        if explained:
+            self._load_changes(db, self._dirty)
+        else:
+            self._load_all(db)
+        self._version = version
+        self._local_commits, self._dirty, self._rebuild = 0, set(), False
+
+    # --- RECHERCHE ---
+    def _result(self, ing_id, score):
+        name, category, unit, _ = self._entries[ing_id]
+        return {"id": ing_id, "name": name, "category": category, "unit": unit, "score": round(score, 3)}
+
+    @staticmethod
+    def _prefixed(keys, prefix, limit, seen):
+        found = []
+        i = bisect_left(keys, (prefix,))
+        while i < len(keys) and len(found) < limit and keys[i][0].startswith(prefix):
+            ing_id = keys[i][1]
+            if ing_id not in seen:
+                seen.add(ing_id)
+                found.append(ing_id)
+            i += 1
+        return found
+
+    def _fuzzy(self, folded, limit, seen, threshold):
+        grams = trigrams(folded)
+        if not grams:
+            return []
+        # Candidats : porteurs des trigrammes rares ; les trigrammes courants
+        # ne font que compléter le compte des candidats retenus
+        postings = sorted((self._grams.get(gram, set()) for gram in grams), key=len)
+        rare = max(1, sum(1 for p in postings if len(p) <= FUZZY_MAX_POSTINGS))
+        shared = Counter()
+        for posting in postings[:rare]:
+            shared.update(posting)
+        scored = []
+        for ing_id, common in shared.items():
+            if ing_id in seen:
+                continue
+            common += sum(1 for posting in postings[rare:] if ing_id in posting)
+            score = 2.0 * common / (len(grams) + self._gram_counts[ing_id])
+            if score >= threshold:
+                scored.append((-score, len(self._entries[ing_id][3]), ing_id))
+        scored.sort()
+        return [(ing_id, -neg) for neg, _, ing_id in scored[:limit]]
+
+    def search(self, db: Session, q: str, limit: int = 10):
+        """
+        Autocomplétion : nom exact, puis noms commençant par `q`, puis noms dont
+        un mot commence par `q`, puis correspondances approximatives (fautes de frappe).
+        """
+        folded = fold(q)
+        if not folded or limit <= 0:
+            return []
+        with self._lock:
+            self._sync(db)
+            seen, results = set(), []
+            exact = self._exact.get(folded)
+            if exact is not None:
+                seen.add(exact)
+                results.append(self._result(exact, 1.0))
+            for keys, score in ((self._names, 0.9), (self._words, 0.8)):
+                for ing_id in self._prefixed(keys, folded, limit - len(results), seen):
+                    results.append(self._result(ing_id, score))
+            if len(results) < limit:
+                for ing_id, score in self._fuzzy(folded, limit - len(results), seen, FUZZY_THRESHOLD):
+                    results.append(self._result(ing_id, score))
+            return results
+
+    def lookup(self, db: Session, name: str):
+        """Id de l'ingrédient de même nom (sans tenir compte de la casse ni des accents), ou None."""
+        with self._lock:
+            self._sync(db)
+            return self._exact.get(fold(name))
+
+    def match(self, db: Session, name: str, threshold: float = MATCH_THRESHOLD):
+        """Meilleur ingrédient existant pour un nom lu sur un ticket, ou None."""
+        folded = fold(name)
+        if not folded:
+            return None
+        with self._lock:
+            self._sync(db)
+            exact = self._exact.get(folded)
+            if exact is not None:
+                return self._result(exact, 1.0)
+            best = self._fuzzy(folded, 1, set(), threshold)
+            return self._result(*best[0]) if best else None
+
+
+# Un index par cuisine (chacune a sa propre table d'ingrédients)
+index = PerKitchen(lambda kitchen: IngredientIndex())
+
+
+# --- SUIVI DES ÉCRITURES SUR LES INGRÉDIENTS ---
+def _changes(session):
+    return session.info.setdefault(CHANGES_KEY, {"ids": set(), "rebuild": False})
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    ids = [obj.id for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+           if isinstance(obj, Ingredient)]
+    if ids:
+        _changes(session)["ids"].update(ids)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement(orm_execute_state):
+    table = getattr(orm_execute_state.statement, "table", None)
+    if table is None or table.name != Ingredient.__tablename__:
+        return
+    changes = _changes(orm_execute_state.session)
+    if orm_execute_state.is_insert:
+        return  # nouveaux ids : relus au-delà du plus grand id connu
+    params = orm_execute_state.parameters
+    if isinstance(params, list) and params and all("id" in p for p in params):
+        changes["ids"].update(p["id"] for p in params)  # UPDATE par clé primaire
+    else:
+        changes["rebuild"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session):
+    changes = session.info.pop(CHANGES_KEY, None)
+    if changes is not None:
+        index.get(session_kitchen(session)).ingredients_changed(changes["ids"], changes["rebuild"])
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changes(session):
+    session.info.pop(CHANGES_KEY, None)
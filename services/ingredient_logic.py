@@ -0,0 +1,99 @@
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import func, select, or_
+from sqlalchemy.orm import Session
+from database import dialect_insert
+from models import Ingredient, PantryItem, RecipeIngredient, ShoppingList
+from services import changefeed, demand_logic, units
+
+# Limite de paramètres par requête (SQLite plafonne le nombre de variables liées)
+LOOKUP_CHUNK = 500
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Clé de comparaison d'un nom d'ingrédient (insensible à la casse et aux espaces)."""
+    return (name or "").strip().lower()
+
+
+def _chunks(values, size=LOOKUP_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def resolve_ingredients(db: Session, items: Iterable[Tuple[str, str, str]]) -> Dict[str, int]:
+    """
+    Résout en lot une liste de (nom, unité, catégorie) vers les IDs d'ingrédients.
+
+    - Une seule normalisation par nom (la première orthographe rencontrée est conservée).
+    - Une requête ensembliste pour retrouver les noms connus.
+    - Un seul INSERT pour tous les manquants, dans la transaction courante
+      (aucun commit ici : c'est l'appelant qui valide). Les noms insérés entre-temps
+      par une requête concurrente sont ignorés (ON CONFLICT DO NOTHING) puis relus.
+
+    Retourne un dictionnaire { nom_normalisé: ingredient_id }.
+    """
+    wanted = {}  # { clé: (nom, unité, catégorie) }
+    for name, unit, category in items:
+        key = normalize_name(name)
+        if key and key not in wanted:
+            wanted[key] = (name.strip(), unit or "unit", category or "Divers")
+
+    if not wanted:
+        return {}
+
+    ids = {}
+    for chunk in _chunks(wanted):
+        exact = [wanted[k][0] for k in chunk]
+        rows = db.execute(
+            select(Ingredient.id, Ingredient.name).where(
+                or_(func.lower(Ingredient.name).in_(chunk), Ingredient.name.in_(exact))
+            )
+        ).all()
+        for ing_id, ing_name in rows:
+            ids.setdefault(normalize_name(ing_name), ing_id)
+
+    missing = [key for key in wanted if key not in ids]
+    if missing:
+        db.execute(
+            dialect_insert(db, Ingredient).on_conflict_do_nothing(index_elements=[Ingredient.name]),
+            [{"name": wanted[k][0], "unit": wanted[k][1], "category": wanted[k][2]} for k in missing],
+        )
+        # Relecture ciblée des IDs générés
+        for chunk in _chunks(wanted[k][0] for k in missing):
+            rows = db.execute(
+                select(Ingredient.id, Ingredient.name).where(Ingredient.name.in_(chunk))
+            ).all()
+            for ing_id, ing_name in rows:
+                ids.setdefault(normalize_name(ing_name), ing_id)
+
+    return ids
+
+
+def update_ingredient(db: Session, ingredient_id: int, changes: dict):
+    """
+    Modifie un ingrédient (seuls les champs donnés). Un changement d'unité, de densité ou de
+    poids d'une pièce ré-exprime les quantités qui en dépendent et recalcule sa demande.
+    Retourne (ingrédient, recettes dont les lignes ont changé), ou None s'il n'existe pas.
+    """
+    ingredient = db.get(Ingredient, ingredient_id)
+    if ingredient is None:
+        return None
+    old = (ingredient.unit, ingredient.density, ingredient.piece_weight)
+    for field, value in changes.items():
+        setattr(ingredient, field, value)
+    new = (ingredient.unit, ingredient.density, ingredient.piece_weight)
+
+    recipe_ids = []
+    if new != old:
+        db.flush()
+        recipe_ids = db.scalars(
+            select(RecipeIngredient.recipe_id).where(RecipeIngredient.ingredient_id == ingredient_id).distinct()
+        ).all()
+        units.reexpress_ingredient(db, ingredient_id, old, new)
+        demand_logic.rebuild_demand(db, [ingredient_id])
+    # Nom, unité et quantités sont inclus dans les lignes de stock et de courses diffusées
+    changefeed.mark(db, PantryItem.__tablename__,
+                    db.scalars(select(PantryItem.ingredient_id).where(PantryItem.ingredient_id == ingredient_id)))
+    changefeed.mark(db, ShoppingList.__tablename__,
+                    db.scalars(select(ShoppingList.id).where(ShoppingList.ingredient_id == ingredient_id)))
+    return ingredient, recipe_ids
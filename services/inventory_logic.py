@@ -1,45 +1,290 @@
+from collections import Counter
+from datetime import date, timedelta
+from sqlalchemy import case, delete, func, insert, select, update
 from sqlalchemy.orm import Session
-from models import PantryItem, RecipeIngredient, WeeklyStaple, ShoppingList, MealPlan, Recipe
+from database import dialect_insert
+from models import Ingredient, PantryItem, PantryLot, RecipeIngredient, ShoppingList, MealPlan, Recipe
+from services import changefeed
+from services.demand_logic import EPSILON, apply_recipes_delta, recipe_multiplier, sync_shopping_list
+from services.ingredient_logic import normalize_name, resolve_ingredients
+from services.suggestion_engine import matrix as suggestion_matrix
+from services.units import ConversionError, from_canonical, load_profiles, to_canonical, unit_factor_sql
 
 def update_shopping_list_logic(db: Session):
-    db.query(ShoppingList).delete()
-    demand = {}
-
-    # 1. Ajouter les basiques (Staples)
-    for staple in db.query(WeeklyStaple).all():
-        demand[staple.ingredient_id] = demand.get(staple.ingredient_id, 0) + staple.default_quantity
-
-    # 2. Ajouter les besoins du Meal Plan
-    plans = db.query(MealPlan).all()
-    for plan in plans:
-        for ri in db.query(RecipeIngredient).filter_by(recipe_id=plan.recipe_id).all():
-            demand[ri.ingredient_id] = demand.get(ri.ingredient_id, 0) + ri.quantity_required
-
-    # 3. Soustraire le stock actuel
-    for ing_id, qty_needed in demand.items():
-        pantry = db.query(PantryItem).filter_by(ingredient_id=ing_id).first()
-        stock = pantry.quantity_available if pantry else 0
-        final_need = qty_needed - stock
-        
-        if final_need > 0:
-            db.add(ShoppingList(ingredient_id=ing_id, quantity_needed=final_need, source="AUTO"))
+    # Basiques + Meal Plan moins le stock, par diff sur la demande agrégée
+    sync_shopping_list(db, source="AUTO", include_staples=True)
     db.commit()
 
 def suggest_recipes_logic(db: Session):
-    recipes = db.query(Recipe).all()
-    suggestions = []
-    
-    for recipe in recipes:
-        total_ing = len(recipe.ingredients)
-        if total_ing == 0: continue
-        
-        in_stock_count = 0
-        for ri in recipe.ingredients:
-            pantry = db.query(PantryItem).filter_by(ingredient_id=ri.ingredient_id).first()
-            if pantry and pantry.quantity_available >= ri.quantity_required:
-                in_stock_count += 1
-        
-        score = (in_stock_count / total_ing) * 100
-        suggestions.append({"recipe_name": recipe.name, "match_percentage": score})
-    
-    return sorted(suggestions, key=lambda x: x['match_percentage'], reverse=True)
\ No newline at end of file
+    suggestions = suggestion_matrix.suggest(db)
+    return [{"recipe_name": s["recipe_name"], "match_percentage": s["match_percentage"]} for s in suggestions]
+
+def add_to_pantry(db: Session, quantities: dict):
+    """Upsert additif du stock { ingredient_id: quantité canonique } en une seule requête."""
+    if not quantities:
+        return
+    units = dict(db.execute(select(Ingredient.id, Ingredient.unit).where(Ingredient.id.in_(list(quantities)))).all())
+    stmt = dialect_insert(db, PantryItem).values([
+        {"ingredient_id": ing_id, "quantity_canonical": qty, "quantity_available": from_canonical(qty, units.get(ing_id))}
+        for ing_id, qty in quantities.items()
+    ])
+    changefeed.mark(db, PantryItem.__tablename__, quantities)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[PantryItem.ingredient_id],
+        set_={
+            "quantity_available": func.coalesce(PantryItem.quantity_available, 0.0) + stmt.excluded.quantity_available,
+            "quantity_canonical": func.coalesce(PantryItem.quantity_canonical, 0.0) + stmt.excluded.quantity_canonical,
+        },
+    ))
+
+# --- LOTS ---
+def add_lots(db: Session, lots: dict, source: str) -> dict:
+    """
+    Entre en stock { (ingredient_id, péremption): quantité canonique } : un lot par achat
+    (un seul INSERT) et l'agrégat `pantry` par ingrédient (un seul upsert).
+    Retourne { ingredient_id: quantité canonique }.
+    """
+    today = date.today()
+    rows = [
+        {"ingredient_id": ing_id, "quantity_canonical": qty, "purchased_at": today, "expires_at": expires_at,
+         "source": source}
+        for (ing_id, expires_at), qty in lots.items() if qty > EPSILON
+    ]
+    if rows:
+        db.execute(insert(PantryLot.__table__), rows)
+    totals = {}
+    for (ing_id, _), qty in lots.items():
+        totals[ing_id] = totals.get(ing_id, 0.0) + qty
+    add_to_pantry(db, totals)
+    return totals
+
+def _expiry(item: dict):
+    # Date de péremption d'un article : "expires_at" (AAAA-MM-JJ) ou "shelf_life_days"
+    if item.get('expires_at'):
+        return date.fromisoformat(str(item['expires_at'])[:10])
+    if item.get('shelf_life_days') is not None:
+        return date.today() + timedelta(days=int(item['shelf_life_days']))
+    return None
+
+def fefo_order():
+    """Ordre de consommation des lots : péremption la plus proche (sans date en dernier), puis achat."""
+    return (PantryLot.expires_at.asc().nulls_last(), PantryLot.purchased_at, PantryLot.id)
+
+def consume_lots(db: Session, used):
+    """
+    Retire des lots, en FEFO et en une requête, les quantités du sous-select `used`
+    (ingredient_id, used). Somme glissante des lots de chaque ingrédient : un lot est vidé
+    tant que la quantité à retirer dépasse les lots qui le précèdent, le lot suivant est entamé.
+    """
+    ordered = (
+        select(PantryLot.id, PantryLot.quantity_canonical.label("quantity"), used.c.used,
+               func.coalesce(func.sum(PantryLot.quantity_canonical).over(
+                   partition_by=PantryLot.ingredient_id, order_by=fefo_order(), rows=(None, -1)), 0.0
+               ).label("before"))
+        .join(used, used.c.ingredient_id == PantryLot.ingredient_id)
+        .subquery()
+    )
+    remaining = case(
+        (ordered.c.used >= ordered.c.before + ordered.c.quantity, 0.0),
+        else_=ordered.c.before + ordered.c.quantity - ordered.c.used,
+    )
+    db.execute(
+        update(PantryLot)
+        .where(PantryLot.id == ordered.c.id, ordered.c.used > ordered.c.before)
+        .values(quantity_canonical=remaining)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(
+        delete(PantryLot)
+        .where(PantryLot.ingredient_id.in_(select(used.c.ingredient_id)), PantryLot.quantity_canonical <= EPSILON)
+        .execution_options(synchronize_session=False)
+    )
+
+def remove_from_pantry(db: Session, ingredient_id: int) -> bool:
+    """Retire un ingrédient du stock (agrégat et lots). Retourne False s'il n'y était pas."""
+    db_item = db.query(PantryItem).filter_by(ingredient_id=ingredient_id).first()
+    if not db_item:
+        return False
+    db.delete(db_item)
+    db.execute(delete(PantryLot).where(PantryLot.ingredient_id == ingredient_id))
+    return True
+
+def reconcile_lots(db: Session):
+    """
+    Migration / réparation : aligne les lots sur l'agrégat `pantry` (stock d'avant les lots,
+    import NDJSON). Un manque devient un lot sans date ; un excédent ou des lots orphelins
+    sont refaits à partir de l'agrégat. Une seule requête de lecture quand tout est aligné.
+    """
+    lot_totals = (
+        select(PantryLot.ingredient_id, func.sum(PantryLot.quantity_canonical).label("total"))
+        .group_by(PantryLot.ingredient_id)
+        .subquery()
+    )
+    stock = func.coalesce(PantryItem.quantity_canonical, 0.0)
+    lots = func.coalesce(lot_totals.c.total, 0.0)
+    drift = db.execute(
+        select(PantryItem.ingredient_id, stock, lots)
+        .outerjoin(lot_totals, lot_totals.c.ingredient_id == PantryItem.ingredient_id)
+        .where(func.abs(stock - lots) > EPSILON)
+    ).all()
+    rebuilt = [ing_id for ing_id, total, in_lots in drift if in_lots > total]
+    db.execute(delete(PantryLot).where(
+        PantryLot.ingredient_id.in_(rebuilt) | PantryLot.ingredient_id.not_in(select(PantryItem.ingredient_id))
+    ))
+    today = date.today()
+    rows = [
+        {"ingredient_id": ing_id, "quantity_canonical": total if in_lots > total else total - in_lots,
+         "purchased_at": today, "expires_at": None, "source": "migration"}
+        for ing_id, total, in_lots in drift if total > EPSILON
+    ]
+    if rows:
+        db.execute(insert(PantryLot.__table__), rows)
+
+def use_soon(db: Session, days: int = 3, limit: int = 50):
+    """Lots périmés ou périmant dans `days` jours (index sur la péremption), et recettes qui les utilisent."""
+    horizon = date.today() + timedelta(days=days)
+    rows = db.execute(
+        select(PantryLot, Ingredient.name, Ingredient.unit)
+        .join(Ingredient, Ingredient.id == PantryLot.ingredient_id)
+        .where(PantryLot.expires_at <= horizon)
+        .order_by(PantryLot.expires_at, PantryLot.id)
+        .limit(limit)
+    ).all()
+    lots = [lot_dict(lot, name, unit) for lot, name, unit in rows]
+    first_expiry = {}
+    for lot in lots:
+        first_expiry.setdefault(lot["ingredient_id"], lot["expires_at"])
+
+    recipes = {}
+    if first_expiry:
+        for recipe_id, recipe_name, ing_id in db.execute(
+            select(Recipe.id, Recipe.name, RecipeIngredient.ingredient_id)
+            .join(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id)
+            .where(RecipeIngredient.ingredient_id.in_(list(first_expiry)))
+            .distinct()
+        ):
+            recipe = recipes.setdefault(recipe_id, {"recipe_id": recipe_id, "recipe_name": recipe_name,
+                                                    "ingredient_ids": [], "first_expiry": None})
+            recipe["ingredient_ids"].append(ing_id)
+            expiry = first_expiry[ing_id]
+            recipe["first_expiry"] = min(expiry, recipe["first_expiry"] or expiry)
+    # Recettes utilisant le plus d'ingrédients à écouler, puis la péremption la plus proche
+    ranked = sorted(recipes.values(), key=lambda r: (-len(r["ingredient_ids"]), r["first_expiry"], r["recipe_name"]))
+    return {"lots": lots, "recipes": ranked[:limit]}
+
+def lot_dict(lot: PantryLot, name: str, unit: str) -> dict:
+    return {
+        "id": lot.id, "ingredient_id": lot.ingredient_id, "ingredient_name": name,
+        "quantity": from_canonical(lot.quantity_canonical, unit), "unit": unit,
+        "quantity_canonical": lot.quantity_canonical, "purchased_at": lot.purchased_at,
+        "expires_at": lot.expires_at, "source": lot.source,
+    }
+
+def list_lots(db: Session, ingredient_id: int):
+    rows = db.execute(
+        select(PantryLot, Ingredient.name, Ingredient.unit)
+        .join(Ingredient, Ingredient.id == PantryLot.ingredient_id)
+        .where(PantryLot.ingredient_id == ingredient_id)
+        .order_by(*fefo_order())
+    ).all()
+    return [lot_dict(lot, name, unit) for lot, name, unit in rows]
+
+def add_pantry_entries(db: Session, items, source: str = "manual") -> dict:
+    """
+    Ajoute au stock une liste d'articles {name, quantity, unit[, expires_at | shelf_life_days]} :
+    résolution des noms en lot, conversion dans l'unité canonique de chaque ingrédient, un lot
+    par ingrédient et date de péremption, puis un seul upsert de l'agrégat.
+    Retourne { ingredient_id: quantité canonique }.
+    """
+    items = [item for item in items if (item.get('name') or '').strip()]
+    ids = resolve_ingredients(db, [(item['name'], item.get('unit', 'unit'), "Divers") for item in items])
+    profiles = load_profiles(db, set(ids.values()))
+
+    lots = {}
+    for item in items:
+        ing_id = ids[normalize_name(item['name'])]
+        ing_unit, density, piece_weight = profiles[ing_id]
+        try:
+            qty = to_canonical(item.get('quantity', 0), item.get('unit'), ing_unit, density, piece_weight)
+        except ConversionError as e:
+            raise ConversionError(f"{item['name']} : {e}")
+        key = (ing_id, _expiry(item))
+        lots[key] = lots.get(key, 0.0) + qty
+    return add_lots(db, lots, source)
+
+def cook_plans(db: Session, plan_ids):
+    """
+    Cuisine des plans de repas en requêtes ensemblistes, quel que soit le nombre d'ingrédients.
+    Les plans sont d'abord supprimés (DELETE ... RETURNING) : deux cuissons concurrentes
+    du même plan ne peuvent donc pas décrémenter le stock deux fois.
+    Retourne (plans cuisinés, ingrédients du stock touchés).
+    """
+    cooked = db.execute(
+        delete(MealPlan).where(MealPlan.id.in_(plan_ids)).returning(MealPlan.id, MealPlan.recipe_id)
+    ).all()
+    if not cooked:
+        return [], []
+    changefeed.mark(db, MealPlan.__tablename__, [plan_id for plan_id, _ in cooked])
+    factors = Counter(recipe_id for _, recipe_id in cooked if recipe_id is not None)
+    if not factors:
+        # Plans sans recette : rien à retirer du stock (CASE sans WHEN invalide en SQL)
+        return [plan_id for plan_id, _ in cooked], []
+
+    used = (
+        select(func.sum(RecipeIngredient.quantity_canonical * recipe_multiplier(factors)))
+        .where(RecipeIngredient.recipe_id.in_(list(factors)),
+               RecipeIngredient.ingredient_id == PantryItem.ingredient_id)
+        .scalar_subquery()
+    )
+    remaining = func.coalesce(PantryItem.quantity_canonical, 0.0) - func.coalesce(used, 0.0)
+    ingredient_unit = select(Ingredient.unit).where(Ingredient.id == PantryItem.ingredient_id).scalar_subquery()
+    touched = db.execute(
+        update(PantryItem)
+        .where(PantryItem.ingredient_id.in_(
+            select(RecipeIngredient.ingredient_id).where(RecipeIngredient.recipe_id.in_(list(factors)))
+        ))
+        .values(quantity_canonical=remaining, quantity_available=remaining / unit_factor_sql(ingredient_unit))
+        .returning(PantryItem.ingredient_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if touched:
+        changefeed.mark(db, PantryItem.__tablename__, touched)
+        db.execute(
+            delete(PantryItem)
+            .where(PantryItem.ingredient_id.in_(touched), PantryItem.quantity_canonical <= EPSILON)
+            .execution_options(synchronize_session=False)
+        )
+    # Mêmes quantités retirées des lots, les plus proches de leur péremption d'abord
+    consume_lots(db, (
+        select(RecipeIngredient.ingredient_id,
+               func.sum(RecipeIngredient.quantity_canonical * recipe_multiplier(factors)).label("used"))
+        .where(RecipeIngredient.recipe_id.in_(list(factors)))
+        .group_by(RecipeIngredient.ingredient_id)
+        .subquery()
+    ))
+    apply_recipes_delta(db, {recipe_id: -count for recipe_id, count in factors.items()})
+    return [plan_id for plan_id, _ in cooked], touched
+
+def checkout_items(db: Session, item_ids=None, sources=None):
+    """
+    Passe en stock les articles cochés (ou la sélection demandée) : les lignes sont
+    retirées de la liste avec DELETE ... RETURNING puis ajoutées au stock par un upsert.
+    Retourne les ingrédients ajoutés au stock.
+    """
+    condition = ShoppingList.is_checked == True
+    if item_ids is not None:
+        condition = ShoppingList.id.in_(item_ids)
+    if sources is not None:
+        condition = condition & ShoppingList.source.in_(sources)
+    purchased = db.execute(
+        delete(ShoppingList).where(condition)
+        .returning(ShoppingList.id, ShoppingList.ingredient_id, ShoppingList.quantity_canonical)
+        .execution_options(synchronize_session=False)
+    ).all()
+    changefeed.mark(db, ShoppingList.__tablename__, [item_id for item_id, _, _ in purchased])
+
+    lots = {}
+    for _, ing_id, qty in purchased:
+        if ing_id is not None:
+            lots[(ing_id, None)] = lots.get((ing_id, None), 0.0) + (qty or 0.0)
+    return list(add_lots(db, lots, "checkout"))
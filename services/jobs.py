@@ -0,0 +1,363 @@
+"""
+Travaux en arrière-plan : ajout massif au stock, génération de la liste de courses,
+import du fichier maître.
+
+Les jobs sont des lignes de la table `jobs` de la cuisine. L'exécution passe par un
+pool de threads (JOB_MODE=thread) ou de processus (JOB_MODE=process) ; dans les deux cas
+un job est réclamé par une mise à jour conditionnelle, si bien qu'un seul processus
+l'exécute, et un job dont le battement de cœur s'est arrêté est repris par un autre.
+
+Les handlers découpent le travail en lots : chaque lot est validé avec la progression
+du job dans la même transaction, qui sert aussi de curseur de reprise. Un job relancé
+après un arrêt reprend donc au lot suivant sans rien appliquer deux fois. La fin du job
+est validée avec le dernier lot.
+
+Idempotency-Key : la clé du client est unique dans la table. Un job déjà créé avec cette
+clé est renvoyé tel quel, et une opération synchrone (run_once) enregistre son résultat
+dans la transaction même de ses écritures : une requête rejouée reçoit la réponse d'origine.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import database
+from models import Job
+
+JOB_MODE = os.getenv("JOB_MODE", "thread")                       # "thread" | "process"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "60"))    # battement de cœur au-delà duquel on reprend
+JOB_RETENTION_HOURS = int(os.getenv("JOB_RETENTION_HOURS", "72"))
+JOB_CHUNK = 500                                                   # articles par lot validé
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 200
+
+ACTIVE = ("queued", "running")
+FINISHED = ("done", "error", "cancelled")
+
+# Identifiant du processus exécutant : les jobs "running" d'un processus mort sont repris
+OWNER = f"{os.uname().nodename}:{os.getpid()}"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# --- HANDLERS ---
+class JobSpec:
+    def __init__(self, kind, run, on_done=None):
+        self.kind = kind
+        self.run = run            # run(db, payload, ctx) -> (résultat, effets)
+        self.on_done = on_done    # on_done(cuisine, effets), dans le processus de l'API, même après
+                                  # une erreur ou une annulation (effets des lots déjà validés)
+
+
+HANDLERS = {}
+
+
+def handler(kind: str, on_done=None):
+    def register(run):
+        HANDLERS[kind] = JobSpec(kind, run, on_done)
+        return run
+    return register
+
+
+class JobContext:
+    def __init__(self, db: Session, job: Job, kitchen: str):
+        self.db = db
+        self.job = job
+        self.kitchen = kitchen
+        self.effects = set()  # effets des lots validés, rapportés même si le job échoue ensuite
+
+    @property
+    def done(self) -> int:
+        # Reprise : nombre d'éléments déjà validés
+        return self.job.done or 0
+
+    def checkpoint(self, done: int, total: int = None, effects=()):
+        """
+        Valide les écritures en cours avec la progression (et leurs effets), puis s'arrête si
+        une annulation est demandée.
+        """
+        self.job.done = done
+        if total is not None:
+            self.job.total = total
+        self.job.heartbeat = datetime.now()
+        self.db.commit()
+        self.effects.update(effects)
+        if self.db.execute(select(Job.cancel_requested).where(Job.id == self.job.id)).scalar():
+            raise JobCancelled()
+
+
+# --- EXÉCUTION ---
+def _claim(db: Session, job_id: str) -> bool:
+    now = datetime.now()
+    stale = now - timedelta(seconds=JOB_STALE_SECONDS)
+    claimed = db.execute(
+        update(Job)
+        .where(Job.id == job_id,
+               or_(Job.status == "queued", and_(Job.status == "running", Job.heartbeat < stale)),
+               Job.cancel_requested.is_not(True))
+        .values(status="running", owner=OWNER, heartbeat=now, started_at=now)
+    ).rowcount
+    db.commit()
+    return claimed == 1
+
+
+def _finish(db: Session, job: Job, status: str, result=None, error=None):
+    job.status = status
+    job.result = json.dumps(result, default=str) if result is not None else None
+    job.error = error
+    job.finished_at = datetime.now()
+    db.commit()
+
+
+def execute_job(kitchen: str, job_id: str):
+    """
+    Exécute un job (thread ou processus du pool). Retourne (statut, type, effets),
+    ou None si le job est déjà pris par un autre exécutant.
+    """
+    db = database.router.sessionmaker(kitchen)()
+    try:
+        if not _claim(db, job_id):
+            return None
+        job = db.get(Job, job_id)
+        spec = HANDLERS[job.kind]
+        ctx = JobContext(db, job, kitchen)
+        try:
+            result, effects = spec.run(db, json.loads(job.payload or "{}"), ctx)
+        except JobCancelled:
+            db.rollback()
+            _finish(db, job, "cancelled")
+            return "cancelled", job.kind, sorted(ctx.effects) or None
+        except Exception as e:
+            db.rollback()
+            print(f"Job {job.kind} {job_id} en erreur : {e}")
+            _finish(db, job, "error", error=str(e))
+            return "error", job.kind, sorted(ctx.effects) or None
+        # Statut final validé avec le dernier lot d'écritures
+        _finish(db, job, "done", result=result)
+        return "done", job.kind, effects
+    finally:
+        db.close()
+
+
+def _init_process():
+    # Processus du pool (spawn) : initialisation des shards à leur ouverture, comme dans l'API
+    import services.shards  # noqa: F401 -- import pour son seul effet : enregistre le hook d'initialisation des shards
+
+
+class JobRunner:
+    def __init__(self, mode: str = JOB_MODE, workers: int = JOB_WORKERS):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"JOB_MODE inconnu : {mode}")
+        self.mode = mode
+        self.workers = workers
+        self._executor = None
+        self._closing = False
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                if self.mode == "process":
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_process,
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            return self._executor
+
+    def submit(self, kitchen: str, job_id: str):
+        future = self._pool().submit(execute_job, kitchen, job_id)
+        future.add_done_callback(lambda f: self._finished(kitchen, job_id, f))
+        return future
+
+    def _finished(self, kitchen, job_id, future):
+        try:
+            outcome = future.result()
+        except Exception as e:
+            # À l'arrêt, le job resté en base est repris à la prochaine ouverture de la cuisine
+            if not self._closing:
+                print(f"Job {job_id} : exécution interrompue : {e}")
+            return
+        if outcome is None:
+            return
+        status, kind, effects = outcome
+        spec = HANDLERS.get(kind)
+        if spec and spec.on_done and effects:
+            spec.on_done(kitchen, effects)
+
+    def shutdown(self):
+        with self._lock:
+            self._closing = True
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+runner = JobRunner()
+
+
+# --- CRÉATION ET IDEMPOTENCE ---
+def request_hash(kind: str, payload) -> str:
+    return hashlib.sha256(f"{kind}\x1f{json.dumps(payload, sort_keys=True, default=str)}".encode("utf-8")).hexdigest()
+
+
+def _by_key(db: Session, key: str, fingerprint: str):
+    if not (0 < len(key) <= MAX_KEY_LENGTH):
+        raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} invalide (1 à {MAX_KEY_LENGTH} caractères)")
+    job = db.execute(select(Job).where(Job.idempotency_key == key)).scalar_one_or_none()
+    if job is not None and job.request_hash != fingerprint:
+        raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} déjà utilisée pour une autre requête")
+    return job
+
+
+def enqueue(db: Session, kitchen: str, kind: str, payload, key: str = None) -> Job:
+    """Crée le job (ou retrouve celui de la même clé) et le confie au pool."""
+    fingerprint = request_hash(kind, payload)
+    if key is not None:
+        existing = _by_key(db, key, fingerprint)
+        if existing is not None:
+            return existing
+    job = Job(id=uuid.uuid4().hex, kind=kind, status="queued", idempotency_key=key, request_hash=fingerprint,
+              payload=json.dumps(payload, default=str), done=0, cancel_requested=False, created_at=datetime.now())
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Même clé envoyée en parallèle : le premier job l'emporte
+        db.rollback()
+        return _by_key(db, key, fingerprint)
+    runner.submit(kitchen, job.id)
+    return job
+
+
+def run_once(db: Session, kind: str, payload, key, apply):
+    """
+    Exécute apply(db) -> (résultat, effets) dans la transaction de la requête et, avec une
+    clé, enregistre le résultat dans cette même transaction. Retourne (résultat, effets) ;
+    une requête rejouée reçoit le résultat d'origine et aucun effet.
+    """
+    if key is None:
+        result, effects = apply(db)
+        db.commit()
+        return result, effects
+    fingerprint = request_hash(kind, payload)
+    previous = _by_key(db, key, fingerprint)
+    if previous is not None:
+        return replay(previous), None
+    result, effects = apply(db)
+    db.add(done_job(kind, key, fingerprint, result))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Requête concurrente avec la même clé validée avant : nos écritures sont annulées
+        db.rollback()
+        return replay(_by_key(db, key, fingerprint)), None
+    return result, effects
+
+
+def done_job(kind: str, key: str, fingerprint: str, result) -> Job:
+    """Trace d'une opération synchrone déjà appliquée, à ajouter dans la transaction de ses écritures."""
+    now = datetime.now()
+    return Job(id=uuid.uuid4().hex, kind=kind, status="done", idempotency_key=key, request_hash=fingerprint,
+               payload=None, result=json.dumps(result, default=str), done=1, total=1, cancel_requested=False,
+               created_at=now, started_at=now, finished_at=now)
+
+
+def replay(job: Job):
+    if job.status in ACTIVE:
+        raise HTTPException(status_code=409, detail=f"Requête d'origine en cours (job {job.id})")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"La requête d'origine n'a pas abouti ({job.status}) : "
+                                                    f"utilisez une nouvelle clé")
+    return json.loads(job.result) if job.result else None
+
+
+# --- CONSULTATION ---
+def job_dict(job: Job) -> dict:
+    return {
+        "id": job.id, "kind": job.kind, "status": job.status, "done": job.done or 0, "total": job.total,
+        "result": json.loads(job.result) if job.result else None, "error": job.error,
+        "cancel_requested": bool(job.cancel_requested),
+        "created_at": job.created_at, "started_at": job.started_at, "finished_at": job.finished_at,
+    }
+
+
+def cancel(db: Session, job: Job):
+    """Un job en file est annulé tout de suite ; un job en cours s'arrête au lot suivant."""
+    db.execute(update(Job).where(Job.id == job.id, Job.status.not_in(FINISHED)).values(cancel_requested=True))
+    db.execute(update(Job).where(Job.id == job.id, Job.status == "queued")
+               .values(status="cancelled", finished_at=datetime.now()))
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def resume_pending(shard: database.Shard):
+    """À l'ouverture d'une cuisine : purge des vieux jobs, reprise des jobs en file ou interrompus."""
+    db = shard.sessionmaker()
+    try:
+        db.execute(delete(Job).where(Job.status.in_(FINISHED),
+                                     Job.finished_at < datetime.now() - timedelta(hours=JOB_RETENTION_HOURS)))
+        db.commit()
+        # Seuls les types exécutés par ce pool (les scans de tickets ont leur propre file)
+        pending = db.execute(select(Job.id).where(Job.status.in_(ACTIVE), Job.kind.in_(list(HANDLERS)))).scalars().all()
+    finally:
+        db.close()
+    for job_id in pending:
+        runner.submit(shard.kitchen, job_id)
+
+
+# --- TRAVAUX ---
+def _stock_changed(kitchen, ingredient_ids):
+    from services.suggestion_engine import matrix
+    matrix.get(kitchen).stock_changed(ingredient_ids)
+
+
+@handler("pantry_bulk", on_done=_stock_changed)
+def run_pantry_bulk(db: Session, payload, ctx: JobContext):
+    from services.inventory_logic import add_pantry_entries
+    items = payload["items"]
+    touched = set()
+    for start in range(ctx.done, len(items), JOB_CHUNK):
+        chunk = items[start:start + JOB_CHUNK]
+        added = add_pantry_entries(db, chunk, payload.get("source", "bulk"))
+        touched.update(added)
+        ctx.checkpoint(start + len(chunk), len(items), added)
+    return {"status": "success", "message": f"{len(items)} articles ajoutés"}, sorted(touched)
+
+
+@handler("shopping_generate")
+def run_shopping_generate(db: Session, payload, ctx: JobContext):
+    from services.demand_logic import sync_shopping_list
+    date_from, date_to = (date.fromisoformat(payload[k]) if payload.get(k) else None for k in ("from", "to"))
+    added, skipped = sync_shopping_list(db, source="Planning", date_from=date_from, date_to=date_to)
+    ctx.job.total = 1
+    ctx.job.done = 1
+    return {"status": "success", "message": "Calcul terminé.", "added": added, "skipped": skipped}, None
+
+
+@handler("master_import")
+def run_master_import(db: Session, payload, ctx: JobContext):
+    from services import master_import
+    factory = database.router.sessionmaker(ctx.kitchen)
+    progress = master_import.import_master_file(
+        factory, payload["path"], ctx.kitchen,
+        on_chunk=lambda p: ctx.checkpoint(p["bytes_read"], p["total_bytes"]),
+    )
+    if progress["state"] == "error":
+        if db.execute(select(Job.cancel_requested).where(Job.id == ctx.job.id)).scalar():
+            raise JobCancelled()
+        raise RuntimeError(progress["error"])
+    ctx.job.done = ctx.job.total = progress["total_bytes"]
+    return dict(progress), None
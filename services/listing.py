@@ -0,0 +1,201 @@
+import base64
+import hashlib
+import json
+import orjson
+from fastapi import HTTPException, Request, Response
+from datetime import date
+from sqlalchemy import Date, tuple_
+from sqlalchemy.orm import Session, joinedload, load_only, selectinload
+from database import session_kitchen
+from models import Ingredient, MealPlan, PantryItem, Recipe, RecipeIngredient
+from services.meal_plan_logic import in_window
+from services.read_cache import cache as read_cache
+from services.table_versions import versions
+
+MAX_PAGE_SIZE = 1000
+
+
+# --- CURSEURS ET PROJECTION ---
+def encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+
+
+def parse_fields(fields, allowed):
+    if not fields:
+        return set(allowed)
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = wanted - set(allowed)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Champs inconnus : {', '.join(sorted(unknown))}")
+    return wanted
+
+
+# --- SÉRIALISATION (uniquement ce qui a été chargé) ---
+INGREDIENT_FIELDS = ("id", "name", "category", "unit", "density", "piece_weight")
+RECIPE_FIELDS = ("id", "name", "instructions", "ingredients")
+PANTRY_FIELDS = ("ingredient_id", "quantity_available", "quantity_canonical", "ingredient")
+MEAL_PLAN_FIELDS = ("id", "date", "slot", "recipe_id", "recipe")
+
+
+def ingredient_dict(ing, fields=INGREDIENT_FIELDS):
+    if ing is None:
+        return None
+    return {f: getattr(ing, f) for f in fields}
+
+
+def recipe_line_dict(ri):
+    return {
+        "id": ri.id, "recipe_id": ri.recipe_id, "ingredient_id": ri.ingredient_id,
+        "quantity_required": ri.quantity_required, "unit": ri.unit, "quantity_canonical": ri.quantity_canonical,
+        "ingredient": ingredient_dict(ri.ingredient),
+    }
+
+
+def recipe_dict(recipe, fields=RECIPE_FIELDS):
+    if recipe is None:
+        return None
+    data = {f: getattr(recipe, f) for f in fields if f != "ingredients"}
+    if "ingredients" in fields:
+        data["ingredients"] = [recipe_line_dict(ri) for ri in recipe.ingredients]
+    return data
+
+
+def pantry_dict(item, fields=PANTRY_FIELDS):
+    data = {f: getattr(item, f) for f in fields if f != "ingredient"}
+    if "ingredient" in fields:
+        data["ingredient"] = ingredient_dict(item.ingredient)
+    return data
+
+
+def meal_plan_dict(plan, fields=MEAL_PLAN_FIELDS):
+    data = {}
+    for f in fields:
+        if f == "date":
+            data["date"] = plan.date.isoformat() if plan.date else None
+        elif f == "recipe":
+            data["recipe"] = recipe_dict(plan.recipe)
+        else:
+            data[f] = getattr(plan, f)
+    return data
+
+
+# --- REQUÊTES PAGINÉES ---
+def keyset_page(query, order_columns, limit, after):
+    """Pagination par clé : WHERE (clé) > (curseur) ORDER BY clé LIMIT n+1."""
+    if after:
+        values = [_cursor_value(c, v) for c, v in zip(order_columns, decode_cursor(after))]
+        if len(order_columns) == 1:
+            query = query.filter(order_columns[0] > values[0])
+        else:
+            query = query.filter(tuple_(*order_columns) > tuple_(*values))
+    query = query.order_by(*order_columns)
+    if limit is None:
+        return query.all(), None
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, c.key) for c in order_columns])
+
+
+def _cursor_value(column, value):
+    # Les dates passent en texte ISO dans le curseur JSON
+    if isinstance(value, str) and isinstance(column.type, Date):
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Curseur invalide")
+    return value
+
+
+def _columns(model, fields, always):
+    return [getattr(model, f) for f in set(fields) | set(always) if f in model.__table__.columns]
+
+
+def list_ingredients(db: Session, limit=None, after=None, fields=None, by_name=False):
+    wanted = parse_fields(fields, INGREDIENT_FIELDS)
+    order = [Ingredient.name, Ingredient.id] if by_name else [Ingredient.id]
+    query = db.query(Ingredient).options(load_only(*_columns(Ingredient, wanted, ["id", "name"])))
+    rows, cursor = keyset_page(query, order, limit, after)
+    keep = [f for f in INGREDIENT_FIELDS if f in wanted]
+    return [ingredient_dict(ing, keep) for ing in rows], cursor
+
+
+def list_recipes(db: Session, limit=None, after=None, fields=None):
+    wanted = parse_fields(fields, RECIPE_FIELDS)
+    query = db.query(Recipe).options(load_only(*_columns(Recipe, wanted, ["id"])))
+    if "ingredients" in wanted:
+        query = query.options(selectinload(Recipe.ingredients).joinedload(RecipeIngredient.ingredient))
+    rows, cursor = keyset_page(query, [Recipe.id], limit, after)
+    keep = [f for f in RECIPE_FIELDS if f in wanted]
+    return [recipe_dict(r, keep) for r in rows], cursor
+
+
+def list_pantry(db: Session, limit=None, after=None, fields=None):
+    wanted = parse_fields(fields, PANTRY_FIELDS)
+    query = db.query(PantryItem)
+    if "ingredient" in wanted:
+        query = query.options(joinedload(PantryItem.ingredient))
+    rows, cursor = keyset_page(query, [PantryItem.ingredient_id], limit, after)
+    keep = [f for f in PANTRY_FIELDS if f in wanted]
+    return [pantry_dict(p, keep) for p in rows], cursor
+
+
+def list_meal_plans(db: Session, limit=None, after=None, fields=None, date_from=None, date_to=None):
+    wanted = parse_fields(fields, MEAL_PLAN_FIELDS)
+    query = in_window(db.query(MealPlan), date_from, date_to)
+    if "recipe" in wanted:
+        query = query.options(
+            joinedload(MealPlan.recipe)
+            .selectinload(Recipe.ingredients)
+            .joinedload(RecipeIngredient.ingredient)
+        )
+    # Ordre de l'index (date, créneau) : la fenêtre et le tri se lisent dans l'index
+    rows, cursor = keyset_page(query, [MealPlan.date, MealPlan.slot, MealPlan.id], limit, after)
+    keep = [f for f in MEAL_PLAN_FIELDS if f in wanted]
+    return [meal_plan_dict(p, keep) for p in rows], cursor
+
+
+# --- GET CONDITIONNEL ---
+def serialize(rows) -> bytes:
+    # Dicts déjà construits à partir des seules colonnes chargées : orjson les écrit directement
+    return orjson.dumps(rows)
+
+
+def conditional_list(request: Request, db: Session, tables, build, cached: bool = False):
+    """
+    Calcule l'ETag à partir des versions des tables lues et des paramètres de la requête :
+    si le client a déjà cette version (If-None-Match), réponse 304 sans exécuter `build`.
+    Avec `cached`, le corps JSON déjà sérialisé est réutilisé tant que ces versions
+    ne changent pas. `build()` retourne (lignes, curseur suivant).
+    """
+    current = versions(db, tables)
+    # La cuisine fait partie de la signature : deux cuisines aux mêmes versions ne partagent ni ETag ni cache
+    signature = json.dumps([session_kitchen(db), request.url.path, str(request.query_params),
+                            sorted(current.items())])
+    etag = f'W/"{hashlib.sha1(signature.encode("utf-8")).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    client_tags = {t.strip() for t in request.headers.get("if-none-match", "").split(",")}
+    if etag in client_tags or "*" in client_tags:
+        return Response(status_code=304, headers=headers)
+
+    entry = read_cache.get(etag) if cached else None
+    if entry is None:
+        rows, cursor = build()
+        entry = (serialize(rows), cursor)
+        if cached:
+            read_cache.put(etag, *entry)
+    body, cursor = entry
+    if cursor:
+        headers["X-Next-Cursor"] = cursor
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import bindparam, delete, func, insert, or_, select, update
+from database import DEFAULT_KITCHEN
+from models import Ingredient, ImportState, Job, MasterIngredientRow
+from services.ingredient_logic import normalize_name, resolve_ingredients
+
+# Nombre de lignes appliquées par transaction (verrou d'écriture court)
+CHUNK_SIZE = 1000
+READ_SIZE = 64 * 1024
+
+# Progression de l'import exécuté par ce processus, par cuisine ; l'état exposé par l'API
+# est celui du job master_import (import_status), valable quel que soit le processus qui l'exécute
+IDLE = {"state": "idle", "processed": 0, "applied": 0, "bytes_read": 0, "total_bytes": 0, "error": None}
+_progress = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+
+def progress_for(kitchen: str = DEFAULT_KITCHEN) -> dict:
+    with _registry_lock:
+        if kitchen not in _progress:
+            _progress[kitchen] = dict(IDLE)
+            _locks[kitchen] = threading.Lock()
+        return _progress[kitchen]
+
+
+def import_status(db) -> dict:
+    """État du dernier job master_import : statut, octets lus (done / total), rapport une fois terminé."""
+    job = db.execute(select(Job).where(Job.kind == "master_import").order_by(Job.created_at.desc()).limit(1)).scalar()
+    if job is None:
+        return dict(IDLE)
+    status = dict(IDLE, state=job.status, bytes_read=job.done or 0, total_bytes=job.total or 0, error=job.error)
+    if job.status == "done" and job.result:
+        status.update(json.loads(job.result))
+    return status
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def row_fingerprint(name: str, unit: str, category: str) -> str:
+    return hashlib.sha1(f"{name.strip()}\x1f{unit}\x1f{category}".encode("utf-8")).hexdigest()
+
+
+def iter_json_array(f, progress=None):
+    """Parcourt un tableau JSON objet par objet sans charger tout le fichier."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        # Saut des séparateurs entre deux éléments
+        while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == "," or (not started and buffer[pos] == "[")):
+            started = started or buffer[pos] == "["
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        if pos < len(buffer):
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+                yield obj
+                pos = end
+                continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+        if eof:
+            return
+        chunk = f.read(READ_SIZE)
+        if progress is not None:
+            progress["bytes_read"] = f.tell()
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def _apply_chunk(db, rows):
+    """
+    Applique un lot de lignes ajoutées ou modifiées : { clé: (nom, unité, catégorie, empreinte) }.
+    Les ingrédients manquants sont créés ; sur un ingrédient existant, seules l'unité et la
+    catégorie vides sont complétées. Une unité déjà renseignée n'est jamais remplacée : les
+    quantités canoniques du stock, des recettes et de la demande sont exprimées dans sa base.
+    """
+    ids = resolve_ingredients(db, [(name, unit, category) for name, unit, category, _ in rows.values()])
+    table = Ingredient.__table__
+    db.execute(
+        update(table)
+        .where(table.c.id == bindparam("b_id"), or_(table.c.unit.is_(None), table.c.category.is_(None)))
+        .values(unit=func.coalesce(table.c.unit, bindparam("b_unit")),
+                category=func.coalesce(table.c.category, bindparam("b_category"))),
+        [{"b_id": ids[key], "b_unit": unit, "b_category": category}
+         for key, (_, unit, category, _) in rows.items()],
+    )
+    db.execute(delete(MasterIngredientRow).where(MasterIngredientRow.name_key.in_(list(rows))))
+    db.execute(
+        insert(MasterIngredientRow),
+        [{"name_key": key, "fingerprint": fp} for key, (_, _, _, fp) in rows.items()],
+    )
+    db.commit()
+
+
+def import_master_file(session_factory, file_path: str, kitchen: str = DEFAULT_KITCHEN, on_chunk=None):
+    """
+    Import incrémental du fichier maître :
+    - rien n'est relu si le hash du fichier est identique au dernier import,
+    - seules les lignes dont l'empreinte a changé sont appliquées, par lots.
+    Le hash n'est enregistré qu'en fin d'import : un import interrompu est repris
+    au prochain démarrage, les lots déjà appliqués étant ignorés grâce aux empreintes.
+    """
+    progress = progress_for(kitchen)
+    lock = _locks[kitchen]
+    if not lock.acquire(blocking=False):
+        return progress
+    db = session_factory()
+    try:
+        progress.update(state="running", processed=0, applied=0, bytes_read=0,
+                        total_bytes=os.path.getsize(file_path), error=None)
+        content_hash = file_sha256(file_path)
+        state = db.get(ImportState, file_path)
+        if state and state.content_hash == content_hash:
+            progress.update(state="skipped", bytes_read=progress["total_bytes"])
+            print(f"Fichier maître inchangé ({content_hash[:12]}), import ignoré.")
+            return progress
+
+        known = dict(db.execute(select(MasterIngredientRow.name_key, MasterIngredientRow.fingerprint)).all())
+        pending = {}
+        with open(file_path, "r", encoding="utf-8") as f:
+            for item in iter_json_array(f, progress):
+                name = (item.get("name") or "").strip()
+                if not name:
+                    continue
+                progress["processed"] += 1
+                unit, category = item.get("unit", "unit"), item.get("category", "Divers")
+                key = normalize_name(name)
+                fp = row_fingerprint(name, unit, category)
+                if known.get(key) == fp:
+                    continue
+                known[key] = fp
+                pending[key] = (name, unit, category, fp)
+                if len(pending) >= CHUNK_SIZE:
+                    _apply_chunk(db, pending)
+                    progress["applied"] += len(pending)
+                    pending = {}
+                    if on_chunk:
+                        on_chunk(progress)
+        if pending:
+            _apply_chunk(db, pending)
+            progress["applied"] += len(pending)
+
+        if state is None:
+            state = ImportState(source=file_path)
+            db.add(state)
+        state.content_hash = content_hash
+        state.row_count = progress["processed"]
+        state.imported_at = datetime.now()
+        db.commit()
+        progress["state"] = "done"
+        print(f"Succès : {progress['processed']} ingrédients lus, {progress['applied']} ajoutés ou modifiés.")
+        return progress
+    except Exception as e:
+        db.rollback()
+        progress.update(state="error", error=str(e))
+        print(f"Erreur lors de l'import des ingrédients : {e}")
+        return progress
+    finally:
+        db.close()
+        lock.release()
@@ -0,0 +1,63 @@
+from datetime import date
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy import inspect, or_, text, update
+from database import bind_schema, qualified
+from models import MealPlan
+
+# --- CRÉNEAUX ---
+SLOTS = ("BREAKFAST", "LUNCH", "DINNER", "SNACK", "ANY")
+DEFAULT_SLOT = "ANY"
+
+
+def normalize_slot(slot: Optional[str]) -> str:
+    value = (slot or DEFAULT_SLOT).strip().upper()
+    if value not in SLOTS:
+        raise HTTPException(status_code=400, detail=f"Créneau inconnu : {slot} (attendu : {', '.join(SLOTS)})")
+    return value
+
+
+def check_window(date_from: Optional[date], date_to: Optional[date]):
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="Fenêtre invalide : 'from' est après 'to'")
+
+
+def in_window(query, date_from: Optional[date], date_to: Optional[date]):
+    """Restreint une requête sur les plans à [date_from, date_to] (bornes incluses, optionnelles)."""
+    if date_from:
+        query = query.where(MealPlan.date >= date_from)
+    if date_to:
+        query = query.where(MealPlan.date <= date_to)
+    return query
+
+
+# --- MIGRATION DES PLANS HÉRITÉS ---
+def migrate_legacy_plans(bind):
+    """
+    Anciennes bases : contrainte UNIQUE (date, slot) et créneau rempli avec un horodatage
+    (seul moyen de planifier deux recettes le même jour). La contrainte est retirée
+    (reconstruction de la table sous SQLite, qui ne sait pas la supprimer) et les
+    horodatages deviennent le créneau ANY.
+    """
+    inspector = inspect(bind)
+    schema = bind_schema(bind)
+    legacy = [uc for uc in inspector.get_unique_constraints(MealPlan.__tablename__, schema=schema)
+              if sorted(uc["column_names"]) == ["date", "slot"]]
+    with bind.begin() as conn:
+        if legacy and bind.dialect.name == "sqlite":
+            print("Migration des plans de repas : suppression de la contrainte UNIQUE (date, slot)")
+            for index in inspector.get_indexes(MealPlan.__tablename__):
+                conn.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+            conn.execute(text("ALTER TABLE meal_plans RENAME TO meal_plans_legacy"))
+            MealPlan.__table__.create(bind=conn)
+            conn.execute(text("INSERT INTO meal_plans (id, date, slot, recipe_id) "
+                              "SELECT id, date, slot, recipe_id FROM meal_plans_legacy"))
+            conn.execute(text("DROP TABLE meal_plans_legacy"))
+        else:
+            for uc in legacy:
+                conn.execute(text(f'ALTER TABLE {qualified(bind, "meal_plans")} DROP CONSTRAINT "{uc["name"]}"'))
+        # Index sur la seule date (remplacé par l'index composite date, créneau)
+        conn.execute(text(f"DROP INDEX IF EXISTS {qualified(bind, 'ix_meal_plans_date')}"))
+        conn.execute(update(MealPlan)
+                     .where(or_(MealPlan.slot.is_(None), MealPlan.slot.not_in(SLOTS)))
+                     .values(slot=DEFAULT_SLOT))
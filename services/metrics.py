@@ -0,0 +1,196 @@
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from services import coldstart
+
+# Au-delà de ce nombre d'exécutions d'une même requête SQL dans une requête HTTP : N+1 probable
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+# Journal des requêtes lentes (0 = désactivé), en millisecondes
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+BACKGROUND = ("-", "background")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+AI_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+_BIND_LIST = re.compile(r"\(\s*\?(\s*,\s*\?)+\s*\)|\(\s*%\(\w+\)s(\s*,\s*%\(\w+\)s)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def statement_pattern(statement: str) -> str:
+    """Forme normalisée d'une requête : listes IN (?, ?, ...) repliées, espaces compactés."""
+    return _SPACES.sub(" ", _BIND_LIST.sub("(?…)", statement)).strip()
+
+
+class RequestStats:
+    """Compteurs SQL d'une requête HTTP en cours (portés par une ContextVar)."""
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self.patterns = Counter()
+        self.pattern_time = defaultdict(float)
+
+    def suspected_n_plus_one(self):
+        return [(p, n) for p, n in self.patterns.most_common() if n >= N_PLUS_ONE_THRESHOLD]
+
+
+current_request: ContextVar = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()                      # (méthode, route, statut)
+        self.latency = {}                              # (méthode, route) -> Histogram
+        self.statements = Counter()                    # (méthode, route) -> requêtes SQL
+        self.db_time = defaultdict(float)              # (méthode, route) -> secondes
+        self.n_plus_one = Counter()                    # (méthode, route) -> requêtes HTTP suspectes
+        self.ai_calls = {}                             # (modèle, issue) -> Histogram
+
+    def record_request(self, method, route, status, seconds, stats: RequestStats):
+        with self._lock:
+            key = (method, route)
+            self.requests[(method, route, status)] += 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.statements[key] += stats.statements
+            self.db_time[key] += stats.db_time
+            if stats.suspected_n_plus_one():
+                self.n_plus_one[key] += 1
+
+    def record_background(self, seconds):
+        with self._lock:
+            # Hors requête HTTP : démarrage, import en arrière-plan
+            self.statements[BACKGROUND] += 1
+            self.db_time[BACKGROUND] += seconds
+
+    def record_ai_call(self, model, ok, seconds):
+        with self._lock:
+            self.ai_calls.setdefault((model, "ok" if ok else "error"), Histogram(AI_BUCKETS)).observe(seconds)
+
+    # --- EXPORT PROMETHEUS ---
+    def render(self) -> str:
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, labels, hist):
+            # counts est déjà cumulatif (observe incrémente chaque borne >= valeur)
+            for bound, count in zip(hist.buckets, hist.counts):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.total}')
+            lines.append(f"{name}_sum{{{labels}}} {hist.sum:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {hist.total}")
+
+        with self._lock:
+            header("kitchen_http_requests_total", "counter", "Requêtes HTTP par route et statut")
+            for (method, route, status), n in sorted(self.requests.items()):
+                lines.append(f'kitchen_http_requests_total{{method="{method}",route="{_esc(route)}",status="{status}"}} {n}')
+            header("kitchen_http_request_duration_seconds", "histogram", "Latence des requêtes HTTP")
+            for key, hist in sorted(self.latency.items()):
+                histogram("kitchen_http_request_duration_seconds", _route_labels(key), hist)
+            header("kitchen_db_statements_total", "counter", "Requêtes SQL exécutées, par route")
+            for key, n in sorted(self.statements.items()):
+                lines.append(f'kitchen_db_statements_total{{{_route_labels(key)}}} {n}')
+            header("kitchen_db_time_seconds_total", "counter", "Temps passé en base, par route")
+            for key, seconds in sorted(self.db_time.items()):
+                lines.append(f'kitchen_db_time_seconds_total{{{_route_labels(key)}}} {seconds:.6f}')
+            header("kitchen_db_n_plus_one_total", "counter",
+                   f"Requêtes HTTP ayant répété une même requête SQL au moins {N_PLUS_ONE_THRESHOLD} fois")
+            for key, n in sorted(self.n_plus_one.items()):
+                lines.append(f'kitchen_db_n_plus_one_total{{{_route_labels(key)}}} {n}')
+            header("kitchen_ai_call_duration_seconds", "histogram", "Durée des appels Gemini par modèle")
+            for (model, outcome), hist in sorted(self.ai_calls.items()):
+                histogram("kitchen_ai_call_duration_seconds", f'model="{_esc(model)}",outcome="{outcome}"', hist)
+        startup = coldstart.snapshot()
+        header("kitchen_startup_seconds", "gauge", "Démarrage à froid : import de main et délai avant d'être prêt")
+        lines.append(f'kitchen_startup_seconds{{stage="import"}} {startup["import_seconds"]:.6f}')
+        lines.append(f'kitchen_startup_seconds{{stage="ready"}} {startup["ready_seconds"]:.6f}')
+        header("kitchen_startup_phase_seconds", "gauge", "Durée cumulée de chaque phase d'initialisation")
+        for name, entry in startup["phases"].items():
+            lines.append(f'kitchen_startup_phase_seconds{{phase="{_esc(name)}"}} {entry["seconds"]:.6f}')
+        return "\n".join(lines) + "\n"
+
+
+def _esc(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _route_labels(key) -> str:
+    method, route = key
+    return f'method="{method}",route="{_esc(route)}"'
+
+
+registry = MetricsRegistry()
+
+
+# --- ÉVÉNEMENTS SQLALCHEMY ---
+# Sur la classe Engine : moteur synchrone, moteur asynchrone et tout moteur créé plus tard
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = current_request.get()
+    if stats is None:
+        registry.record_background(elapsed)
+        return
+    pattern = statement_pattern(statement)
+    stats.statements += 1
+    stats.db_time += elapsed
+    stats.patterns[pattern] += 1
+    stats.pattern_time[pattern] += elapsed
+
+
+# --- MIDDLEWARE HTTP ---
+async def track_request(request, call_next):
+    stats = RequestStats()
+    token = current_request.set(stats)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        current_request.reset(token)
+        route = getattr(request.scope.get("route"), "path", None) or "unmatched"
+        registry.record_request(request.method, route, status, elapsed, stats)
+        suspects = stats.suspected_n_plus_one()
+        if suspects:
+            print(f"[N+1] {request.method} {route} : {suspects[0][1]}x {suspects[0][0][:160]}")
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            log_slow_request(request.method, route, status, elapsed, stats)
+
+
+def log_slow_request(method, route, status, elapsed, stats: RequestStats):
+    print(f"[LENT] {method} {route} -> {status} en {elapsed * 1000:.1f} ms, "
+          f"{stats.statements} requêtes SQL ({stats.db_time * 1000:.1f} ms en base)")
+    top = sorted(stats.patterns, key=lambda p: stats.pattern_time[p], reverse=True)[:5]
+    for pattern in top:
+        print(f"    {stats.patterns[pattern]:4d}x {stats.pattern_time[pattern] * 1000:8.2f} ms  {pattern[:200]}")
@@ -0,0 +1,124 @@
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.orm import Session
+from models import Recipe, RecipeIngredient
+from services import demand_logic, units
+from services.ingredient_logic import normalize_name, resolve_ingredients
+
+
+def recipe_summary(recipe: Recipe) -> dict:
+    return {"id": recipe.id, "name": recipe.name, "instructions": recipe.instructions}
+
+
+def create_recipe(db: Session, data: dict) -> dict:
+    db_recipe = Recipe(name=data['name'], instructions=data.get('instructions', ""))
+    db.add(db_recipe)
+
+    ids = resolve_ingredients(db, [
+        (ing_data['name'], ing_data.get('unit', 'unit'), "Divers") for ing_data in data['ingredients']
+    ])
+    for ing_data in data['ingredients']:
+        db_recipe.ingredients.append(RecipeIngredient(
+            ingredient_id=ids[normalize_name(ing_data['name'])],
+            quantity_required=float(ing_data['quantity']),
+            unit=ing_data.get('unit')
+        ))
+    db.flush()
+    units.refresh_recipe_lines(db, [db_recipe.id])
+    return recipe_summary(db_recipe)
+
+
+def diff_lines(stored, wanted):
+    """
+    Rapproche les lignes enregistrées [(id, ingredient_id, quantité, unité)] des lignes voulues
+    [(ingredient_id, quantité, unité)]. Une ligne identique est conservée ; sinon une ligne restante
+    du même ingrédient est modifiée sur place. Retourne (ajouts, modifications [(id, quantité, unité)], suppressions).
+    """
+    remaining = list(stored)
+    pending = []
+    for line in wanted:
+        same = next((s for s in remaining if s[1:] == line), None)
+        if same is not None:
+            remaining.remove(same)
+        else:
+            pending.append(line)
+    added, changed = [], []
+    for ingredient_id, quantity, unit in pending:
+        reused = next((s for s in remaining if s[1] == ingredient_id), None)
+        if reused is not None:
+            remaining.remove(reused)
+            changed.append((reused[0], quantity, unit))
+        else:
+            added.append((ingredient_id, quantity, unit))
+    return added, changed, [s[0] for s in remaining]
+
+
+def _sync_lines(db: Session, recipe_id: int, lines) -> bool:
+    """Écrit le diff des lignes en requêtes groupées ; la demande planifiée suit les seules lignes touchées."""
+    ids = resolve_ingredients(db, [
+        (ing_data.get('name', 'Inconnu'), ing_data.get('unit', 'unit'), "Divers") for ing_data in lines
+    ])
+    wanted = [
+        (ids[normalize_name(ing_data.get('name', 'Inconnu'))], float(ing_data.get('quantity', 0)), ing_data.get('unit'))
+        for ing_data in lines
+    ]
+    table = RecipeIngredient.__table__
+    stored = db.execute(
+        select(table.c.id, table.c.ingredient_id, table.c.quantity_required, table.c.unit)
+        .where(table.c.recipe_id == recipe_id)
+        .order_by(table.c.id)
+    ).all()
+    added, changed, removed = diff_lines([tuple(row) for row in stored], wanted)
+    if not (added or changed or removed):
+        return False
+
+    # Les plans utilisant la recette perdent la demande des anciennes lignes et gagnent celle des nouvelles
+    planned = demand_logic.count_plans(db, recipe_id)
+    demand_logic.apply_lines_delta(db, [line_id for line_id, _, _ in changed] + removed, -planned)
+    if removed:
+        db.execute(delete(table).where(table.c.id.in_(removed)))
+    if changed:
+        # quantity_canonical remis à NULL : recalculé ci-dessous avec celui des ajouts
+        db.execute(
+            update(table).where(table.c.id == bindparam("line_id"))
+            .values(quantity_required=bindparam("new_quantity"), unit=bindparam("new_unit"), quantity_canonical=None),
+            [{"line_id": line_id, "new_quantity": quantity, "new_unit": unit} for line_id, quantity, unit in changed],
+        )
+    inserted = []
+    if added:
+        inserted = db.execute(
+            insert(table).returning(table.c.id),
+            [{"recipe_id": recipe_id, "ingredient_id": ingredient_id, "quantity_required": quantity, "unit": unit}
+             for ingredient_id, quantity, unit in added],
+        ).scalars().all()
+    if changed or added:
+        units.refresh_recipe_lines(db, [recipe_id], only_missing=True)
+    demand_logic.apply_lines_delta(db, [line_id for line_id, _, _ in changed] + list(inserted), planned)
+    return True
+
+
+def update_recipe(db: Session, recipe_id: int, data: dict, partial: bool = False):
+    """
+    Met à jour une recette par diff : seules les lignes réellement ajoutées, modifiées ou
+    supprimées sont écrites. PUT (partial=False) remplace tous les champs ; PATCH ne touche
+    que les champs présents, et `ingredients`, s'il est donné, est la liste complète des lignes.
+    Retourne (résumé, recette modifiée pour les suggestions), ou None si elle n'existe pas.
+    """
+    db_recipe = db.get(Recipe, recipe_id)
+    if not db_recipe:
+        return None
+
+    renamed = False
+    if not partial or 'name' in data:
+        renamed = data.get('name') != db_recipe.name
+        if renamed:
+            db_recipe.name = data.get('name')
+    if not partial or 'instructions' in data:
+        instructions = data.get('instructions', "")
+        if instructions != db_recipe.instructions:
+            db_recipe.instructions = instructions
+
+    lines_changed = False
+    if not partial or 'ingredients' in data:
+        lines_changed = _sync_lines(db, recipe_id, data.get('ingredients') or [])
+    db.flush()
+    return recipe_summary(db_recipe), renamed or lines_changed
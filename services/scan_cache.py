@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import ai_service
+
+SCAN_CACHE_PATH = os.getenv("SCAN_CACHE_PATH", "./scan_cache.db")
+SCAN_CACHE_MEMORY_ITEMS = int(os.getenv("SCAN_CACHE_MEMORY_ITEMS", "256"))
+SCAN_CACHE_MAX_ROWS = int(os.getenv("SCAN_CACHE_MAX_ROWS", "5000"))
+SCAN_CACHE_TTL = int(os.getenv("SCAN_CACHE_TTL", str(30 * 24 * 3600)))
+
+
+def scan_key(image_bytes: bytes) -> str:
+    """Clé adressée par contenu : image + version du prompt et des modèles."""
+    config = "\x1f".join([ai_service.PROMPT_VERSION, ai_service.PROMPT, *ai_service.MODEL_CANDIDATES])
+    version = hashlib.sha256(config.encode("utf-8")).hexdigest()[:16]
+    return f"{hashlib.sha256(image_bytes).hexdigest()}:{version}"
+
+
+class ScanCache:
+    """
+    Cache des résultats de scan à deux niveaux :
+    - LRU en mémoire (OrderedDict),
+    - fichier SQLite persistant avec TTL et éviction des entrées les moins utilisées.
+    Chaque entrée garde la latence du scan d'origine pour mesurer le temps économisé.
+
+    Le niveau mémoire est consulté sur la boucle d'événements (get_memory, remember) ;
+    le niveau disque est bloquant (load, store) et s'appelle depuis un thread.
+    """
+    def __init__(self, path: str = SCAN_CACHE_PATH, memory_items: int = SCAN_CACHE_MEMORY_ITEMS,
+                 max_rows: int = SCAN_CACHE_MAX_ROWS, ttl: int = SCAN_CACHE_TTL):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()       # niveau mémoire et compteurs (jamais tenu pendant une E/S)
+        self._disk_lock = threading.Lock()  # connexion SQLite
+        self._conn = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0,
+                      "stores": 0, "evictions": 0, "saved_calls": 0, "saved_seconds": 0.0}
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scan_cache ("
+                "key TEXT PRIMARY KEY, result TEXT NOT NULL, latency REAL, created_at REAL, last_hit REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_scan_cache_last_hit ON scan_cache (last_hit)")
+        return self._conn
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _record_hit(self, tier, entry):
+        with self._lock:
+            self.stats[f"{tier}_hits"] += 1
+            self.stats["saved_calls"] += 1
+            self.stats["saved_seconds"] += entry["latency"] or 0.0
+
+    # --- NIVEAU MÉMOIRE (boucle d'événements) ---
+    def get_memory(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if not entry:
+                return None
+            if now - entry["created_at"] >= self.ttl:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+        self._record_hit("memory", entry)
+        return entry["result"]
+
+    def remember(self, key: str, result, latency: float):
+        self._remember(key, {"result": result, "latency": latency, "created_at": time.time()})
+
+    # --- NIVEAU DISQUE (bloquant : à appeler hors de la boucle) ---
+    def load(self, key: str):
+        now = time.time()
+        with self._disk_lock:
+            conn = self._db()
+            row = conn.execute(
+                "SELECT result, latency, created_at FROM scan_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE scan_cache SET last_hit = ? WHERE key = ?", (now, key))
+                conn.commit()
+        if row is None:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        entry = {"result": json.loads(row[0]), "latency": row[1], "created_at": row[2]}
+        self._remember(key, entry)
+        self._record_hit("disk", entry)
+        return entry["result"]
+
+    def store(self, key: str, result, latency: float):
+        now = time.time()
+        with self._disk_lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO scan_cache (key, result, latency, created_at, last_hit) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(result), latency, now, now),
+            )
+            evicted = self._evict(conn, now)
+            conn.commit()
+        with self._lock:
+            self.stats["stores"] += 1
+            self.stats["evictions"] += evicted
+
+    def get(self, key: str):
+        # Les deux niveaux, en appel bloquant (outillage, tests)
+        result = self.get_memory(key)
+        return result if result is not None else self.load(key)
+
+    def put(self, key: str, result, latency: float):
+        self.remember(key, result, latency)
+        self.store(key, result, latency)
+
+    def _evict(self, conn, now):
+        expired = conn.execute("DELETE FROM scan_cache WHERE created_at <= ?", (now - self.ttl,)).rowcount
+        overflow = conn.execute(
+            "DELETE FROM scan_cache WHERE key IN ("
+            "SELECT key FROM scan_cache ORDER BY last_hit DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        ).rowcount
+        return expired + overflow
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "saved_seconds": round(self.stats["saved_seconds"], 3),
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
@@ -0,0 +1,282 @@
+import asyncio
+import base64
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from anyio import to_thread
+from sqlalchemy import and_, func, or_, select, update
+import ai_service
+import database
+from models import Job
+from services.jobs import JOB_STALE_SECONDS, OWNER
+from services.scan_cache import ScanCache, scan_key
+
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "2"))
+SCAN_MAX_PENDING = int(os.getenv("SCAN_MAX_PENDING", "50"))
+SCAN_MAX_PER_MODEL = int(os.getenv("SCAN_MAX_PER_MODEL", "2"))
+
+KIND = "receipt_scan"
+# Un scan en attente après un 429 reste actif (repris si son processus s'arrête)
+ACTIVE = ("queued", "running", "retrying")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _state(job) -> dict:
+    # Suivi du scan (modèle courant, tentatives, articles lus), dans la colonne result du job
+    return json.loads(job.result) if job.result else {"model": None, "attempts": [], "items": None, "cached": False}
+
+
+class ScanQueue:
+    """
+    File de scans de tickets traitée par un pool borné de workers.
+
+    Chaque scan est un job de la cuisine (table jobs, type "receipt_scan") : son statut se
+    lit depuis n'importe quel worker uvicorn, et un scan en attente survit à un redémarrage
+    (l'image est gardée dans le job jusqu'à la fin). Un passage dans la file correspond à
+    une tentative sur un modèle ; chaque passage réclame le job par une mise à jour
+    conditionnelle, si bien qu'un seul processus l'exécute. Après un 429, le job est remis
+    en file après QUOTA_RETRY_DELAY secondes (call_later) : l'attente n'occupe ni worker ni thread.
+
+    Les images déjà scannées sont servies par le cache, et un envoi identique à un scan
+    en cours reçoit le job déjà créé au lieu d'en créer un second. Seul le niveau mémoire
+    du cache est lu sur la boucle : la base et le fichier du cache passent par des threads.
+    """
+    def __init__(self, workers: int = SCAN_WORKERS, max_pending: int = SCAN_MAX_PENDING,
+                 max_per_model: int = SCAN_MAX_PER_MODEL, cache: ScanCache = None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_per_model = max_per_model
+        self.cache = cache
+        self._pending = set()  # (cuisine, job) en file ou en cours dans ce processus
+        self._backlog = []     # scans à reprendre signalés avant le démarrage
+        self._loop = None
+        self._queue = None
+        self._tasks = []
+        self._executor = None
+        self._model_slots = {}
+
+    # --- CYCLE DE VIE ---
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scan")
+        self._model_slots = {m: asyncio.Semaphore(self.max_per_model) for m in ai_service.MODEL_CANDIDATES}
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        for kitchen, job_id in self._backlog:
+            self._enqueue(kitchen, job_id)
+        self._backlog = []
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = self._queue = None
+        self._pending.clear()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def resume(self, shard: database.Shard):
+        """Hook d'ouverture d'une cuisine : reprise des scans restés actifs (redémarrage, autre worker arrêté)."""
+        db = shard.sessionmaker()
+        try:
+            pending = db.execute(select(Job.id).where(Job.kind == KIND, Job.status.in_(ACTIVE))).scalars().all()
+        finally:
+            db.close()
+        for job_id in pending:
+            if self._loop is None:
+                self._enqueue(shard.kitchen, job_id)
+            else:
+                self._loop.call_soon_threadsafe(self._enqueue, shard.kitchen, job_id)
+
+    # --- API ---
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def submit(self, kitchen: str, image_bytes: bytes) -> dict:
+        key = scan_key(image_bytes)
+        cached = self.cache.get_memory(key) if self.cache else None
+        if cached is None and self.pending_count() >= self.max_pending:
+            raise QueueFullError("File de scan pleine, réessayez plus tard.")
+        job, created = await to_thread.run_sync(self._create, kitchen, key, image_bytes, cached)
+        if created and job["status"] == "queued":
+            self._enqueue(kitchen, job["id"])
+        return job
+
+    def get(self, db, kitchen: str, job_id: str):
+        job = db.get(Job, job_id)
+        return self.public(job, kitchen) if job is not None and job.kind == KIND else None
+
+    def public(self, job: Job, kitchen: str) -> dict:
+        state = _state(job)
+        updated = job.finished_at or job.heartbeat or job.created_at
+        return {
+            "id": job.id, "status": job.status, "model": state["model"], "attempts": state["attempts"],
+            "result": state["items"], "error": job.error, "cached": state["cached"],
+            "created_at": job.created_at.isoformat(), "updated_at": updated.isoformat(),
+            "position": self._position(kitchen, job.id) if job.status == "queued" else None,
+        }
+
+    # --- BASE (threads) ---
+    def _create(self, kitchen, key, image_bytes, cached):
+        db = database.router.sessionmaker(kitchen)()
+        try:
+            if cached is None:
+                # Même image en cours de scan (ce processus ou un autre) : le job existant est renvoyé
+                running = db.execute(select(Job).where(Job.kind == KIND, Job.request_hash == key,
+                                                       Job.status.in_(ACTIVE)).limit(1)).scalar()
+                if running is not None:
+                    if self.cache:
+                        self.cache.stats["coalesced"] += 1
+                    return self.public(running, kitchen), False
+            now = datetime.now()
+            job = Job(id=uuid.uuid4().hex, kind=KIND, status="queued", request_hash=key, done=0,
+                      total=len(ai_service.MODEL_CANDIDATES), cancel_requested=False, created_at=now,
+                      payload=json.dumps({"image": base64.b64encode(image_bytes).decode("ascii")}))
+            if cached is not None:
+                job.status, job.payload, job.finished_at = "done", None, now
+                job.result = json.dumps({"model": None, "attempts": [], "items": cached, "cached": True})
+            db.add(job)
+            created = self.public(job, kitchen)  # avant le commit : pas de relecture de la ligne
+            db.commit()
+            return created, True
+        finally:
+            db.close()
+
+    def _claim(self, kitchen, job_id):
+        """Réclame le job pour une tentative : (état, image), ou None s'il est pris, fini ou annulé."""
+        db = database.router.sessionmaker(kitchen)()
+        try:
+            now = datetime.now()
+            stale = now - timedelta(seconds=JOB_STALE_SECONDS)
+            claimed = db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.kind == KIND, Job.cancel_requested.is_not(True),
+                       or_(Job.status == "queued",
+                           and_(Job.status.in_(("running", "retrying")), or_(Job.owner == OWNER, Job.heartbeat < stale))))
+                .values(status="running", owner=OWNER, heartbeat=now,
+                        started_at=func.coalesce(Job.started_at, now))
+                .returning(Job.result, Job.payload)
+                .execution_options(synchronize_session=False)
+            ).first()
+            if claimed is None:
+                # Annulation demandée pendant une tentative de ce processus : le job est clos ici
+                db.execute(update(Job).where(Job.id == job_id, Job.kind == KIND, Job.owner == OWNER,
+                                             Job.cancel_requested.is_(True), Job.status.in_(ACTIVE))
+                           .values(status="cancelled", payload=None, finished_at=now))
+                db.commit()
+                return None
+            db.commit()
+            return _state(claimed), base64.b64decode(json.loads(claimed.payload)["image"])
+        finally:
+            db.close()
+
+    def _save(self, kitchen, job_id, status, state, error=None):
+        db = database.router.sessionmaker(kitchen)()
+        try:
+            now = datetime.now()
+            values = {"status": status, "result": json.dumps(state, default=str), "error": error,
+                      "heartbeat": now, "done": len(state["attempts"])}
+            if status in ("done", "error"):
+                # Image inutile une fois le scan terminé
+                values.update(payload=None, finished_at=now)
+            db.execute(update(Job).where(Job.id == job_id, Job.owner == OWNER).values(**values))
+            db.commit()
+        finally:
+            db.close()
+
+    # --- INTERNE ---
+    def _enqueue(self, kitchen, job_id):
+        if self._queue is None:
+            # File pas encore démarrée : le job sera mis en file par start()
+            self._backlog.append((kitchen, job_id))
+        elif (kitchen, job_id) not in self._pending:
+            self._pending.add((kitchen, job_id))
+            self._queue.put_nowait((kitchen, job_id))
+
+    def _position(self, kitchen, job_id):
+        try:
+            return list(self._queue._queue).index((kitchen, job_id)) if self._queue else None
+        except ValueError:
+            return None
+
+    async def _db(self, fn, *args):
+        return await to_thread.run_sync(fn, *args)
+
+    def _store(self, key, result, latency):
+        try:
+            self.cache.store(key, result, latency)
+        except Exception as e:
+            print(f"Cache des scans : écriture impossible : {e}")
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            kitchen, job_id = await self._queue.get()
+            try:
+                await self._attempt(loop, kitchen, job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Base indisponible : le job reste actif et sera repris (battement de cœur périmé)
+                print(f"Scan {job_id} : {e}")
+                self._pending.discard((kitchen, job_id))
+
+    async def _attempt(self, loop, kitchen, job_id):
+        claimed = await self._db(self._claim, kitchen, job_id)
+        if claimed is None:
+            self._pending.discard((kitchen, job_id))
+            return
+        state, image_bytes = claimed
+        key = scan_key(image_bytes)
+        if self.cache and not state["attempts"]:
+            # Premier passage : niveau disque du cache, lu hors de la boucle
+            try:
+                cached = await loop.run_in_executor(self._executor, self.cache.load, key)
+            except Exception as e:
+                cached = None
+                print(f"Cache des scans : lecture impossible : {e}")
+            if cached is not None:
+                state.update(items=cached, cached=True)
+                await self._finish(kitchen, job_id, "done", state)
+                return
+
+        model_name = ai_service.MODEL_CANDIDATES[len(state["attempts"])]
+        state["model"] = model_name
+        started = time.monotonic()
+        try:
+            async with self._model_slots[model_name]:
+                result = await loop.run_in_executor(self._executor, ai_service.call_model, model_name, image_bytes)
+        except Exception as e:
+            print(f"Échec avec {model_name}: {str(e)[:100]}...")
+            state["attempts"].append({"model": model_name, "ok": False, "error": str(e)[:200]})
+            if len(state["attempts"]) >= len(ai_service.MODEL_CANDIDATES):
+                print(f"ERREUR FATALE AI : Aucun modèle n'a répondu favorablement.")
+                await self._finish(kitchen, job_id, "error", state, error=str(e))
+            elif ai_service.is_quota_error(e):
+                await self._db(self._save, kitchen, job_id, "retrying", state)
+                loop.call_later(ai_service.QUOTA_RETRY_DELAY, self._requeue, kitchen, job_id)
+            else:
+                await self._db(self._save, kitchen, job_id, "running", state)
+                self._requeue(kitchen, job_id)
+            return
+        state["attempts"].append({"model": model_name, "ok": True})
+        state["items"] = result
+        if self.cache:
+            latency = time.monotonic() - started
+            self.cache.remember(key, result, latency)
+            self._executor.submit(self._store, key, result, latency)
+        await self._finish(kitchen, job_id, "done", state)
+
+    async def _finish(self, kitchen, job_id, status, state, error=None):
+        await self._db(self._save, kitchen, job_id, status, state, error)
+        self._pending.discard((kitchen, job_id))
+
+    def _requeue(self, kitchen, job_id):
+        self._queue.put_nowait((kitchen, job_id))
@@ -0,0 +1,292 @@
+"""
+Shards des cuisines : initialisation à la première ouverture, et outillage de placement.
+
+    python -m services.shards list
+    python -m services.shards create maison-42 [postgresql+psycopg://pg2/kitchens --schema kitchen_maison-42]
+    python -m services.shards move maison-42 sqlite:///./kitchens/archive/maison-42.db
+    python -m services.shards move maison-42 postgresql+psycopg://pg2/kitchens --schema kitchen_maison-42
+    python -m services.shards split postgresql+psycopg://pg1/kitchens postgresql+psycopg://pg2/kitchens
+    python -m services.shards rebalance postgresql+psycopg://pg1/kitchens postgresql+psycopg://pg2/kitchens
+    python -m services.shards bootstrap [maison-42 ...]
+
+Un déplacement marque la cuisine "moving" dans shards.json (les workers répondent 503
+après au plus SHARD_MAP_TTL secondes), copie ses données par l'export / import NDJSON,
+puis pointe la cuisine vers son nouvel emplacement. L'ancienne base n'est pas supprimée.
+
+L'API ne sert que les cuisines existantes (404 sinon) : une cuisine est créée ici.
+"""
+import argparse
+import glob
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+import database
+from database import DEFAULT_KITCHEN, KITCHEN_DATABASE_URL, KITCHEN_SCHEMA, Shard, default_location, is_sqlite
+from services import demand_logic, inventory_logic, transfer, units
+from services.meal_plan_logic import migrate_legacy_plans
+
+# Délai laissé aux requêtes en cours après le marquage "moving", en plus de SHARD_MAP_TTL
+MOVE_GRACE = float(os.getenv("SHARD_MOVE_GRACE", "2"))
+# Initialisation faite par chaque processus à la première ouverture d'une cuisine :
+# "full" (schéma, migrations, demande) ou "none" pour des bases préparées au déploiement
+# (`python -m services.shards bootstrap`), ce qui raccourcit le démarrage à froid
+SHARD_BOOTSTRAP = os.getenv("SHARD_BOOTSTRAP", "full")
+
+
+# --- INITIALISATION D'UN SHARD ---
+BOOTSTRAPS = {}
+
+
+def bootstrap_provider(name: str):
+    def register(fn):
+        BOOTSTRAPS[name] = fn
+        return fn
+    return register
+
+
+@bootstrap_provider("full")
+def bootstrap(shard: Shard):
+    """Schéma, migrations et demande agrégée d'une cuisine, à sa première ouverture par le processus."""
+    database.sync_schema(shard.engine)
+    migrate_legacy_plans(shard.engine)
+    # Quantités canoniques des lignes d'avant la conversion d'unités, lots du stock d'avant
+    # les lots, puis recalcul complet de la demande agrégée (tenue à jour ensuite par deltas)
+    db = shard.sessionmaker()
+    try:
+        units.backfill_canonical(db)
+        inventory_logic.reconcile_lots(db)
+        demand_logic.rebuild_demand(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+@bootstrap_provider("none")
+def skip_bootstrap(shard: Shard):
+    # Schéma et données déjà à jour : aucune requête à l'ouverture
+    pass
+
+
+if SHARD_BOOTSTRAP not in BOOTSTRAPS:
+    raise ValueError(f"SHARD_BOOTSTRAP inconnu : {SHARD_BOOTSTRAP} (attendu : {', '.join(BOOTSTRAPS)})")
+database.router.open_hooks.append(BOOTSTRAPS[SHARD_BOOTSTRAP])
+
+
+def open_prepared(kitchen: str, url: str, schema: str) -> Shard:
+    """Ouvre un emplacement avec l'initialisation complète, quel que soit SHARD_BOOTSTRAP (outillage)."""
+    shard = Shard(database.router, kitchen, url, schema)
+    fresh = shard.location not in database.router.bootstrapped
+    database.router.bootstrapped.add(shard.location)  # pas de hooks d'ouverture : initialisation explicite
+    shard.open()
+    if fresh:
+        bootstrap(shard)
+    return shard
+
+
+def create(kitchen: str, url: str = "", schema: str = ""):
+    """Crée et initialise une cuisine, à son emplacement par défaut ou sur (url, schema)."""
+    if not database.KITCHEN_ID.match(kitchen):
+        raise ValueError(f"Identifiant de cuisine invalide : {kitchen}")
+    known = discover()
+    if kitchen in known:
+        raise ValueError(f"La cuisine {kitchen} existe déjà : {_describe(known[kitchen]['url'], known[kitchen].get('schema') or '')}")
+    url, schema = (url, schema) if url else default_location(kitchen)
+    for other, entry in known.items():
+        if (entry["url"], entry.get("schema") or "") == (url, schema):
+            raise ValueError(f"{_describe(url, schema)} est déjà occupé par la cuisine {other}")
+    open_prepared(kitchen, url, schema).close()
+    # Emplacement hors gabarit, ou non vérifiable par l'API (une base par cuisine) : inscrit dans shards.json
+    if (url, schema) != default_location(kitchen) or not (schema or is_sqlite(url)):
+        kitchens = database.read_shard_map()
+        kitchens[kitchen] = {"url": url, "schema": schema}
+        database.write_shard_map(kitchens)
+    print(f"{kitchen} créée ({_describe(url, schema)})")
+
+
+def prepare(kitchen: str):
+    """Initialise une cuisine existante avant un déploiement en SHARD_BOOTSTRAP=none."""
+    entry = discover().get(kitchen)
+    if entry is None:
+        raise ValueError(f"Cuisine inconnue : {kitchen} (python -m services.shards create {kitchen})")
+    url, schema = entry["url"], entry.get("schema") or ""
+    started = time.perf_counter()
+    open_prepared(kitchen, url, schema).close()
+    print(f"{kitchen} initialisée en {time.perf_counter() - started:.2f}s ({_describe(url, schema)})")
+
+
+# --- INVENTAIRE ---
+def _template_pattern(template: str):
+    # "kitchen_{kitchen}" -> regex capturant l'identifiant
+    before, _, after = template.partition("{kitchen}")
+    return re.compile(f"^{re.escape(before)}(.+){re.escape(after)}$")
+
+
+def discover() -> dict:
+    """{ cuisine: {"url", "schema", "moving"} } : shards.json, cuisine par défaut et emplacements par défaut existants."""
+    found = {}
+    if "{kitchen}" in KITCHEN_DATABASE_URL and is_sqlite(KITCHEN_DATABASE_URL):
+        path = make_url(KITCHEN_DATABASE_URL).database
+        pattern = _template_pattern(os.path.basename(path))
+        for candidate in glob.glob(path.replace("{kitchen}", "*")):
+            match = pattern.match(os.path.basename(candidate))
+            if match and database.KITCHEN_ID.match(match.group(1)):
+                found[match.group(1)] = {"url": KITCHEN_DATABASE_URL.format(kitchen=match.group(1)), "schema": ""}
+    elif "{kitchen}" in KITCHEN_SCHEMA:
+        pattern = _template_pattern(KITCHEN_SCHEMA)
+        server = database.make_engine(KITCHEN_DATABASE_URL)
+        try:
+            with server.connect() as conn:
+                for (schema,) in conn.execute(text("SELECT schema_name FROM information_schema.schemata")):
+                    match = pattern.match(schema)
+                    if match:
+                        found[match.group(1)] = {"url": KITCHEN_DATABASE_URL, "schema": schema}
+        finally:
+            server.dispose()
+    url, schema = default_location(DEFAULT_KITCHEN)
+    found[DEFAULT_KITCHEN] = {"url": url, "schema": schema}
+    found.update(database.read_shard_map())
+    return found
+
+
+def target_location(target: str, kitchen: str):
+    """Emplacement d'une cuisine sur une cible : URL (avec {kitchen} pour un fichier par cuisine)."""
+    url = target.format(kitchen=kitchen)
+    if is_sqlite(url):
+        return url, ""
+    return url, (KITCHEN_SCHEMA or "kitchen_{kitchen}").format(kitchen=kitchen)
+
+
+def _describe(url, schema):
+    return f"{make_url(url).render_as_string(hide_password=True)}{f' (schéma {schema})' if schema else ''}"
+
+
+# --- DÉPLACEMENT ---
+def _set_entry(kitchen: str, entry):
+    kitchens = database.read_shard_map()
+    if entry is None or (entry["url"], entry.get("schema") or "") == default_location(kitchen) \
+            and not entry.get("moving"):
+        kitchens.pop(kitchen, None)
+    else:
+        kitchens[kitchen] = entry
+    database.write_shard_map(kitchens)
+
+
+def move(kitchen: str, url: str, schema: str = "") -> dict:
+    """Copie une cuisine vers (url, schema) et l'y fait pointer. Retourne le rapport d'import."""
+    known = discover()
+    source = known.get(kitchen)
+    if source is None:
+        raise ValueError(f"Cuisine inconnue : {kitchen}")
+    src = (source["url"], source.get("schema") or "")
+    if src == (url, schema):
+        print(f"{kitchen} est déjà sur {_describe(url, schema)}")
+        return {}
+    for other, entry in known.items():
+        if other != kitchen and (entry["url"], entry.get("schema") or "") == (url, schema):
+            raise ValueError(f"{_describe(url, schema)} est déjà occupé par la cuisine {other}")
+
+    previous = database.read_shard_map().get(kitchen)
+    _set_entry(kitchen, {"url": src[0], "schema": src[1], "moving": True})
+    try:
+        time.sleep(database.SHARD_MAP_TTL + MOVE_GRACE)
+        started = datetime.now()
+        old = open_prepared(kitchen, *src)
+        new = open_prepared(kitchen, url, schema)
+        with tempfile.TemporaryFile() as spool:
+            for block in transfer.export_ndjson(old.sessionmaker):
+                spool.write(block)
+            spool.seek(0)
+            report = transfer.import_ndjson(new.sessionmaker, spool, replace=True)
+        old.close()
+        new.close()
+    except BaseException:
+        _set_entry(kitchen, previous)
+        raise
+    _set_entry(kitchen, {"url": url, "schema": schema})
+    print(f"{kitchen} : {_describe(*src)} -> {_describe(url, schema)} "
+          f"en {(datetime.now() - started).total_seconds():.1f}s ({report})")
+    print(f"L'ancienne base de {kitchen} est conservée : {_describe(*src)}")
+    return report
+
+
+def split(source: str, target: str, fraction: float = 0.5):
+    """Déplace une part des cuisines d'un serveur partagé vers une autre cible."""
+    on_source = sorted(k for k, e in discover().items() if e["url"] == source)
+    moving = on_source[len(on_source) - math.ceil(len(on_source) * fraction):] if on_source else []
+    for kitchen in moving:
+        move(kitchen, *target_location(target, kitchen))
+    return moving
+
+
+def rebalance(targets):
+    """Répartit toutes les cuisines à parts égales sur les cibles, en déplaçant le moins possible."""
+    known = discover()
+    placed = {t: [] for t in targets}
+    unplaced = []
+    for kitchen, entry in sorted(known.items()):
+        target = next((t for t in targets if target_location(t, kitchen)[0] == entry["url"]), None)
+        (placed[target] if target else unplaced).append(kitchen)
+    share = math.ceil(len(known) / len(targets))
+    for target in targets:
+        unplaced.extend(placed[target][share:])
+        del placed[target][share:]
+    moves = []
+    for kitchen in unplaced:
+        target = min(targets, key=lambda t: len(placed[t]))
+        placed[target].append(kitchen)
+        move(kitchen, *target_location(target, kitchen))
+        moves.append((kitchen, target))
+    return moves
+
+
+# --- LIGNE DE COMMANDE ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Placement des cuisines sur les shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="cuisines connues et leur emplacement")
+    cr = sub.add_parser("create", help="crée une cuisine")
+    cr.add_argument("kitchen")
+    cr.add_argument("url", nargs="?", default="", help="URL de la base (défaut : KITCHEN_DATABASE_URL)")
+    cr.add_argument("--schema", default="", help="schéma Postgres")
+    mv = sub.add_parser("move", help="déplace une cuisine")
+    mv.add_argument("kitchen")
+    mv.add_argument("url", help="URL de destination ({kitchen} est remplacé par l'identifiant)")
+    mv.add_argument("--schema", default="", help="schéma Postgres de destination")
+    sp = sub.add_parser("split", help="déplace une part des cuisines d'un serveur vers une autre cible")
+    sp.add_argument("source", help="URL du serveur à alléger")
+    sp.add_argument("target", help="URL cible ({kitchen} pour un fichier SQLite par cuisine)")
+    sp.add_argument("--fraction", type=float, default=0.5)
+    rb = sub.add_parser("rebalance", help="répartit les cuisines à parts égales sur les cibles")
+    rb.add_argument("targets", nargs="+", help="URL cibles ({kitchen} pour un fichier SQLite par cuisine)")
+    bs = sub.add_parser("bootstrap", help="initialise les cuisines (schéma, migrations, demande) avant un déploiement")
+    bs.add_argument("kitchens", nargs="*", help="cuisines à initialiser (défaut : toutes les cuisines connues)")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for kitchen, entry in sorted(discover().items()):
+            flag = "  [migration en cours]" if entry.get("moving") else ""
+            print(f"{kitchen:32s} {_describe(entry['url'], entry.get('schema') or '')}{flag}")
+    elif args.command == "create":
+        create(args.kitchen, args.url.format(kitchen=args.kitchen), args.schema)
+    elif args.command == "move":
+        move(args.kitchen, args.url.format(kitchen=args.kitchen), args.schema)
+    elif args.command == "bootstrap":
+        for kitchen in args.kitchens or sorted(discover()):
+            prepare(kitchen)
+    elif args.command == "split":
+        moved = split(args.source, args.target, args.fraction)
+        print(f"{len(moved)} cuisine(s) déplacée(s)")
+    else:
+        moves = rebalance(args.targets)
+        print(f"{len(moves)} cuisine(s) déplacée(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+import threading
+from collections import Counter
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from database import PerKitchen
+from models import Ingredient, PantryItem, Recipe, RecipeIngredient
+from services import table_versions
+
+EPSILON = 1e-9
+TRACKED_TABLES = (Recipe.__tablename__, RecipeIngredient.__tablename__, PantryItem.__tablename__)
+
+
+class RecipeMatrix:
+    """
+    Matrice creuse recettes x ingrédients (quantités requises) et vecteur de stock,
+    en quantités canoniques (unité de base de chaque ingrédient).
+
+    Les recettes et le stock modifiés sont signalés par recipes_changed / stock_changed
+    puis relus par lot au calcul suivant ; la matrice CSR n'est reconstruite que si
+    une recette a changé, le vecteur de stock est mis à jour en place.
+
+    Comme l'index des ingrédients, chaque calcul compare les versions des tables suivies
+    au nombre de commits faits par ce processus : une écriture venue d'ailleurs (autre
+    worker, job en processus séparé, import ou déplacement en ligne de commande)
+    provoque un rechargement complet.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._versions = None
+        self._local_commits = Counter()  # { table: commits de ce processus depuis la dernière lecture }
+        self._recipes = {}  # { recipe_id: (nom, { ingredient_id: quantité }) }
+        self._columns = {}  # { ingredient_id: colonne }
+        self._stock = np.zeros(0)
+        self._dirty_recipes = set()
+        self._dirty_stock = set()
+        self._matrix = None
+        self._row_ids = None
+
+    # --- SIGNALEMENT DES CHANGEMENTS ---
+    def recipes_changed(self, recipe_ids):
+        with self._lock:
+            self._dirty_recipes.update(recipe_ids)
+
+    def stock_changed(self, ingredient_ids):
+        with self._lock:
+            self._dirty_stock.update(ingredient_ids)
+
+    def tables_committed(self, tables):
+        with self._lock:
+            self._local_commits.update(t for t in tables if t in TRACKED_TABLES)
+
+    def reset(self):
+        with self._lock:
+            self._loaded = False
+
+    # --- CHARGEMENT ---
+    def _column(self, ingredient_id):
+        col = self._columns.get(ingredient_id)
+        if col is None:
+            col = self._columns[ingredient_id] = len(self._columns)
+            if col >= len(self._stock):
+                self._stock = np.concatenate([self._stock, np.zeros(max(64, len(self._stock)))])
+        return col
+
+    def _load_recipes(self, db: Session, recipe_ids=None):
+        query = select(Recipe.id, Recipe.name)
+        lines = select(RecipeIngredient.recipe_id, RecipeIngredient.ingredient_id, RecipeIngredient.quantity_canonical)
+        if recipe_ids is not None:
+            query = query.where(Recipe.id.in_(recipe_ids))
+            lines = lines.where(RecipeIngredient.recipe_id.in_(recipe_ids))
+            for recipe_id in recipe_ids:
+                self._recipes.pop(recipe_id, None)
+        for recipe_id, name in db.execute(query):
+            self._recipes[recipe_id] = (name, {})
+        for recipe_id, ing_id, qty in db.execute(lines):
+            if recipe_id in self._recipes and ing_id is not None:
+                row = self._recipes[recipe_id][1]
+                row[ing_id] = row.get(ing_id, 0.0) + (qty or 0.0)
+                self._column(ing_id)
+        self._matrix = None
+
+    def _load_stock(self, db: Session, ingredient_ids=None):
+        query = select(PantryItem.ingredient_id, PantryItem.quantity_canonical)
+        if ingredient_ids is not None:
+            query = query.where(PantryItem.ingredient_id.in_(ingredient_ids))
+            for ing_id in ingredient_ids:
+                if ing_id in self._columns:
+                    self._stock[self._columns[ing_id]] = 0.0
+        else:
+            self._stock[:] = 0.0
+        for ing_id, qty in db.execute(query):
+            # Colonne d'abord : _column peut réallouer self._stock
+            col = self._column(ing_id)
+            self._stock[col] = qty or 0.0
+
+    def _sync(self, db: Session):
+        current = table_versions.versions(db, TRACKED_TABLES)
+        explained = self._versions is not None and all(
+            current[t] - self._versions[t] == self._local_commits[t] for t in TRACKED_TABLES
+        )
+        self._versions = current
+        self._local_commits.clear()
+        if not explained:
+            self._loaded = False
+        # Versions expliquées : les lignes signalées (éventuellement après le commit) sont relues
+        if not self._loaded:
+            self._recipes, self._columns, self._stock = {}, {}, np.zeros(0)
+            self._dirty_recipes.clear()
+            self._dirty_stock.clear()
+            self._load_recipes(db)
+            self._load_stock(db)
+            self._loaded = True
+            return
+        if self._dirty_recipes:
+            self._load_recipes(db, list(self._dirty_recipes))
+            self._dirty_recipes.clear()
+        if self._dirty_stock:
+            self._load_stock(db, list(self._dirty_stock))
+            self._dirty_stock.clear()
+
+    def _build(self):
+        # Import différé : scipy n'est chargé qu'au premier calcul de suggestions (démarrage à froid)
+        from scipy import sparse
+        row_ids = np.fromiter(self._recipes.keys(), dtype=np.int64, count=len(self._recipes))
+        indptr, indices, data = [0], [], []
+        for recipe_id in row_ids:
+            row = self._recipes[recipe_id][1]
+            indices.extend(self._columns[i] for i in row)
+            data.extend(row.values())
+            indptr.append(len(indices))
+        self._matrix = sparse.csr_matrix(
+            (np.asarray(data, dtype=float), np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+            shape=(len(row_ids), len(self._columns)),
+        )
+        self._row_ids = row_ids
+
+    # --- CALCUL VECTORISÉ ---
+    def _scores(self):
+        matrix = self._matrix
+        n = matrix.shape[0]
+        counts = np.diff(matrix.indptr)
+        rows = np.repeat(np.arange(n), counts)
+        required = matrix.data
+        stock = self._stock[matrix.indices]
+
+        in_stock = np.bincount(rows, weights=(stock + EPSILON >= required), minlength=n)
+        missing_qty = np.bincount(rows, weights=np.maximum(required - stock, 0.0), minlength=n)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            match = np.where(counts > 0, in_stock / np.maximum(counts, 1) * 100.0, 0.0)
+            ratios = np.where(required > 0, np.floor((stock + EPSILON) / required), np.inf)
+
+        servings = np.zeros(n)
+        non_empty = counts > 0
+        if non_empty.any():
+            servings[non_empty] = np.minimum.reduceat(ratios, matrix.indptr[:-1][non_empty])
+        servings[~np.isfinite(servings)] = 0.0
+        return counts, in_stock, missing_qty, match, servings
+
+    def suggest(self, db: Session, limit: int = None, category: str = None, max_missing: int = None):
+        """
+        Classe toutes les recettes en une passe : pourcentage d'ingrédients en stock,
+        quantité manquante, nombre d'ingrédients manquants et portions réalisables.
+        `category` ne garde que les recettes utilisant un ingrédient de cette catégorie.
+        """
+        with self._lock:
+            self._sync(db)
+            if self._matrix is None:
+                self._build()
+            counts, in_stock, missing_qty, match, servings = self._scores()
+            keep = counts > 0
+            if max_missing is not None:
+                keep &= (counts - in_stock) <= max_missing
+            if category is not None:
+                wanted = np.zeros(self._matrix.shape[1])
+                for (ing_id,) in db.execute(select(Ingredient.id).where(Ingredient.category == category)):
+                    if ing_id in self._columns:
+                        wanted[self._columns[ing_id]] = 1.0
+                keep &= (self._matrix != 0).astype(float) @ wanted > 0
+
+            candidates = np.flatnonzero(keep)
+            # Tri : meilleur pourcentage, puis plus de portions, puis moins de quantité manquante
+            order = candidates[np.lexsort((missing_qty[candidates], -servings[candidates], -match[candidates]))]
+            if limit is not None:
+                order = order[:limit]
+            return [
+                {
+                    "recipe_id": int(self._row_ids[i]),
+                    "recipe_name": self._recipes[int(self._row_ids[i])][0],
+                    "match_percentage": float(match[i]),
+                    "missing_items": int(counts[i] - in_stock[i]),
+                    "missing_quantity": float(missing_qty[i]),
+                    "cookable_servings": int(servings[i]),
+                }
+                for i in order
+            ]
+
+
+# Une matrice par cuisine ; les signalements visent la cuisine de la requête en cours
+matrix = PerKitchen(lambda kitchen: RecipeMatrix())
+
+
+def _count_commit(kitchen, tables):
+    # Commit local : compté pour distinguer nos écritures de celles des autres processus
+    if any(t in TRACKED_TABLES for t in tables):
+        matrix.get(kitchen).tables_committed(tables)
+
+
+table_versions.commit_hooks.append(_count_commit)
@@ -0,0 +1,110 @@
+import os
+import random
+import threading
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from database import dialect_insert, session_kitchen
+from models import ChangeEvent, Job, TableVersion
+
+# Clé de Session.info où sont notées les tables modifiées par la transaction en cours
+TOUCHED_KEY = "touched_tables"
+COMMITTED_KEY = "committed_tables"
+IGNORED_TABLES = {TableVersion.__tablename__, ChangeEvent.__tablename__, Job.__tablename__}
+
+# "shared" : versions lues dans table_versions à chaque requête (cohérent entre workers).
+# "local" : compteurs en mémoire du processus, amorcés depuis la base (un seul worker).
+VERSION_SOURCE = os.getenv("TABLE_VERSION_SOURCE", "shared")
+
+_local_versions = {}  # { cuisine: { table: version } }
+_local_lock = threading.Lock()
+
+# hook(cuisine, tables) après chaque commit de ce processus ayant modifié des tables suivies
+commit_hooks = []
+
+
+def touch(session: Session, *tables):
+    session.info.setdefault(TOUCHED_KEY, set()).update(t for t in tables if t not in IGNORED_TABLES)
+
+
+def current_versions(db: Session, tables) -> dict:
+    rows = dict(db.execute(
+        select(TableVersion.table_name, TableVersion.version).where(TableVersion.table_name.in_(list(tables)))
+    ).all())
+    return {table: rows.get(table, 0) for table in tables}
+
+
+def versions(db: Session, tables) -> dict:
+    """Versions courantes des tables, selon TABLE_VERSION_SOURCE."""
+    if VERSION_SOURCE != "local":
+        return current_versions(db, tables)
+    kitchen = session_kitchen(db)
+    with _local_lock:
+        local = _local_versions.get(kitchen)
+        if local is None:
+            local = _local_versions[kitchen] = dict(
+                db.execute(select(TableVersion.table_name, TableVersion.version)).all())
+        return {table: local.get(table, 0) for table in tables}
+
+
+# --- SUIVI AUTOMATIQUE DES ÉCRITURES ---
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table:
+            touch(session, table)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement(orm_execute_state):
+    # INSERT / UPDATE / DELETE ensemblistes, qui ne passent pas par le flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None:
+            touch(orm_execute_state.session, table.name)
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_versions(session):
+    """Incrémente en une requête la version de chaque table modifiée, dans la transaction validée."""
+    session.flush()
+    touched = session.info.pop(TOUCHED_KEY, None)
+    if not touched:
+        return
+    # Une table sans version démarre à une valeur aléatoire : une base recréée
+    # ne peut pas rejouer les ETags d'une ancienne base
+    stmt = dialect_insert(session, TableVersion).values(
+        [{"table_name": table, "version": random.randrange(1, 1 << 30)} for table in sorted(touched)]
+    )
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[TableVersion.table_name],
+        set_={"version": TableVersion.version + 1},
+    ))
+    session.info.pop(TOUCHED_KEY, None)
+    session.info[COMMITTED_KEY] = touched
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_local_versions(session):
+    committed = session.info.pop(COMMITTED_KEY, None)
+    if not committed:
+        return
+    kitchen = session_kitchen(session)
+    for hook in commit_hooks:
+        hook(kitchen, committed)
+    with _local_lock:
+        local = _local_versions.get(kitchen)
+        if local is None:
+            return
+        # Table inconnue localement (première écriture) : on relira la base
+        if any(table not in local for table in committed):
+            del _local_versions[kitchen]
+        else:
+            for table in committed:
+                local[table] += 1
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_versions(session):
+    session.info.pop(TOUCHED_KEY, None)
+    session.info.pop(COMMITTED_KEY, None)
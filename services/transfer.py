@@ -0,0 +1,481 @@
+"""
+Export / import NDJSON de toute la cuisine (sauvegarde, migration d'une instance à l'autre).
+
+    python -m services.transfer export cuisine.ndjson.gz
+    python -m services.transfer import cuisine.ndjson.gz [--replace]
+
+Une ligne JSON par enregistrement, `type` en tête : en-tête, ingrédients, recettes (avec
+leurs lignes), stock, basiques, plans de repas, liste de courses. Les sections sont écrites
+dans l'ordre de leurs dépendances, lues en flux (yield_per) et relues en flux : la mémoire
+ne dépend que de la taille d'un lot et des tables de correspondance d'IDs.
+"""
+import argparse
+import gzip
+import sys
+from collections import Counter
+from datetime import date, datetime
+from itertools import groupby
+import orjson
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+from database import dialect_insert
+from models import (Ingredient, IngredientDemand, ImportState, MasterIngredientRow, MealPlan, PantryItem,
+                    PantryLot, Recipe, RecipeIngredient, ShoppingList, WeeklyStaple)
+from services import changefeed, demand_logic, inventory_logic, units
+from services.ingredient_logic import normalize_name
+
+FORMAT = "kitchen-ndjson"
+VERSION = 1
+SECTIONS = ("ingredients", "recipes", "pantry", "staples", "meal_plans", "shopping_list")
+
+YIELD_PER = 2000                # lignes lues par aller-retour du curseur
+WRITE_BUFFER = 256 * 1024       # octets accumulés avant d'émettre un bloc
+IMPORT_CHUNK = 5000             # enregistrements par INSERT / upsert
+IN_CHUNK = 500                  # valeurs par clause IN (limite de variables SQLite)
+
+
+# --- EXPORT ---
+def _stream(db: Session, stmt):
+    return db.execute(stmt.execution_options(yield_per=YIELD_PER))
+
+
+def _export_ingredients(db):
+    for row in _stream(db, select(Ingredient.id, Ingredient.name, Ingredient.category, Ingredient.unit,
+                                  Ingredient.density, Ingredient.piece_weight).order_by(Ingredient.id)):
+        yield {"type": "ingredient", "id": row.id, "name": row.name, "category": row.category,
+               "unit": row.unit, "density": row.density, "piece_weight": row.piece_weight}
+
+
+def _export_recipes(db):
+    # Une seule requête triée par recette : les lignes consécutives sont regroupées au vol
+    rows = _stream(db, select(Recipe.id, Recipe.name, Recipe.instructions, RecipeIngredient.ingredient_id,
+                              RecipeIngredient.quantity_required, RecipeIngredient.unit)
+                   .outerjoin(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id)
+                   .order_by(Recipe.id, RecipeIngredient.id))
+    for recipe_id, lines in groupby(rows, key=lambda r: r.id):
+        lines = list(lines)
+        yield {"type": "recipe", "id": recipe_id, "name": lines[0].name, "instructions": lines[0].instructions,
+               "ingredients": [{"ingredient_id": l.ingredient_id, "quantity": l.quantity_required, "unit": l.unit}
+                               for l in lines if l.ingredient_id is not None]}
+
+
+def _export_pantry(db):
+    # Comme les recettes : lots de chaque ingrédient regroupés au vol (quantités canoniques)
+    rows = _stream(db, select(PantryItem.ingredient_id, PantryItem.quantity_available, PantryLot.quantity_canonical,
+                              PantryLot.purchased_at, PantryLot.expires_at, PantryLot.source)
+                   .outerjoin(PantryLot, PantryLot.ingredient_id == PantryItem.ingredient_id)
+                   .order_by(PantryItem.ingredient_id, PantryLot.id))
+    for ingredient_id, lots in groupby(rows, key=lambda r: r.ingredient_id):
+        lots = list(lots)
+        yield {"type": "pantry", "ingredient_id": ingredient_id, "quantity": lots[0].quantity_available,
+               "lots": [{"quantity_canonical": l.quantity_canonical, "source": l.source,
+                         "purchased_at": l.purchased_at.isoformat() if l.purchased_at else None,
+                         "expires_at": l.expires_at.isoformat() if l.expires_at else None}
+                        for l in lots if l.quantity_canonical is not None]}
+
+
+def _export_staples(db):
+    for row in _stream(db, select(WeeklyStaple.ingredient_id, WeeklyStaple.default_quantity)
+                       .order_by(WeeklyStaple.ingredient_id)):
+        yield {"type": "staple", "ingredient_id": row.ingredient_id, "quantity": row.default_quantity}
+
+
+def _export_meal_plans(db):
+    for row in _stream(db, select(MealPlan.id, MealPlan.date, MealPlan.slot, MealPlan.recipe_id)
+                       .order_by(MealPlan.id)):
+        yield {"type": "meal_plan", "id": row.id, "date": row.date.isoformat() if row.date else None,
+               "slot": row.slot, "recipe_id": row.recipe_id}
+
+
+def _export_shopping_list(db):
+    for row in _stream(db, select(ShoppingList.ingredient_id, ShoppingList.quantity_needed,
+                                  ShoppingList.is_checked, ShoppingList.source).order_by(ShoppingList.id)):
+        yield {"type": "shopping", "ingredient_id": row.ingredient_id, "quantity": row.quantity_needed,
+               "is_checked": bool(row.is_checked), "source": row.source}
+
+
+EXPORTERS = {
+    "ingredients": _export_ingredients, "recipes": _export_recipes, "pantry": _export_pantry,
+    "staples": _export_staples, "meal_plans": _export_meal_plans, "shopping_list": _export_shopping_list,
+}
+
+
+def parse_sections(sections):
+    if not sections:
+        return list(SECTIONS)
+    wanted = [s.strip() for s in (sections.split(",") if isinstance(sections, str) else sections) if s.strip()]
+    unknown = set(wanted) - set(SECTIONS)
+    if unknown:
+        raise ValueError(f"Sections inconnues : {', '.join(sorted(unknown))}")
+    return [s for s in SECTIONS if s in wanted]
+
+
+def export_ndjson(session_factory, sections=None):
+    """
+    Générateur de blocs NDJSON (bytes). La session est ouverte par le générateur
+    lui-même : il peut être consommé après la fin de la requête HTTP qui l'a créé.
+    """
+    wanted = parse_sections(sections)
+    db = session_factory()
+    try:
+        buffer = bytearray(orjson.dumps({"type": "header", "format": FORMAT, "version": VERSION,
+                                         "exported_at": datetime.now().isoformat(timespec="seconds"),
+                                         "sections": wanted}))
+        buffer += b"\n"
+        for section in wanted:
+            for record in EXPORTERS[section](db):
+                buffer += orjson.dumps(record)
+                buffer += b"\n"
+                if len(buffer) >= WRITE_BUFFER:
+                    yield bytes(buffer)
+                    buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+    finally:
+        db.close()
+
+
+# --- IMPORT ---
+def _in_chunks(values, size=IN_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _date(value):
+    return date.fromisoformat(value) if value else None
+
+
+def _insert_by_name(db: Session, model, rows) -> dict:
+    """
+    INSERT en lot (les noms pris entre-temps sont ignorés) puis relecture des IDs par nom.
+    Sur la table et non l'entité ORM : les colonnes à None ne scindent pas le lot.
+    """
+    db.execute(dialect_insert(db, model.__table__).on_conflict_do_nothing(index_elements=["name"]), rows)
+    ids = {}
+    for names in _in_chunks([row["name"] for row in rows]):
+        ids.update((name, row_id) for row_id, name in db.execute(select(model.id, model.name).where(model.name.in_(names))))
+    return ids
+
+
+def _bulk_update(db: Session, model, rows, column):
+    """UPDATE ... WHERE id = ? en un seul executemany pour { id, column }."""
+    if rows:
+        table = model.__table__
+        db.execute(update(table).where(table.c.id == bindparam("row_id")).values({column: bindparam("value")}),
+                   [{"row_id": row["id"], "value": row[column]} for row in rows])
+
+
+def wipe(db: Session):
+    """Vide la cuisine (import --replace), tables dépendantes d'abord."""
+    for model in (ShoppingList, MealPlan, PantryLot, PantryItem, WeeklyStaple, RecipeIngredient, Recipe, IngredientDemand,
+                  MasterIngredientRow, ImportState, Ingredient):
+        db.execute(delete(model))
+
+
+class NdjsonImporter:
+    """
+    Applique un flux d'enregistrements par lots : un INSERT / upsert par lot et par table,
+    le tout dans une seule transaction (un import interrompu, --replace compris, ne laisse
+    rien). Les IDs du fichier sont remappés vers ceux de la base cible par des dictionnaires
+    en mémoire ; les ingrédients (nom normalisé) et les recettes (nom) déjà présents sont réutilisés.
+
+    Sans --replace, plans de repas et articles de courses (sans clé naturelle) ne sont ajoutés
+    qu'au-delà des lignes déjà présentes avec la même clé : réimporter un fichier ne les duplique pas.
+    """
+    # Clé de déduplication des sections sans clé naturelle (import sans --replace)
+    MERGE_KEYS = {"meal_plans": ("recipe_id", "date", "slot"), "shopping_list": ("ingredient_id", "source")}
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.ingredient_ids = {}   # ID du fichier -> ID local
+        self.recipe_ids = {}
+        self.known_ingredients = None
+        self.known_recipes = None
+        self.counts = {section: 0 for section in SECTIONS}
+        self.skipped = 0
+        self.duplicates = 0
+        self.merge = False
+        self._present = {}   # { table: { clé: lignes présentes avant l'import } }
+        self._seen = {}      # { table: Counter(clé) } des lignes du fichier
+
+    def _load_known(self):
+        # Noms déjà présents dans la base cible, lus une fois en flux
+        self.known_ingredients = {normalize_name(name): ing_id for ing_id, name in
+                                  _stream(self.db, select(Ingredient.id, Ingredient.name))}
+        self.known_recipes = {name: recipe_id for recipe_id, name in
+                              _stream(self.db, select(Recipe.id, Recipe.name))}
+
+    # --- LOTS PAR TYPE ---
+    def _ingredients(self, records):
+        fresh, profiles = {}, []
+        for rec in records:
+            key = normalize_name(rec.get("name"))
+            if not key:
+                self.skipped += 1
+                continue
+            local = self.known_ingredients.get(key)
+            if local is not None:
+                self.ingredient_ids[rec["id"]] = local
+                # Densité / poids d'une pièce complétés, jamais effacés
+                for field in ("density", "piece_weight"):
+                    if rec.get(field) is not None:
+                        profiles.append({"id": local, field: rec[field]})
+            elif key in fresh:
+                fresh[key][1].append(rec["id"])
+            else:
+                fresh[key] = ({"name": rec["name"].strip(), "category": rec.get("category") or "Divers",
+                               "unit": rec.get("unit") or "unit", "density": rec.get("density"),
+                               "piece_weight": rec.get("piece_weight")}, [rec["id"]])
+        if fresh:
+            new_ids = _insert_by_name(self.db, Ingredient, [row for row, _ in fresh.values()])
+            for key, (row, old_ids) in fresh.items():
+                local = self.known_ingredients[key] = new_ids[row["name"]]
+                for old_id in old_ids:
+                    self.ingredient_ids[old_id] = local
+        for field in ("density", "piece_weight"):
+            _bulk_update(self.db, Ingredient, [row for row in profiles if field in row], field)
+        return len(records)
+
+    def _recipes(self, records):
+        fresh, reused = {}, []
+        for rec in records:
+            name = (rec.get("name") or "").strip()
+            if not name:
+                self.skipped += 1
+                continue
+            local = self.known_recipes.get(name)
+            if local is not None:
+                self.recipe_ids[rec["id"]] = local
+                reused.append({"id": local, "instructions": rec.get("instructions")})
+            else:
+                fresh.setdefault(name, (rec, []))[1].append(rec["id"])
+        if fresh:
+            new_ids = _insert_by_name(self.db, Recipe, [{"name": name, "instructions": rec.get("instructions")}
+                                                        for name, (rec, _) in fresh.items()])
+            for name, (_, old_ids) in fresh.items():
+                local = self.known_recipes[name] = new_ids[name]
+                for old_id in old_ids:
+                    self.recipe_ids[old_id] = local
+        if reused:
+            # Recette déjà présente : ses lignes sont remplacées par celles du fichier
+            _bulk_update(self.db, Recipe, reused, "instructions")
+            for ids in _in_chunks({row["id"] for row in reused}):
+                self.db.execute(delete(RecipeIngredient).where(RecipeIngredient.recipe_id.in_(ids)))
+        lines, seen = [], set()
+        for rec in records:
+            local = self.recipe_ids.get(rec.get("id"))
+            if local is None or local in seen:
+                continue
+            seen.add(local)
+            for line in rec.get("ingredients") or []:
+                ing_id = self.ingredient_ids.get(line.get("ingredient_id"))
+                if ing_id is None:
+                    self.skipped += 1
+                    continue
+                # Quantité canonique recalculée à la fin, selon les unités de la base cible
+                lines.append({"recipe_id": local, "ingredient_id": ing_id, "quantity_required": line.get("quantity"),
+                              "unit": line.get("unit"), "quantity_canonical": None})
+        if lines:
+            self.db.execute(insert(RecipeIngredient.__table__), lines)
+        return len(records)
+
+    def _mapped(self, records, **refs):
+        """Enregistrements dont toutes les références sont connues, IDs remplacés."""
+        for rec in records:
+            mapped = {}
+            for field, mapping in refs.items():
+                mapped[field] = mapping.get(rec.get(field))
+                if mapped[field] is None:
+                    break
+            else:
+                yield rec, mapped
+                continue
+            self.skipped += 1
+
+    def _upsert(self, model, rows, key, values):
+        if not rows:
+            return
+        # Table (et non entité ORM) : les None explicites restent des NULL
+        stmt = dialect_insert(self.db, model.__table__)
+        self.db.execute(stmt.on_conflict_do_update(
+            index_elements=[key], set_={name: getattr(stmt.excluded, name) for name in values}), rows)
+
+    def _pantry(self, records):
+        rows, lots = {}, []
+        for rec, m in self._mapped(records, ingredient_id=self.ingredient_ids):
+            rows[m["ingredient_id"]] = {"ingredient_id": m["ingredient_id"], "quantity_available": rec.get("quantity"),
+                                        "quantity_canonical": None}
+            lots.extend({"ingredient_id": m["ingredient_id"], "quantity_canonical": lot.get("quantity_canonical"),
+                         "source": lot.get("source") or "import",
+                         "purchased_at": _date(lot.get("purchased_at")) or date.today(),
+                         "expires_at": _date(lot.get("expires_at"))}
+                        for lot in rec.get("lots") or [])
+        self._upsert(PantryItem, list(rows.values()), PantryItem.ingredient_id,
+                     ["quantity_available", "quantity_canonical"])
+        # Les lots du fichier remplacent ceux de la cuisine ; sans lots, reconcile_lots en crée un
+        for ids in _in_chunks(rows):
+            self.db.execute(delete(PantryLot).where(PantryLot.ingredient_id.in_(ids)))
+        if lots:
+            self.db.execute(insert(PantryLot.__table__), lots)
+        return len(records)
+
+    def _staples(self, records):
+        rows = {m["ingredient_id"]: {"ingredient_id": m["ingredient_id"], "default_quantity": rec.get("quantity")}
+                for rec, m in self._mapped(records, ingredient_id=self.ingredient_ids)}
+        self._upsert(WeeklyStaple, list(rows.values()), WeeklyStaple.ingredient_id, ["default_quantity"])
+        return len(records)
+
+    def _new_rows(self, model, rows):
+        """Import sans --replace : ne garde d'une clé que les lignes au-delà de celles déjà en base."""
+        if not self.merge or not rows:
+            return rows
+        table = model.__table__
+        columns = self.MERGE_KEYS[table.name]
+        present = self._present.setdefault(table.name, {})
+        seen = self._seen.setdefault(table.name, Counter())
+        key = lambda row: tuple(row[c] for c in columns)
+        unknown = {key(row) for row in rows} - present.keys()
+        if unknown:
+            # Lignes déjà en base pour les clés vues pour la première fois (avant nos propres insertions)
+            cols = [table.c[c] for c in columns]
+            for ids in _in_chunks({k[0] for k in unknown}):
+                for *values, count in self.db.execute(
+                        select(*cols, func.count()).where(cols[0].in_(ids)).group_by(*cols)):
+                    if tuple(values) in unknown:
+                        present[tuple(values)] = count
+            for k in unknown:
+                present.setdefault(k, 0)
+        kept = []
+        for row in rows:
+            k = key(row)
+            seen[k] += 1
+            if seen[k] > present[k]:
+                kept.append(row)
+        self.duplicates += len(rows) - len(kept)
+        return kept
+
+    def _meal_plans(self, records):
+        rows = [{"recipe_id": m["recipe_id"], "slot": rec.get("slot") or "ANY", "date": _date(rec.get("date"))}
+                for rec, m in self._mapped(records, recipe_id=self.recipe_ids)]
+        rows = self._new_rows(MealPlan, rows)
+        if rows:
+            self.db.execute(insert(MealPlan.__table__), rows)
+        return len(records)
+
+    def _shopping(self, records):
+        rows = [{"ingredient_id": m["ingredient_id"], "quantity_needed": rec.get("quantity"),
+                 "quantity_canonical": None, "is_checked": bool(rec.get("is_checked")),
+                 "source": rec.get("source") or "MANUAL"}
+                for rec, m in self._mapped(records, ingredient_id=self.ingredient_ids)]
+        rows = self._new_rows(ShoppingList, rows)
+        if rows:
+            self.db.execute(insert(ShoppingList.__table__), rows)
+        return len(records)
+
+    HANDLERS = {"ingredient": ("ingredients", _ingredients), "recipe": ("recipes", _recipes),
+                "pantry": ("pantry", _pantry), "staple": ("staples", _staples),
+                "meal_plan": ("meal_plans", _meal_plans), "shopping": ("shopping_list", _shopping)}
+
+    # --- BOUCLE PRINCIPALE ---
+    def _flush(self, kind, records):
+        section, handler = self.HANDLERS[kind]
+        self.counts[section] += handler(self, records)
+
+    def run(self, records, replace: bool = False) -> dict:
+        self.merge = not replace
+        if replace:
+            wipe(self.db)
+        self._load_known()
+        kind, pending = None, []
+        for record in records:
+            record_type = record.get("type")
+            if record_type == "header":
+                if record.get("format") != FORMAT or record.get("version", 0) > VERSION:
+                    raise ValueError(f"Format non pris en charge : {record.get('format')} v{record.get('version')}")
+                continue
+            if record_type not in self.HANDLERS:
+                self.skipped += 1
+                continue
+            # Lot vidé à chaque changement de type : les références vers les sections
+            # précédentes sont toujours résolues
+            if pending and (record_type != kind or len(pending) >= IMPORT_CHUNK):
+                self._flush(kind, pending)
+                pending = []
+            kind = record_type
+            pending.append(record)
+        if pending:
+            self._flush(kind, pending)
+        # Quantités canoniques (unités de la base cible) puis demande agrégée, en quelques requêtes
+        units.backfill_canonical(self.db)
+        inventory_logic.reconcile_lots(self.db)
+        demand_logic.rebuild_demand(self.db)
+        changefeed.mark_reset(self.db, *changefeed.WATCHED)
+        self.db.commit()
+        return {**self.counts, "skipped": self.skipped, "duplicates": self.duplicates}
+
+
+def iter_ndjson(lines):
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield orjson.loads(line)
+        except orjson.JSONDecodeError:
+            raise ValueError(f"Ligne {number} : JSON invalide")
+
+
+def import_ndjson(session_factory, lines, replace: bool = False) -> dict:
+    """Importe un flux de lignes NDJSON (fichier ouvert en binaire). Retourne les volumes importés."""
+    db = session_factory()
+    try:
+        return NdjsonImporter(db).run(iter_ndjson(lines), replace=replace)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# --- LIGNE DE COMMANDE ---
+def _open(path, mode):
+    if path == "-":
+        return sys.stdout.buffer if "w" in mode else sys.stdin.buffer
+    return gzip.open(path, mode) if path.endswith(".gz") else open(path, mode)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export / import NDJSON de la cuisine")
+    parser.add_argument("--kitchen", help="identifiant de la cuisine (défaut : DEFAULT_KITCHEN)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="écrit la cuisine dans un fichier NDJSON (.gz pour compresser)")
+    exp.add_argument("path", help="fichier de sortie, - pour la sortie standard")
+    exp.add_argument("--sections", help=f"sous-ensemble de {','.join(SECTIONS)}")
+    imp = sub.add_parser("import", help="importe un fichier NDJSON dans la cuisine")
+    imp.add_argument("path", help="fichier d'entrée, - pour l'entrée standard")
+    imp.add_argument("--replace", action="store_true", help="vide la cuisine avant l'import")
+    args = parser.parse_args(argv)
+
+    import database
+    import services.shards  # noqa: F401 -- import pour son seul effet : enregistre le hook d'initialisation des shards
+    session_factory = database.router.sessionmaker(args.kitchen or database.DEFAULT_KITCHEN)
+    started = datetime.now()
+    if args.command == "export":
+        f = _open(args.path, "wb")
+        try:
+            for block in export_ndjson(session_factory, args.sections):
+                f.write(block)
+        finally:
+            if f is not sys.stdout.buffer:
+                f.close()
+        print(f"Export terminé en {(datetime.now() - started).total_seconds():.1f}s", file=sys.stderr)
+    else:
+        with _open(args.path, "rb") as f:
+            report = import_ndjson(session_factory, f, replace=args.replace)
+        print(f"Import terminé en {(datetime.now() - started).total_seconds():.1f}s : {report}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
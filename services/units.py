@@ -0,0 +1,219 @@
+from typing import Optional, Tuple
+from sqlalchemy import and_, case, exists, func, literal, select, update
+from sqlalchemy.orm import Session
+from models import Ingredient, PantryItem, PantryLot, RecipeIngredient, ShoppingList, WeeklyStaple
+
+# --- TABLE DES UNITÉS ---
+# unité saisie -> (dimension, facteur vers l'unité de base de la dimension)
+# Bases : g (masse), ml (volume), unit (pièces). Une unité inconnue compte comme une pièce.
+UNITS = {
+    "mg": ("mass", 0.001), "g": ("mass", 1.0), "gr": ("mass", 1.0), "gramme": ("mass", 1.0),
+    "grammes": ("mass", 1.0), "kg": ("mass", 1000.0), "kilo": ("mass", 1000.0),
+    "lb": ("mass", 453.592), "oz": ("mass", 28.3495),
+    "ml": ("volume", 1.0), "cl": ("volume", 10.0), "dl": ("volume", 100.0), "l": ("volume", 1000.0),
+    "litre": ("volume", 1000.0), "litres": ("volume", 1000.0),
+    "cc": ("volume", 5.0), "cac": ("volume", 5.0), "tsp": ("volume", 5.0),
+    "cs": ("volume", 15.0), "cas": ("volume", 15.0), "tbsp": ("volume", 15.0),
+    "tasse": ("volume", 250.0), "cup": ("volume", 250.0),
+    "unit": ("count", 1.0), "u": ("count", 1.0), "pc": ("count", 1.0), "pcs": ("count", 1.0),
+    "piece": ("count", 1.0), "pièce": ("count", 1.0), "pièces": ("count", 1.0), "unité": ("count", 1.0),
+}
+BASE_UNITS = {"mass": "g", "volume": "ml", "count": "unit"}
+DEFAULT_UNIT = ("count", 1.0)
+# Profil nécessaire pour passer d'une dimension par les grammes
+PROFILE_FIELDS = {"volume": "densité", "count": "poids d'une pièce"}
+
+
+class ConversionError(ValueError):
+    """Quantité à passer d'une dimension à l'autre sans densité ou poids d'une pièce (400 à l'API)."""
+
+
+def parse_unit(unit: Optional[str]) -> Tuple[str, float]:
+    return UNITS.get((unit or "").strip().lower(), DEFAULT_UNIT)
+
+
+def base_unit(unit: Optional[str]) -> str:
+    return BASE_UNITS[parse_unit(unit)[0]]
+
+
+def _cross_factor(source: str, target: str, density, piece_weight) -> Optional[float]:
+    """Passage d'une base à l'autre : densité en g/ml, poids d'une pièce en g."""
+    if source == target:
+        return 1.0
+    to_grams = {"mass": 1.0, "volume": density, "count": piece_weight}
+    if to_grams[source] is None or not to_grams[target]:
+        return None
+    return to_grams[source] / to_grams[target]
+
+
+def _impossible(source: str, target: str, unit, ingredient_unit) -> ConversionError:
+    missing = " et ".join(PROFILE_FIELDS[dim] for dim in dict.fromkeys((source, target)) if dim in PROFILE_FIELDS)
+    return ConversionError(f"Conversion impossible de « {unit} » vers « {ingredient_unit} » : "
+                           f"{missing} de l'ingrédient à renseigner")
+
+
+def conversion_factor(unit, ingredient_unit, density=None, piece_weight=None) -> float:
+    """
+    Multiplicateur d'une quantité saisie en `unit` vers l'unité canonique de l'ingrédient
+    (base de la dimension de son unité). Lève ConversionError s'il faut changer de
+    dimension sans densité ou poids d'une pièce.
+    """
+    source, factor = parse_unit(unit or ingredient_unit)
+    target = parse_unit(ingredient_unit)[0]
+    cross = _cross_factor(source, target, density, piece_weight)
+    if cross is None:
+        raise _impossible(source, target, unit, ingredient_unit)
+    return factor * cross
+
+
+def to_canonical(quantity, unit, ingredient_unit, density=None, piece_weight=None) -> float:
+    return float(quantity or 0.0) * conversion_factor(unit, ingredient_unit, density, piece_weight)
+
+
+def from_canonical(quantity, ingredient_unit) -> float:
+    """Quantité canonique ré-exprimée dans l'unité d'affichage de l'ingrédient."""
+    return float(quantity or 0.0) / parse_unit(ingredient_unit)[1]
+
+
+def load_profiles(db: Session, ingredient_ids) -> dict:
+    """{ ingredient_id: (unité, densité, poids d'une pièce) } en une requête."""
+    if not ingredient_ids:
+        return {}
+    rows = db.execute(
+        select(Ingredient.id, Ingredient.unit, Ingredient.density, Ingredient.piece_weight)
+        .where(Ingredient.id.in_(list(ingredient_ids)))
+    )
+    return {ing_id: (unit, density, piece_weight) for ing_id, unit, density, piece_weight in rows}
+
+
+# --- ÉQUIVALENTS SQL ---
+def _unit_key(unit_expr):
+    return func.lower(func.trim(func.coalesce(unit_expr, "")))
+
+
+def unit_factor_sql(unit_expr):
+    """Facteur vers la base de la dimension, calculé par la base (CASE sur l'unité)."""
+    return case({name: factor for name, (_, factor) in UNITS.items()}, value=_unit_key(unit_expr),
+                else_=DEFAULT_UNIT[1])
+
+
+def unit_dimension_sql(unit_expr):
+    return case({name: dim for name, (dim, _) in UNITS.items()}, value=_unit_key(unit_expr),
+                else_=DEFAULT_UNIT[0])
+
+
+def conversion_factor_sql(unit_expr, ingredient_unit_expr, density_expr, piece_weight_expr):
+    """Version SQL de conversion_factor, pour les conversions en lot : NULL là où elle lève ConversionError."""
+    unit_expr = func.coalesce(unit_expr, ingredient_unit_expr)
+    source, target = unit_dimension_sql(unit_expr), unit_dimension_sql(ingredient_unit_expr)
+    to_grams = {"mass": literal(1.0), "volume": density_expr, "count": piece_weight_expr}
+    whens = [(source == target, literal(1.0))]
+    for src in to_grams:
+        for dst in to_grams:
+            if src != dst:
+                # Densité ou poids absent (ou nul en diviseur) : NULL
+                whens.append((and_(source == src, target == dst), to_grams[src] / func.nullif(to_grams[dst], 0.0)))
+    return unit_factor_sql(unit_expr) * case(*whens, else_=literal(1.0))
+
+
+def _unconvertible_lines(db: Session, recipe_ids=None, ingredient_ids=None):
+    """Lignes sans quantité canonique (conversion impossible) : [(ingrédient, unité de la ligne, unité de l'ingrédient)]."""
+    query = (
+        select(Ingredient.name, RecipeIngredient.unit, Ingredient.unit)
+        .join(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id)
+        .where(RecipeIngredient.quantity_canonical.is_(None), RecipeIngredient.quantity_required.is_not(None))
+    )
+    if recipe_ids is not None:
+        query = query.where(RecipeIngredient.recipe_id.in_(list(recipe_ids)))
+    if ingredient_ids is not None:
+        query = query.where(RecipeIngredient.ingredient_id.in_(list(ingredient_ids)))
+    return db.execute(query).all()
+
+
+def refresh_recipe_lines(db: Session, recipe_ids=None, only_missing: bool = False, ingredient_ids=None,
+                         strict: bool = True):
+    """
+    Recalcule quantity_canonical des lignes de recette (toutes, ou celles des recettes / ingrédients donnés).
+    strict : une ligne impossible à convertir lève ConversionError (la transaction est à annuler) ;
+    sinon elle garde une quantité canonique NULL et ne compte ni dans la demande ni dans les suggestions.
+    """
+    stmt = (
+        update(RecipeIngredient)
+        .where(RecipeIngredient.ingredient_id == Ingredient.id)
+        .values(quantity_canonical=RecipeIngredient.quantity_required * conversion_factor_sql(
+            RecipeIngredient.unit, Ingredient.unit, Ingredient.density, Ingredient.piece_weight))
+        .returning(RecipeIngredient.quantity_required, RecipeIngredient.quantity_canonical)
+        .execution_options(synchronize_session=False)
+    )
+    if recipe_ids is not None:
+        stmt = stmt.where(RecipeIngredient.recipe_id.in_(list(recipe_ids)))
+    if ingredient_ids is not None:
+        stmt = stmt.where(RecipeIngredient.ingredient_id.in_(list(ingredient_ids)))
+    if only_missing:
+        stmt = stmt.where(RecipeIngredient.quantity_canonical.is_(None))
+    updated = db.execute(stmt).all()
+    # Lignes recalculées à NULL : relues (noms, unités) pour le message d'erreur seulement
+    if strict and any(canonical is None and required is not None for required, canonical in updated):
+        flagged = _unconvertible_lines(db, recipe_ids, ingredient_ids)
+        if flagged:
+            name, unit, ingredient_unit = flagged[0]
+            source, target = parse_unit(unit or ingredient_unit)[0], parse_unit(ingredient_unit)[0]
+            raise ConversionError(f"{name} : {_impossible(source, target, unit, ingredient_unit)}")
+
+
+def backfill_canonical(db: Session):
+    """Migration : remplit en trois UPDATE les quantités canoniques encore vides."""
+    # Données déjà en base ou importées : les lignes impossibles à convertir sont signalées, pas refusées
+    refresh_recipe_lines(db, only_missing=True, strict=False)
+    flagged = _unconvertible_lines(db)
+    if flagged:
+        print(f"{len(flagged)} ligne(s) de recette sans densité ou poids d'une pièce pour être converties : "
+              f"{', '.join(sorted({name for name, _, _ in flagged}))}")
+    # Stock et liste de courses sont exprimés dans l'unité de l'ingrédient
+    for stmt in (
+        update(PantryItem)
+        .where(PantryItem.ingredient_id == Ingredient.id, PantryItem.quantity_canonical.is_(None))
+        .values(quantity_canonical=PantryItem.quantity_available * unit_factor_sql(Ingredient.unit)),
+        update(ShoppingList)
+        .where(ShoppingList.ingredient_id == Ingredient.id, ShoppingList.quantity_canonical.is_(None))
+        .values(quantity_canonical=ShoppingList.quantity_needed * unit_factor_sql(Ingredient.unit)),
+    ):
+        db.execute(stmt.execution_options(synchronize_session=False))
+
+
+def reexpress_ingredient(db: Session, ingredient_id: int, old, new):
+    """
+    Profil de conversion (unité, densité, poids d'une pièce) d'un ingrédient modifié : recalcule
+    les quantités qui en dépendent (lignes de recette, stock et lots, liste de courses, basiques).
+    """
+    (old_dim, old_factor), (new_dim, new_factor) = parse_unit(old[0]), parse_unit(new[0])
+    if (old_dim, old_factor) != (new_dim, new_factor):
+        # Lignes saisies sans unité : elles restent dans l'ancienne unité de l'ingrédient
+        db.execute(update(RecipeIngredient)
+                   .where(RecipeIngredient.ingredient_id == ingredient_id, RecipeIngredient.unit.is_(None))
+                   .values(unit=old[0]).execution_options(synchronize_session=False))
+    refresh_recipe_lines(db, ingredient_ids=[ingredient_id])
+
+    # Stock et liste de courses : même quantité physique, dans la base de la nouvelle unité
+    cross = _cross_factor(old_dim, new_dim, new[1], new[2])
+    if cross is None:
+        if any(db.scalar(select(exists().where(model.ingredient_id == ingredient_id)))
+               for model in (PantryItem, ShoppingList, WeeklyStaple)):
+            raise _impossible(old_dim, new_dim, old[0], new[0])
+        return
+    if cross == 1.0 and old_factor == new_factor:
+        return
+    for stmt in (
+        update(PantryItem).where(PantryItem.ingredient_id == ingredient_id)
+        .values(quantity_canonical=PantryItem.quantity_canonical * cross,
+                quantity_available=PantryItem.quantity_canonical * cross / new_factor),
+        update(PantryLot).where(PantryLot.ingredient_id == ingredient_id)
+        .values(quantity_canonical=PantryLot.quantity_canonical * cross),
+        update(ShoppingList).where(ShoppingList.ingredient_id == ingredient_id)
+        .values(quantity_canonical=ShoppingList.quantity_canonical * cross,
+                quantity_needed=ShoppingList.quantity_canonical * cross / new_factor),
+        # Les basiques sont saisis dans l'unité de l'ingrédient
+        update(WeeklyStaple).where(WeeklyStaple.ingredient_id == ingredient_id)
+        .values(default_quantity=WeeklyStaple.default_quantity * (old_factor * cross / new_factor)),
+    ):
+        db.execute(stmt.execution_options(synchronize_session=False))
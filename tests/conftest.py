@@ -0,0 +1,70 @@
+"""
+Environnement des tests : chaque test a sa propre cuisine (fichier SQLite temporaire,
+initialisé comme à la première ouverture), l'IA est simulée, aucun appel réseau.
+Les variables d'environnement sont fixées avant l'import des modules qui les lisent.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+WORKDIR = tempfile.mkdtemp(prefix="kitchen-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{WORKDIR}/kitchen.db",
+    "KITCHEN_DATABASE_URL": f"sqlite:///{WORKDIR}/kitchens/{{kitchen}}.db",
+    "KITCHEN_SCHEMA": "",
+    "SHARD_MAP_PATH": f"{WORKDIR}/kitchens/shards.json",
+    "SHARD_MAP_TTL": "0",
+    "SHARD_BOOTSTRAP": "full",
+    "SCAN_CACHE_PATH": f"{WORKDIR}/scan_cache.db",
+    "CHANGE_FEED_BROKER": "memory",
+    "JOB_MODE": "thread",
+    "AI_PROVIDER": "fake",
+})
+os.chdir(WORKDIR)  # ingredient_master.json absent : aucun import au démarrage
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+from services import shards  # noqa: E402
+
+_ids = itertools.count(1)
+
+
+@pytest.fixture
+def kitchen():
+    """Cuisine neuve, créée comme par `python -m services.shards create`, et cuisine courante du test."""
+    name = f"test-{next(_ids)}"
+    shards.create(name)
+    token = database.current_kitchen.set(name)
+    yield name
+    database.current_kitchen.reset(token)
+
+
+@pytest.fixture
+def session_factory(kitchen):
+    return database.router.sessionmaker(kitchen)
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    import main
+    from fastapi.testclient import TestClient
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def client(app_client, kitchen):
+    """Client HTTP de l'application, adressé à la cuisine du test."""
+    app_client.headers["X-Kitchen-Id"] = kitchen
+    yield app_client
+    app_client.headers.pop("X-Kitchen-Id", None)
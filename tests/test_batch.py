@@ -0,0 +1,50 @@
+"""Lot d'opérations (POST /api/batch) : rejeu, traces dans batch_operations, purge."""
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from models import BatchOperation, Job, PantryItem
+from services import batch_logic
+
+PANTRY_ADD = {"name": "Riz", "quantity": 500, "unit": "g"}
+
+
+def _batch(client, *operations, atomic=True):
+    response = client.post("/api/batch", json={"operations": list(operations), "atomic": atomic})
+    assert response.status_code == 200, response.text
+    return response.json()["results"]
+
+
+def test_replayed_batch_applies_nothing(client, db):
+    ops = [{"id": "a1", "op": "pantry.add", "args": PANTRY_ADD},
+           {"id": "a2", "op": "pantry.add", "args": {"name": "Lait", "quantity": 1, "unit": "L"}}]
+    first = _batch(client, *ops)
+    again = _batch(client, *ops)
+    assert [r["status"] for r in first] == ["ok", "ok"]
+    assert [r["status"] for r in again] == ["replayed", "replayed"]
+    assert [r["result"] for r in again] == [r["result"] for r in first]
+    quantities = db.execute(select(PantryItem.quantity_available)).scalars().all()
+    assert sorted(quantities) == [1, 500]
+
+
+def test_traces_stay_out_of_jobs(client, db):
+    _batch(client, {"id": "b1", "op": "pantry.add", "args": PANTRY_ADD})
+    assert db.execute(select(func.count()).select_from(Job)).scalar() == 0
+    assert client.get("/api/jobs").json() == []
+    assert db.get(BatchOperation, "b1").op == "pantry.add"
+
+
+def test_reused_id_for_another_operation_is_refused(client):
+    _batch(client, {"id": "c1", "op": "pantry.add", "args": PANTRY_ADD})
+    results = _batch(client, {"id": "c1", "op": "pantry.add", "args": {**PANTRY_ADD, "quantity": 1}}, atomic=False)
+    assert results[0]["status"] == "error" and results[0]["code"] == 422
+
+
+def test_old_traces_are_purged(client, db):
+    _batch(client, {"id": "d1", "op": "pantry.add", "args": PANTRY_ADD})
+    old = datetime.now() - timedelta(hours=batch_logic.BATCH_RETENTION_HOURS + 1)
+    db.get(BatchOperation, "d1").created_at = old
+    db.commit()
+    _batch(client, {"id": "d2", "op": "pantry.add", "args": PANTRY_ADD})
+    db.expire_all()
+    assert db.execute(select(BatchOperation.id)).scalars().all() == ["d2"]
@@ -0,0 +1,122 @@
+"""Cuisson des plans (cook_plans) et passage en caisse (checkout_items), fonctions et routes de lot."""
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+
+from models import MealPlan, PantryItem, PantryLot, ShoppingList
+from services import inventory_logic
+
+PASTA = {"name": "Pâtes tomate", "instructions": "",
+         "ingredients": [{"name": "Pâtes", "quantity": 200, "unit": "g"},
+                         {"name": "Tomate", "quantity": 3, "unit": "unit"}]}
+
+
+def _stock(db):
+    db.expire_all()
+    return {item.ingredient.name: item.quantity_canonical for item in db.execute(select(PantryItem)).scalars()}
+
+
+@pytest.fixture
+def pasta(client):
+    """Recette de pâtes et son stock : 1 kg de pâtes, 5 tomates ; renvoie l'id de la recette."""
+    recipe_id = client.post("/api/recipes", json=PASTA).json()["id"]
+    client.post("/api/pantry/bulk", json=[{"name": "Pâtes", "quantity": 1, "unit": "kg"},
+                                         {"name": "Tomate", "quantity": 5, "unit": "unit"}])
+    return recipe_id
+
+
+def _plan(client, recipe_id):
+    return client.post(f"/api/meal-plan/{recipe_id}").json()["id"]
+
+
+# --- CUISSON ---
+def test_cook_batch_decrements_stock_once_per_plan(client, db, pasta):
+    plans = [_plan(client, pasta), _plan(client, pasta)]
+    response = client.post("/api/meal-plan/cook-batch", json={"plan_ids": plans})
+    assert response.json() == {"status": "success", "cooked": sorted(plans), "not_found": []}
+    # 2 × 200 g de pâtes, 2 × 3 tomates : les tomates (6 > 5) sortent du stock
+    assert _stock(db) == {"Pâtes": pytest.approx(600.0)}
+    assert db.execute(select(MealPlan)).scalars().all() == []
+
+
+def test_cooking_the_same_plan_twice(client, db, pasta):
+    plan = _plan(client, pasta)
+    first = client.post("/api/meal-plan/cook-batch", json={"plan_ids": [plan, plan]}).json()
+    assert first["cooked"] == [plan]
+    again = client.post(f"/api/meal-plan/{plan}/cook")
+    assert again.status_code == 404
+    assert _stock(db) == {"Pâtes": pytest.approx(800.0), "Tomate": pytest.approx(2.0)}
+
+
+def test_cook_batch_reports_not_found(client, db, pasta):
+    plan = _plan(client, pasta)
+    response = client.post("/api/meal-plan/cook-batch", json={"plan_ids": [9999, plan, 9998]}).json()
+    assert response["cooked"] == [plan]
+    assert response["not_found"] == [9998, 9999]
+
+
+def test_cook_plans_without_recipe(db, pasta):
+    # Aucun WHEN pour le CASE des multiplicateurs : la cuisson ne doit pas émettre de CASE vide
+    db.add(MealPlan(recipe_id=None, date=date.today()))
+    db.commit()
+    plan_id = db.execute(select(MealPlan.id)).scalar()
+    cooked, touched = inventory_logic.cook_plans(db, [plan_id])
+    db.commit()
+    assert (cooked, touched) == ([plan_id], [])
+    assert _stock(db) == {"Pâtes": pytest.approx(1000.0), "Tomate": pytest.approx(5.0)}
+
+
+def test_cook_keeps_lots_in_step(client, db, pasta):
+    client.post("/api/meal-plan/cook-batch", json={"plan_ids": [_plan(client, pasta)]})
+    db.expire_all()
+    for item in db.execute(select(PantryItem)).scalars():
+        lots = db.execute(select(PantryLot.quantity_canonical)
+                          .where(PantryLot.ingredient_id == item.ingredient_id)).scalars().all()
+        assert sum(lots) == pytest.approx(item.quantity_canonical)
+
+
+# --- PASSAGE EN CAISSE ---
+@pytest.fixture
+def shopping(client, db, pasta):
+    """Liste : pâtes 500 g (cochées, RECIPE), tomates 2 (cochées, MANUAL), pâtes 250 g (non cochées, STAPLE)."""
+    ids = {name: ing_id for ing_id, name in
+           [(i["id"], i["name"]) for i in client.get("/api/ingredients").json()]}
+    rows = [ShoppingList(ingredient_id=ids["Pâtes"], quantity_needed=500, quantity_canonical=500,
+                         is_checked=True, source="RECIPE"),
+            ShoppingList(ingredient_id=ids["Tomate"], quantity_needed=2, quantity_canonical=2,
+                         is_checked=True, source="MANUAL"),
+            ShoppingList(ingredient_id=ids["Pâtes"], quantity_needed=250, quantity_canonical=250,
+                         is_checked=False, source="STAPLE")]
+    db.add_all(rows)
+    db.commit()
+    return [row.id for row in rows]
+
+
+def test_checkout_moves_checked_items_to_stock(client, db, shopping):
+    assert client.post("/api/shopping-list/checkout").json() == {"status": "success"}
+    assert _stock(db) == {"Pâtes": pytest.approx(1500.0), "Tomate": pytest.approx(7.0)}
+    assert db.execute(select(ShoppingList.id)).scalars().all() == [shopping[2]]
+    checkout_lots = db.execute(select(PantryLot.quantity_canonical).where(PantryLot.source == "checkout")).scalars()
+    assert sorted(checkout_lots) == [2.0, 500.0]
+
+
+def test_checkout_batch_by_ids_and_sources(client, db, shopping):
+    response = client.post("/api/shopping-list/checkout-batch",
+                           json={"item_ids": [shopping[0], shopping[2]], "sources": ["STAPLE"]})
+    assert response.json() == {"status": "success", "stocked": 1}
+    assert _stock(db) == {"Pâtes": pytest.approx(1250.0), "Tomate": pytest.approx(5.0)}
+    assert sorted(db.execute(select(ShoppingList.id)).scalars()) == shopping[:2]
+
+
+def test_checkout_batch_sums_lines_of_one_ingredient(client, db, shopping):
+    response = client.post("/api/shopping-list/checkout-batch", json={"item_ids": [shopping[0], shopping[2]]})
+    assert response.json()["stocked"] == 1
+    assert _stock(db)["Pâtes"] == pytest.approx(1750.0)
+
+
+def test_checkout_replayed_with_idempotency_key(client, db, shopping):
+    headers = {"Idempotency-Key": "caisse-1"}
+    client.post("/api/shopping-list/checkout-batch", json={"sources": ["RECIPE"]}, headers=headers)
+    client.post("/api/shopping-list/checkout-batch", json={"sources": ["RECIPE"]}, headers=headers)
+    assert _stock(db)["Pâtes"] == pytest.approx(1500.0)
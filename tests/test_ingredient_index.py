@@ -0,0 +1,59 @@
+"""Index des noms d'ingrédients (services.ingredient_index) : repliement, préfixes, fautes de frappe."""
+import pytest
+
+from models import Ingredient
+from services.ingredient_index import IngredientIndex, fold
+
+NAMES = ["Crème fraîche", "Crème liquide", "Cresson", "Œuf", "Pâtes", "Pâte feuilletée", "Tomate",
+         "Tomates cerises", "Sauce tomate", "Champignon de Paris", "Mozzarella", "Parmesan"]
+
+
+@pytest.fixture
+def index(db):
+    db.add_all([Ingredient(name=name, category="Divers", unit="g") for name in NAMES])
+    db.commit()
+    return IngredientIndex()
+
+
+def _names(results):
+    return [r["name"] for r in results]
+
+
+def test_fold():
+    assert fold("Crème Fraîche") == "creme fraiche"
+    assert fold("  ŒUF ") == "oeuf"
+    assert fold("Champignon-de-Paris!") == "champignon de paris"
+
+
+def test_accents_and_case_are_ignored(db, index):
+    assert _names(index.search(db, "CREME FRAICHE", 1)) == ["Crème fraîche"]
+    assert index.search(db, "oeuf", 1)[0]["score"] == 1.0
+    assert index.lookup(db, "pates") == index.lookup(db, "PÂTES") is not None
+    assert index.lookup(db, "Pâtes") != index.lookup(db, "Pâte feuilletée")
+
+
+def test_prefix_matches(db, index):
+    # Exact d'abord, puis noms qui commencent par la saisie, puis noms dont un mot commence par elle
+    assert _names(index.search(db, "tomate", 3)) == ["Tomate", "Tomates cerises", "Sauce tomate"]
+    assert _names(index.search(db, "cre", 3)) == ["Crème fraîche", "Crème liquide", "Cresson"]
+    assert [r["score"] for r in index.search(db, "paris", 1)] == [0.8]
+    assert _names(index.search(db, "crème", 1)) == ["Crème fraîche"]  # limite respectée
+
+
+def test_misspelled_query_is_found(db, index):
+    assert _names(index.search(db, "mozarela", 1)) == ["Mozzarella"]
+    assert _names(index.search(db, "parmezan", 1)) == ["Parmesan"]
+    assert index.match(db, "champigon de paris")["name"] == "Champignon de Paris"
+    assert index.match(db, "xyz") is None
+
+
+def test_new_and_renamed_ingredients(db, index):
+    assert index.lookup(db, "basilic") is None
+    db.add(Ingredient(name="Basilic", category="Frais", unit="g"))
+    db.commit()
+    tomato = db.query(Ingredient).filter_by(name="Tomate").one()
+    tomato.name = "Tomate ronde"
+    db.commit()
+    assert index.lookup(db, "basilic") is not None
+    assert index.lookup(db, "tomate") is None
+    assert index.lookup(db, "tomate ronde") == tomato.id
@@ -0,0 +1,40 @@
+"""Jobs en arrière-plan : effets des lots validés rapportés quel que soit le statut final."""
+from concurrent.futures import Future
+
+from sqlalchemy import func, select
+
+from models import Job, PantryItem
+from services import jobs
+from services.suggestion_engine import matrix
+
+
+def _run(kitchen, monkeypatch, db, kind, payload):
+    # Exécution synchrone : le job est créé sans passer par le pool
+    monkeypatch.setattr(jobs.runner, "submit", lambda kitchen, job_id: None)
+    job = jobs.enqueue(db, kitchen, kind, payload)
+    outcome = jobs.execute_job(kitchen, job.id)
+    future = Future()
+    future.set_result(outcome)
+    jobs.runner._finished(kitchen, job.id, future)
+    return outcome
+
+
+def test_pantry_bulk_done_marks_stock(kitchen, db, monkeypatch):
+    items = [{"name": f"produit {i}", "quantity": 1, "unit": "kg"} for i in range(3)]
+    status, _, effects = _run(kitchen, monkeypatch, db, "pantry_bulk", {"items": items})
+    assert status == "done"
+    assert len(effects) == 3
+    assert matrix.get(kitchen)._dirty_stock == set(effects)
+
+
+def test_failed_pantry_bulk_still_reports_committed_chunks(kitchen, db, monkeypatch):
+    items = [{"name": f"produit {i}", "quantity": 1, "unit": "kg"} for i in range(jobs.JOB_CHUNK)]
+    items.append({"name": "illisible", "quantity": "abc", "unit": "kg"})
+    status, _, effects = _run(kitchen, monkeypatch, db, "pantry_bulk", {"items": items})
+    assert status == "error"
+    # Premier lot validé avant l'erreur : il reste en stock et la matrice doit le relire
+    db.expire_all()
+    assert db.scalar(select(func.count()).select_from(PantryItem)) == jobs.JOB_CHUNK
+    assert len(effects) == jobs.JOB_CHUNK
+    assert matrix.get(kitchen)._dirty_stock == set(effects)
+    assert db.scalar(select(Job.done).where(Job.kind == "pantry_bulk")) == jobs.JOB_CHUNK
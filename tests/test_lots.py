@@ -0,0 +1,135 @@
+"""Lots du stock : consommation FEFO (consume_lots) et réalignement sur l'agrégat (reconcile_lots)."""
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import literal, select, union_all
+
+from models import Ingredient, PantryItem, PantryLot
+from services import inventory_logic
+
+TODAY = date.today()
+
+
+def _day(offset):
+    return TODAY + timedelta(days=offset) if offset is not None else None
+
+
+@pytest.fixture
+def rice(db):
+    ingredient = Ingredient(name="Riz", category="Épicerie", unit="g")
+    db.add(ingredient)
+    db.commit()
+    return ingredient.id
+
+
+def _lots(db, ingredient_id, *lots):
+    """Lots (quantité, péremption en jours, achat en jours) et agrégat égal à leur somme."""
+    rows = [PantryLot(ingredient_id=ingredient_id, quantity_canonical=qty, expires_at=_day(expires),
+                      purchased_at=_day(purchased), source="manual") for qty, expires, purchased in lots]
+    db.add_all(rows)
+    db.add(PantryItem(ingredient_id=ingredient_id, quantity_canonical=sum(q for q, _, _ in lots),
+                      quantity_available=sum(q for q, _, _ in lots)))
+    db.commit()
+    return [row.id for row in rows]
+
+
+def _consume(db, **quantities):
+    used = union_all(*[select(literal(ing_id).label("ingredient_id"), literal(qty).label("used"))
+                       for ing_id, qty in quantities.values()]).subquery()
+    inventory_logic.consume_lots(db, used)
+    db.commit()
+    db.expire_all()
+
+
+def _remaining(db, ingredient_id):
+    return dict(db.execute(select(PantryLot.id, PantryLot.quantity_canonical)
+                           .where(PantryLot.ingredient_id == ingredient_id)).all())
+
+
+def test_fefo_order(db, rice):
+    late, soon, undated, soon_older = _lots(db, rice, (100, 5, -1), (100, 2, -1), (100, None, -10), (100, 2, -3))
+    _consume(db, rice=(rice, 150))
+    # Péremption la plus proche d'abord, à égalité le plus ancien achat ; lots sans date en dernier
+    assert _remaining(db, rice) == {soon: 50, late: 100, undated: 100}
+    _consume(db, rice=(rice, 120))
+    assert _remaining(db, rice) == {late: 30, undated: 100}
+
+
+def test_partially_consumed_lot(db, rice):
+    first, second = _lots(db, rice, (100, 1, 0), (100, 3, 0))
+    _consume(db, rice=(rice, 30))
+    assert _remaining(db, rice) == {first: 70, second: 100}
+    _consume(db, rice=(rice, 30))
+    assert _remaining(db, rice) == {first: 40, second: 100}
+
+
+def test_empty_lots_are_deleted(db, rice):
+    first, second = _lots(db, rice, (100, 1, 0), (50, 3, 0))
+    _consume(db, rice=(rice, 100))
+    assert _remaining(db, rice) == {second: 50}
+    _consume(db, rice=(rice, 80))  # plus que le stock : tout est vidé
+    assert _remaining(db, rice) == {}
+
+
+def test_other_ingredients_untouched(db, rice):
+    pasta = Ingredient(name="Pâtes", category="Épicerie", unit="g")
+    db.add(pasta)
+    db.commit()
+    (rice_lot,) = _lots(db, rice, (100, 1, 0))
+    (pasta_lot,) = _lots(db, pasta.id, (200, 1, 0))
+    _consume(db, rice=(rice, 40))
+    assert _remaining(db, rice) == {rice_lot: 60}
+    assert _remaining(db, pasta.id) == {pasta_lot: 200}
+
+
+def test_cooking_keeps_aggregate_equal_to_lots(client, db):
+    recipe = {"name": "Risotto", "instructions": "", "ingredients": [{"name": "Riz", "quantity": 180, "unit": "g"}]}
+    recipe_id = client.post("/api/recipes", json=recipe).json()["id"]
+    client.post("/api/pantry/bulk", json=[{"name": "Riz", "quantity": 100, "unit": "g", "shelf_life_days": 10},
+                                         {"name": "Riz", "quantity": 100, "unit": "g", "shelf_life_days": 2},
+                                         {"name": "Riz", "quantity": 0.5, "unit": "kg"}])
+    plans = [client.post(f"/api/meal-plan/{recipe_id}").json()["id"] for _ in range(2)]
+    client.post("/api/meal-plan/cook-batch", json={"plan_ids": plans})
+    db.expire_all()
+    item = db.execute(select(PantryItem)).scalar_one()
+    lots = db.execute(select(PantryLot.quantity_canonical, PantryLot.expires_at)).all()
+    assert item.quantity_canonical == pytest.approx(700 - 360)
+    assert sum(q for q, _ in lots) == pytest.approx(item.quantity_canonical)
+    # 360 g : le lot à 2 jours puis celui à 10 jours sont vidés, le lot sans date est entamé
+    assert lots == [(pytest.approx(340.0), None)]
+
+
+def test_reconcile_drifted_aggregate(db, rice):
+    lot_ids = _lots(db, rice, (100, 1, 0), (100, 3, 0))
+    pasta, flour = Ingredient(name="Pâtes", category="Épicerie", unit="g"), Ingredient(name="Farine", unit="g")
+    db.add_all([pasta, flour])
+    db.commit()
+    db.add(PantryItem(ingredient_id=pasta.id, quantity_canonical=300, quantity_available=300))  # stock sans lots
+    db.add(PantryLot(ingredient_id=flour.id, quantity_canonical=50, purchased_at=TODAY, source="manual"))  # orphelin
+    db.get(PantryItem, rice).quantity_canonical = 250  # agrégat au-dessus de ses lots
+    db.commit()
+
+    inventory_logic.reconcile_lots(db)
+    db.commit()
+    db.expire_all()
+    rice_lots = _remaining(db, rice)
+    assert {i: rice_lots[i] for i in lot_ids} == {lot_ids[0]: 100, lot_ids[1]: 100}
+    assert sum(rice_lots.values()) == pytest.approx(250)
+    assert list(_remaining(db, pasta.id).values()) == [300]
+    assert _remaining(db, flour.id) == {}
+
+    # Agrégat en dessous de ses lots : lots refaits à partir de l'agrégat
+    db.get(PantryItem, rice).quantity_canonical = 120
+    db.commit()
+    inventory_logic.reconcile_lots(db)
+    db.commit()
+    db.expire_all()
+    assert list(_remaining(db, rice).values()) == [120]
+
+
+def test_reconcile_aligned_stock_changes_nothing(db, rice):
+    lot_ids = _lots(db, rice, (100, 1, 0), (100, 3, 0))
+    inventory_logic.reconcile_lots(db)
+    db.commit()
+    db.expire_all()
+    assert _remaining(db, rice) == dict(zip(lot_ids, [100, 100]))
@@ -0,0 +1,89 @@
+"""Mise à jour des lignes de recette par diff (diff_lines) et demande planifiée qui en découle."""
+import pytest
+from sqlalchemy import select
+
+from models import Ingredient, IngredientDemand
+from services import demand_logic
+from services.recipe_logic import diff_lines
+
+STORED = [(1, 10, 200.0, "g"), (2, 11, 3.0, "unit"), (3, 12, 1.0, "cs")]
+
+
+# --- DIFF ---
+def test_identical_lines():
+    assert diff_lines(STORED, [line[1:] for line in STORED]) == ([], [], [])
+    # L'ordre des lignes ne compte pas
+    assert diff_lines(STORED, [line[1:] for line in reversed(STORED)]) == ([], [], [])
+
+
+def test_changed_line_is_updated_in_place():
+    wanted = [(10, 250.0, "g"), (11, 3.0, "unit"), (12, 1.0, "cc")]
+    assert diff_lines(STORED, wanted) == ([], [(1, 250.0, "g"), (3, 1.0, "cc")], [])
+
+
+def test_added_and_removed_lines():
+    wanted = [(10, 200.0, "g"), (13, 50.0, "ml")]
+    assert diff_lines(STORED, wanted) == ([(13, 50.0, "ml")], [], [2, 3])
+
+
+def test_duplicate_ingredient():
+    stored = [(1, 10, 200.0, "g"), (2, 10, 1.0, "kg")]
+    # Ligne identique gardée, l'autre ligne du même ingrédient modifiée plutôt que remplacée
+    assert diff_lines(stored, [(10, 1.0, "kg"), (10, 300.0, "g")]) == ([], [(1, 300.0, "g")], [])
+    # Une ligne en double de plus : ajoutée
+    assert diff_lines(stored, [(10, 200.0, "g"), (10, 1.0, "kg"), (10, 5.0, "g")]) == ([(10, 5.0, "g")], [], [])
+    # Doublon retiré : la ligne restante de l'ingrédient est supprimée
+    assert diff_lines(stored, [(10, 1.0, "kg")]) == ([], [], [1])
+
+
+# --- DEMANDE APRÈS PUT / PATCH ---
+CREPES = {"name": "Crêpes", "instructions": "",
+          "ingredients": [{"name": "Farine", "quantity": 250, "unit": "g"},
+                          {"name": "Lait", "quantity": 0.5, "unit": "l"},
+                          {"name": "Oeuf", "quantity": 3, "unit": "unit"}]}
+
+
+def _demand(db):
+    db.expire_all()
+    names = dict(db.execute(select(Ingredient.id, Ingredient.name)).all())
+    return {names[d.ingredient_id]: d.planned_qty for d in db.execute(select(IngredientDemand)).scalars()
+            if d.planned_qty}
+
+
+def _rebuilt(db):
+    # Référence : demande recalculée entièrement depuis les plans
+    demand_logic.rebuild_demand(db)
+    db.flush()
+    rebuilt = _demand(db)
+    db.rollback()
+    return rebuilt
+
+
+@pytest.fixture
+def crepes(client):
+    recipe_id = client.post("/api/recipes", json=CREPES).json()["id"]
+    for _ in range(2):
+        client.post(f"/api/meal-plan/{recipe_id}")
+    return recipe_id
+
+
+def test_demand_after_put(client, db, crepes):
+    assert _demand(db) == pytest.approx({"Farine": 500.0, "Lait": 1000.0, "Oeuf": 6.0})
+    recipe = {**CREPES, "ingredients": [{"name": "Farine", "quantity": 300, "unit": "g"},
+                                        {"name": "Oeuf", "quantity": 3, "unit": "unit"},
+                                        {"name": "Sucre", "quantity": 2, "unit": "cs"}]}
+    assert client.put(f"/api/recipes/{crepes}", json=recipe).status_code == 200
+    assert _demand(db) == pytest.approx({"Farine": 600.0, "Oeuf": 6.0, "Sucre": 60.0})
+    assert _demand(db) == pytest.approx(_rebuilt(db))
+
+
+def test_demand_after_patch(client, db, crepes):
+    lines = [{"name": "Farine", "quantity": 250, "unit": "g"}, {"name": "Lait", "quantity": 40, "unit": "cl"},
+             {"name": "Farine", "quantity": 50, "unit": "g"}]
+    assert client.patch(f"/api/recipes/{crepes}", json={"ingredients": lines}).status_code == 200
+    assert _demand(db) == pytest.approx({"Farine": 600.0, "Lait": 800.0})
+    assert _demand(db) == pytest.approx(_rebuilt(db))
+
+    # PATCH sans `ingredients` : lignes et demande inchangées
+    assert client.patch(f"/api/recipes/{crepes}", json={"instructions": "Mélanger."}).status_code == 200
+    assert _demand(db) == pytest.approx({"Farine": 600.0, "Lait": 800.0})
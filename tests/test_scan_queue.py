@@ -0,0 +1,166 @@
+"""File de scans (services.scan_queue) avec FakeGeminiClient : aucun appel réseau."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ai_service  # noqa: E402
+import database  # noqa: E402
+from models import Job  # noqa: E402
+from services.scan_cache import ScanCache, scan_key  # noqa: E402
+from services.scan_queue import KIND, ScanQueue  # noqa: E402
+
+ITEMS = [{"name": "Tomate", "quantity": 1, "unit": "kg"}]
+FIRST, SECOND, THIRD = ai_service.MODEL_CANDIDATES
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    client = ai_service.FakeGeminiClient(items=ITEMS)
+    monkeypatch.setattr(ai_service, "client", client)
+    monkeypatch.setattr(ai_service, "QUOTA_RETRY_DELAY", 0)
+    return client
+
+
+def _get(queue, kitchen, job_id):
+    db = database.router.sessionmaker(kitchen)()
+    try:
+        return queue.get(db, kitchen, job_id)
+    finally:
+        db.close()
+
+
+async def _wait(queue, kitchen, job, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while job["status"] not in ("done", "error"):
+        assert asyncio.get_running_loop().time() < deadline, job
+        await asyncio.sleep(0.01)
+        job = _get(queue, kitchen, job["id"])
+    return job
+
+
+async def _scan(queue, kitchen, image_bytes):
+    return await _wait(queue, kitchen, await queue.submit(kitchen, image_bytes))
+
+
+def _run(queue, scenario):
+    async def main():
+        await queue.start()
+        try:
+            return await scenario()
+        finally:
+            await queue.stop()
+    return asyncio.run(main())
+
+
+def test_scan_success(fake, kitchen):
+    queue = ScanQueue(workers=1)
+    job = _run(queue, lambda: _scan(queue, kitchen, b"ticket"))
+    assert job["status"] == "done"
+    assert job["result"] == ITEMS
+    assert job["attempts"] == [{"model": FIRST, "ok": True}]
+    assert fake.calls == [FIRST]
+
+
+def test_scan_falls_back_to_next_model(fake, kitchen):
+    fake.failures = {FIRST: Exception("500 INTERNAL"), SECOND: Exception("429 RESOURCE_EXHAUSTED")}
+    queue = ScanQueue(workers=1)
+    job = _run(queue, lambda: _scan(queue, kitchen, b"ticket"))
+    assert job["status"] == "done"
+    assert job["model"] == THIRD
+    assert [a["ok"] for a in job["attempts"]] == [False, False, True]
+    assert fake.calls == [FIRST, SECOND, THIRD]
+
+
+def test_scan_error_when_every_model_fails(fake, kitchen):
+    fake.failures = {m: Exception("500 INTERNAL") for m in ai_service.MODEL_CANDIDATES}
+    queue = ScanQueue(workers=1)
+    job = _run(queue, lambda: _scan(queue, kitchen, b"ticket"))
+    assert job["status"] == "error"
+    assert "500" in job["error"]
+    assert len(job["attempts"]) == len(ai_service.MODEL_CANDIDATES)
+
+
+def test_identical_images_share_one_job(fake, kitchen):
+    fake.latency = 0.05
+    queue = ScanQueue(workers=2)
+
+    async def scenario():
+        first = await queue.submit(kitchen, b"ticket")
+        second = await queue.submit(kitchen, b"ticket")
+        assert second["id"] == first["id"]
+        await _wait(queue, kitchen, first)
+        return await _scan(queue, kitchen, b"other")
+
+    _run(queue, scenario)
+    assert len(fake.calls) == 2
+
+
+def test_scan_is_a_job_row_read_by_any_worker(fake, kitchen, db):
+    # Le statut vient de la table jobs : une autre instance (autre worker uvicorn) le lit
+    queue = ScanQueue(workers=1)
+    job = _run(queue, lambda: _scan(queue, kitchen, b"ticket"))
+    row = db.get(Job, job["id"])
+    assert row.kind == KIND and row.status == "done"
+    assert row.payload is None  # image effacée une fois le scan terminé
+    other = _get(ScanQueue(workers=1), kitchen, job["id"])
+    assert other["status"] == "done" and other["result"] == ITEMS
+    assert _get(queue, kitchen, "inconnu") is None
+
+
+def test_pending_scan_survives_restart(fake, kitchen):
+    # Scan reçu par un processus arrêté avant de l'exécuter : repris à l'ouverture de la cuisine
+    stopped = ScanQueue(workers=1)
+    job = asyncio.run(stopped.submit(kitchen, b"ticket"))
+    assert job["status"] == "queued" and fake.calls == []
+
+    queue = ScanQueue(workers=1)
+    queue.resume(database.router.shard(kitchen))
+    job = _run(queue, lambda: _wait(queue, kitchen, job))
+    assert job["status"] == "done" and job["result"] == ITEMS
+    assert fake.calls == [FIRST]
+
+
+def test_cache_memory_then_disk(fake, kitchen, tmp_path):
+    path = str(tmp_path / "scan_cache.db")
+    queue = ScanQueue(workers=1, cache=ScanCache(path=path))
+
+    async def scenario():
+        fresh = await _scan(queue, kitchen, b"ticket")
+        # Écriture disque faite par le pool : attendue avant l'arrêt de la file
+        probe = ScanCache(path=path)
+        for _ in range(500):
+            if probe.load(scan_key(b"ticket")) is not None:
+                break
+            await asyncio.sleep(0.01)
+        return fresh, await _scan(queue, kitchen, b"ticket")
+
+    fresh, again = _run(queue, scenario)
+    assert not fresh["cached"] and again["cached"]
+    assert again["result"] == ITEMS
+    assert queue.cache.stats["memory_hits"] == 1
+
+    # Nouveau processus : mémoire vide, le ticket est relu depuis le fichier
+    other = ScanQueue(workers=1, cache=ScanCache(path=path))
+    job = _run(other, lambda: _scan(other, kitchen, b"ticket"))
+    assert job["cached"] and job["result"] == ITEMS
+    assert other.cache.stats["disk_hits"] == 1
+    assert fake.calls == [FIRST]
+
+
+def test_cancelled_scan_is_not_run(fake, kitchen, db):
+    from services import jobs
+    queue = ScanQueue(workers=1)
+
+    async def scenario():
+        job = await queue.submit(kitchen, b"ticket")
+        jobs.cancel(db, db.get(Job, job["id"]))
+        await asyncio.sleep(0.05)
+        return _get(queue, kitchen, job["id"])
+
+    job = _run(queue, scenario)
+    assert job["status"] == "cancelled"
+    assert fake.calls == []
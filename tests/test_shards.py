@@ -0,0 +1,94 @@
+"""Routage des cuisines vers leur shard, cache LRU des shards ouverts et outillage `python -m services.shards`."""
+import os
+
+import pytest
+
+import database
+from services import shards
+
+
+def _pantry_names(client):
+    return [item["ingredient"]["name"] for item in client.get("/api/pantry").json()]
+
+
+# --- ROUTAGE ---
+def test_each_kitchen_has_its_own_database(client, kitchen):
+    url, schema = database.router.location(kitchen)
+    assert schema == "" and url.endswith(f"/kitchens/{kitchen}.db")
+    assert os.path.exists(url[len("sqlite:///"):])
+
+    other = f"{kitchen}-voisine"
+    shards.create(other)
+    client.post("/api/pantry", json={"name": "Riz", "quantity": 1, "unit": "kg"})
+    assert _pantry_names(client) == ["Riz"]
+    assert client.get("/api/pantry", headers={"X-Kitchen-Id": other}).json() == []
+    # Paramètre `kitchen` (EventSource) équivalent à l'en-tête
+    assert client.get(f"/api/pantry?kitchen={other}", headers={"X-Kitchen-Id": ""}).json() == []
+
+
+def test_unknown_kitchen_is_404(client):
+    response = client.get("/api/pantry", headers={"X-Kitchen-Id": "jamais-creee"})
+    assert response.status_code == 404
+    assert not os.path.exists(database.default_location("jamais-creee")[0][len("sqlite:///"):])
+    assert client.get("/api/pantry", headers={"X-Kitchen-Id": "../etc"}).status_code == 400
+
+
+# --- CACHE LRU ---
+def test_lru_eviction_closes_least_recently_used(kitchen, tmp_path, monkeypatch):
+    names = [kitchen] + [f"{kitchen}-{suffix}" for suffix in ("b", "c")]
+    for name in names[1:]:
+        shards.create(name)
+    closed = []
+    original = database.Shard.close
+    monkeypatch.setattr(database.Shard, "close", lambda shard: closed.append(shard.kitchen) or original(shard))
+
+    router = database.ShardRouter(capacity=2, map_path=str(tmp_path / "shards.json"))
+    first = router.shard(names[0])
+    router.shard(names[1])
+    assert router.shard(names[0]) is first  # réutilisé, et devenu le plus récent
+    router.shard(names[2])
+    assert closed == [names[1]]
+    assert router.open_kitchens() == [names[0], names[2]]
+    # Cuisine évincée : rouverte à la demande
+    assert router.shard(names[1]).engine is not None
+    assert closed == [names[1], names[0]]
+
+
+# --- OUTILLAGE ---
+def test_create_cli(kitchen, capsys):
+    name = f"{kitchen}-cli"
+    assert shards.main(["create", name]) == 0
+    assert "créée" in capsys.readouterr().out
+    assert database.router.exists(name)
+    with pytest.raises(ValueError, match="existe déjà"):
+        shards.main(["create", name])
+    with pytest.raises(ValueError, match="invalide"):
+        shards.create("Pas Valide")
+    shards.main(["list"])
+    assert name in capsys.readouterr().out
+
+
+def test_move_cli(client, kitchen, tmp_path, monkeypatch):
+    monkeypatch.setattr(shards, "MOVE_GRACE", 0)
+    client.post("/api/pantry", json={"name": "Riz", "quantity": 1, "unit": "kg"})
+    target = f"sqlite:///{tmp_path}/archive/{{kitchen}}.db"
+    assert shards.main(["move", kitchen, target]) == 0
+
+    url = target.format(kitchen=kitchen)
+    assert database.read_shard_map()[kitchen] == {"url": url, "schema": ""}
+    assert database.router.location(kitchen) == (url, "")
+    # Données servies depuis le nouvel emplacement ; l'ancienne base est conservée
+    assert _pantry_names(client) == ["Riz"]
+    assert os.path.exists(database.default_location(kitchen)[0][len("sqlite:///"):])
+
+
+def test_moving_kitchen_is_503(client, kitchen):
+    url, schema = database.router.location(kitchen)
+    shards._set_entry(kitchen, {"url": url, "schema": schema, "moving": True})
+    try:
+        response = client.get("/api/pantry")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "5"
+    finally:
+        shards._set_entry(kitchen, None)
+    assert client.get("/api/pantry").status_code == 200
@@ -0,0 +1,100 @@
+"""Suggestions de recettes (RecipeMatrix) : calcul vectorisé comparé à un calcul naïf, rechargement inter-processus."""
+import os
+import random
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from models import Ingredient, PantryItem, Recipe, RecipeIngredient
+from services.suggestion_engine import EPSILON, RecipeMatrix
+
+
+@pytest.fixture
+def kitchen_data(db):
+    """40 recettes de 0 à 6 lignes sur 15 ingrédients, stock partiel ; lignes à quantité nulle incluses."""
+    rng = random.Random(7)
+    ingredients = [Ingredient(name=f"Ingrédient {i}", category=rng.choice(["Frais", "Épicerie"]), unit="g")
+                   for i in range(15)]
+    db.add_all(ingredients)
+    db.flush()
+    recipes = {}
+    for r in range(40):
+        recipe = Recipe(name=f"Recette {r}", instructions="")
+        db.add(recipe)
+        db.flush()
+        lines = {ing.id: rng.choice([0.0, 50.0, 100.0, 250.0, 1000.0])
+                 for ing in rng.sample(ingredients, rng.randint(0, 6))}
+        for ing_id, qty in lines.items():
+            db.add(RecipeIngredient(recipe_id=recipe.id, ingredient_id=ing_id, quantity_required=qty,
+                                    unit="g", quantity_canonical=qty))
+        recipes[recipe.id] = lines
+    stock = {ing.id: rng.choice([0.0, 50.0, 120.0, 500.0, 5000.0]) for ing in rng.sample(ingredients, 10)}
+    db.add_all([PantryItem(ingredient_id=i, quantity_canonical=q, quantity_available=q) for i, q in stock.items()])
+    db.commit()
+    return recipes, stock, {ing.id: ing.category for ing in ingredients}
+
+
+def _naive(lines, stock):
+    # Une recette à la fois, ligne à ligne
+    in_stock = sum(1 for i, req in lines.items() if stock.get(i, 0.0) + EPSILON >= req)
+    missing_qty = sum(max(req - stock.get(i, 0.0), 0.0) for i, req in lines.items())
+    servings = min(((stock.get(i, 0.0) + EPSILON) // req for i, req in lines.items() if req > 0), default=0)
+    return {"match_percentage": in_stock / len(lines) * 100.0, "missing_items": len(lines) - in_stock,
+            "missing_quantity": missing_qty, "cookable_servings": int(servings)}
+
+
+def test_vectorized_scores_match_naive(db, kitchen_data):
+    recipes, stock, _ = kitchen_data
+    suggestions = RecipeMatrix().suggest(db)
+    assert {s["recipe_id"] for s in suggestions} == {r for r, lines in recipes.items() if lines}
+    for s in suggestions:
+        expected = _naive(recipes[s["recipe_id"]], stock)
+        assert {k: s[k] for k in expected} == pytest.approx(expected), s["recipe_name"]
+    ranking = [(-s["match_percentage"], -s["cookable_servings"], s["missing_quantity"]) for s in suggestions]
+    assert ranking == sorted(ranking)
+
+
+def test_filters_match_naive(db, kitchen_data):
+    recipes, stock, categories = kitchen_data
+    matrix = RecipeMatrix()
+    few_missing = {s["recipe_id"] for s in matrix.suggest(db, max_missing=1)}
+    assert few_missing == {r for r, lines in recipes.items() if lines and _naive(lines, stock)["missing_items"] <= 1}
+    fresh = {s["recipe_id"] for s in matrix.suggest(db, category="Frais")}
+    # Une ligne à quantité nulle (« sel à volonté ») ne fait pas entrer la recette dans la catégorie
+    assert fresh == {r for r, lines in recipes.items() if any(categories[i] == "Frais" and q for i, q in lines.items())}
+    assert len(matrix.suggest(db, limit=5)) == 5
+
+
+def test_signalled_stock_change(db, kitchen_data):
+    recipes, stock, _ = kitchen_data
+    matrix = RecipeMatrix()
+    matrix.suggest(db)
+    ing_id = next(iter(stock))
+    db.get(PantryItem, ing_id).quantity_canonical = stock[ing_id] = 0.0
+    db.commit()
+    matrix.stock_changed([ing_id])
+    for s in matrix.suggest(db):
+        assert s["missing_items"] == _naive(recipes[s["recipe_id"]], stock)["missing_items"]
+
+
+def test_write_from_another_process_triggers_reload(client, kitchen):
+    recipe = {"name": "Pain", "instructions": "", "ingredients": [{"name": "Farine", "quantity": 500, "unit": "g"}]}
+    client.post("/api/recipes", json=recipe)
+    assert client.get("/api/recipes/suggestions").json()[0]["cookable_servings"] == 0
+
+    # Autre processus (worker, job, ligne de commande) : aucun signalement reçu par ce processus
+    script = textwrap.dedent(f"""
+        import database
+        import services.shards  # noqa: F401
+        from services import inventory_logic
+        db = database.router.sessionmaker({kitchen!r})()
+        inventory_logic.add_pantry_entries(db, [{{"name": "Farine", "quantity": 1, "unit": "kg"}}])
+        db.commit()
+    """)
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [repo, os.environ.get("PYTHONPATH")]))}
+    subprocess.run([sys.executable, "-c", script], check=True, env=env, cwd=os.getcwd())
+
+    assert client.get("/api/recipes/suggestions").json()[0]["cookable_servings"] == 2
@@ -0,0 +1,96 @@
+"""Export / import NDJSON (services.transfer) entre cuisines temporaires."""
+import itertools
+
+import orjson
+import pytest
+
+import database
+from services import shards, transfer
+
+_copies = itertools.count(1)
+
+
+@pytest.fixture
+def filled(client, session_factory):
+    """Cuisine source : recettes, stock en lots, basique, plans et liste de courses."""
+    recipe = {"name": "Crêpes", "instructions": "Mélanger.",
+              "ingredients": [{"name": "Farine", "quantity": 250, "unit": "g"},
+                              {"name": "Lait", "quantity": 50, "unit": "cl"}]}
+    recipe_id = client.post("/api/recipes", json=recipe).json()["id"]
+    client.post("/api/recipes", json={"name": "Omelette", "instructions": "",
+                                      "ingredients": [{"name": "Oeuf", "quantity": 3, "unit": "unit"}]})
+    client.post("/api/pantry/bulk", json=[{"name": "Farine", "quantity": 1, "unit": "kg", "shelf_life_days": 90},
+                                         {"name": "Farine", "quantity": 200, "unit": "g"},
+                                         {"name": "Oeuf", "quantity": 6, "unit": "unit"}])
+    eggs = next(i["id"] for i in client.get("/api/ingredients").json() if i["name"] == "Oeuf")
+    client.put(f"/api/staples/{eggs}", json={"default_quantity": 12})
+    client.post(f"/api/meal-plan/{recipe_id}?date=2026-10-20&slot=dinner")
+    client.post(f"/api/meal-plan/{recipe_id}?date=2026-10-21&slot=lunch")
+    client.post("/api/shopping-list/generate")
+    return session_factory
+
+
+def _export(session_factory):
+    return b"".join(transfer.export_ndjson(session_factory))
+
+
+def _snapshot(session_factory):
+    """Contenu de la cuisine par noms (les IDs diffèrent d'une cuisine à l'autre)."""
+    records = [orjson.loads(line) for line in _export(session_factory).splitlines()]
+    names = {r["id"]: r["name"] for r in records if r["type"] == "ingredient"}
+    recipes = {r["id"]: r["name"] for r in records if r["type"] == "recipe"}
+    snapshot = []
+    for r in records:
+        if r["type"] == "header":
+            continue
+        r = {k: v for k, v in r.items() if k != "id"}
+        if "ingredient_id" in r:
+            r["ingredient_id"] = names[r["ingredient_id"]]
+        if "recipe_id" in r:
+            r["recipe_id"] = recipes[r["recipe_id"]]
+        if r["type"] == "recipe":
+            r["ingredients"] = [{**line, "ingredient_id": names[line["ingredient_id"]]} for line in r["ingredients"]]
+        snapshot.append(r)
+    return sorted(snapshot, key=lambda r: orjson.dumps(r, option=orjson.OPT_SORT_KEYS))
+
+
+def _other_kitchen(kitchen):
+    name = f"{kitchen}-copie-{next(_copies)}"
+    shards.create(name)
+    return database.router.sessionmaker(name)
+
+
+def test_round_trip(filled, kitchen):
+    target = _other_kitchen(kitchen)
+    report = transfer.import_ndjson(target, _export(filled).splitlines())
+    assert report["ingredients"] == 3 and report["recipes"] == 2 and report["meal_plans"] == 2
+    assert _snapshot(target) == _snapshot(filled)
+
+
+def test_merge_reimport_changes_nothing(filled):
+    before = _snapshot(filled)
+    report = transfer.import_ndjson(filled, _export(filled).splitlines())
+    assert report["duplicates"] > 0
+    assert _snapshot(filled) == before
+
+
+def test_failed_import_rolls_back(filled, kitchen):
+    target = _other_kitchen(kitchen)
+    transfer.import_ndjson(target, _export(filled).splitlines())
+    before = _snapshot(target)
+    lines = _export(filled).splitlines()
+    lines = lines[:1] + [orjson.dumps({"type": "ingredient", "id": 999, "name": "Sel", "category": "Épicerie",
+                                       "unit": "g", "density": None, "piece_weight": None})] + lines[1:] + [b"{oups"]
+    for replace in (False, True):
+        with pytest.raises(ValueError, match="JSON invalide"):
+            transfer.import_ndjson(target, lines, replace=replace)
+        # Rien n'est gardé, --replace compris (la cuisine n'a pas été vidée)
+        assert _snapshot(target) == before
+
+
+def test_unsupported_format_is_refused(filled):
+    before = _snapshot(filled)
+    header = orjson.dumps({"type": "header", "format": transfer.FORMAT, "version": transfer.VERSION + 1})
+    with pytest.raises(ValueError, match="Format non pris en charge"):
+        transfer.import_ndjson(filled, [header], replace=True)
+    assert _snapshot(filled) == before
@@ -0,0 +1,92 @@
+"""Conversions d'unités (services.units) : facteurs Python et SQL, ré-expression après PATCH d'un ingrédient."""
+import pytest
+from sqlalchemy import Float, String, literal, select
+
+from models import PantryItem, PantryLot, RecipeIngredient, ShoppingList, WeeklyStaple
+from services import units
+
+INGREDIENT_UNITS = ["g", "kg", "ml", "L", "unit", None]
+PROFILES = [(None, None), (1.03, None), (None, 60.0), (0.9, 120.0), (0.0, 0.0)]
+
+
+@pytest.mark.parametrize("density,piece_weight", PROFILES)
+def test_sql_factor_mirrors_python(db, density, piece_weight):
+    for ingredient_unit in INGREDIENT_UNITS:
+        for unit in list(units.UNITS) + ["boîte", " KG ", None]:
+            try:
+                expected = units.conversion_factor(unit, ingredient_unit, density, piece_weight)
+            except units.ConversionError:
+                expected = None
+            factor = db.execute(select(units.conversion_factor_sql(
+                literal(unit, String), literal(ingredient_unit, String),
+                literal(density, Float), literal(piece_weight, Float),
+            ))).scalar()
+            assert factor == pytest.approx(expected), (unit, ingredient_unit, density, piece_weight)
+
+
+def test_cross_dimension_needs_a_profile():
+    assert units.conversion_factor("l", "kg", density=1.03) == pytest.approx(1030.0)
+    assert units.conversion_factor("unit", "g", piece_weight=60.0) == pytest.approx(60.0)
+    with pytest.raises(units.ConversionError, match="densité"):
+        units.conversion_factor("l", "kg")
+    with pytest.raises(units.ConversionError, match="poids d'une pièce"):
+        units.conversion_factor("unit", "g", density=1.0)
+
+
+# --- PATCH /api/ingredients/{id} ---
+@pytest.fixture
+def milk(client, db):
+    """Lait en litres : 2 L en stock, 1 L à acheter, basique d'1 L, recette de 500 ml."""
+    ingredient_id = client.post("/api/ingredients", json={"name": "Lait", "unit": "L"}).json()["id"]
+    assert client.post("/api/pantry", json={"name": "Lait", "quantity": 2, "unit": "L"}).status_code == 200
+    assert client.put(f"/api/staples/{ingredient_id}", json={"default_quantity": 1}).status_code == 200
+    db.add(ShoppingList(ingredient_id=ingredient_id, quantity_needed=1.0, quantity_canonical=1000.0,
+                        is_checked=False, source="MANUAL"))
+    db.commit()
+    recipe = {"name": "Crêpes", "instructions": "", "ingredients": [{"name": "Lait", "quantity": 500, "unit": "ml"}]}
+    assert client.post("/api/recipes", json=recipe).status_code == 200
+    return ingredient_id
+
+
+def _quantities(db, ingredient_id):
+    db.expire_all()
+    pantry = db.get(PantryItem, ingredient_id)
+    shopping = db.execute(select(ShoppingList).where(ShoppingList.ingredient_id == ingredient_id)).scalar_one()
+    lots = db.execute(select(PantryLot.quantity_canonical).where(PantryLot.ingredient_id == ingredient_id)).scalars()
+    line = db.execute(select(RecipeIngredient.quantity_canonical)
+                      .where(RecipeIngredient.ingredient_id == ingredient_id)).scalar_one()
+    return {
+        "stock": (pantry.quantity_available, pantry.quantity_canonical), "lots": sorted(lots),
+        "shopping": (shopping.quantity_needed, shopping.quantity_canonical),
+        "staple": db.get(WeeklyStaple, ingredient_id).default_quantity, "line": line,
+    }
+
+
+def test_patch_same_dimension_keeps_canonical(client, db, milk):
+    assert client.patch(f"/api/ingredients/{milk}", json={"unit": "cl"}).status_code == 200
+    assert _quantities(db, milk) == pytest.approx({
+        "stock": (200.0, 2000.0), "lots": [2000.0], "shopping": (100.0, 1000.0), "staple": 100.0, "line": 500.0,
+    })
+
+
+def test_patch_to_mass_with_density(client, db, milk):
+    response = client.patch(f"/api/ingredients/{milk}", json={"unit": "kg", "density": 1.03})
+    assert response.status_code == 200, response.text
+    assert _quantities(db, milk) == pytest.approx({
+        "stock": (2.06, 2060.0), "lots": [2060.0], "shopping": (1.03, 1030.0), "staple": 1.03, "line": 515.0,
+    })
+
+
+def test_patch_to_mass_without_density_is_refused(client, db, milk):
+    before = _quantities(db, milk)
+    response = client.patch(f"/api/ingredients/{milk}", json={"unit": "kg"})
+    assert response.status_code == 400
+    assert "densité" in response.json()["detail"]
+    assert _quantities(db, milk) == before
+    assert client.get("/api/ingredients").json()[0]["unit"] == "L"
+
+
+def test_pantry_entry_in_another_dimension_is_refused(client, milk):
+    response = client.post("/api/pantry", json={"name": "Lait", "quantity": 3, "unit": "pièce"})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Lait : ")